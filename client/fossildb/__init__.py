@@ -0,0 +1,52 @@
+"""Asynchronous FossilDB client built on grpc.aio.
+
+Usage:
+
+    async with AsyncFossilDBClient("localhost:7155") as client:
+        versions = await client.list_versions("volumeData", key)
+
+BatchingWriter and BatchingReader collect single puts and gets into bulk requests:
+
+    async with BatchingWriter(client, "volumeData") as writer:
+        for key, version, value in records:
+            writer.put(key, version, value)
+
+The generated protobuf modules are expected next to this package, run update_api.sh to create them.
+"""
+
+from .batching import BatchingReader, BatchingWriter
+from .client import AsyncFossilDBClient, FossilDBError, RetryPolicy
+from .pool import ChannelPool
+from .types import (
+    BackupInfo,
+    BackupJobStatus,
+    CacheStats,
+    CompressionStats,
+    ExportStatus,
+    KeyCount,
+    KeyVersions,
+    ReadCacheStats,
+    SnapshotToken,
+    VersionedKeyValue,
+    VersionedValue,
+)
+
+__all__ = [
+    "AsyncFossilDBClient",
+    "BackupInfo",
+    "BackupJobStatus",
+    "BatchingReader",
+    "BatchingWriter",
+    "CacheStats",
+    "ChannelPool",
+    "CompressionStats",
+    "ExportStatus",
+    "FossilDBError",
+    "KeyCount",
+    "KeyVersions",
+    "ReadCacheStats",
+    "RetryPolicy",
+    "SnapshotToken",
+    "VersionedKeyValue",
+    "VersionedValue",
+]
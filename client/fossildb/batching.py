@@ -0,0 +1,222 @@
+import abc
+import asyncio
+from typing import Optional
+
+import grpc
+
+from .client import AsyncFossilDBClient
+from .pool import MAX_MESSAGE_LENGTH, is_message_too_large
+from .types import VersionedKeyValue, VersionedValue
+
+# Room for the collection name and the framing of the request
+_REQUEST_OVERHEAD = 64 * 1024
+# Upper bound of the framing of one entry: field tags, length prefixes and the version
+_ENTRY_OVERHEAD = 32
+
+
+class _Batcher(abc.ABC):
+    """Buffers items and sends them in batches once max_items or max_bytes are reached, or
+    max_delay seconds after the first buffered item. At most max_concurrent_batches are sent
+    at the same time, further batches wait.
+    """
+
+    def __init__(
+        self,
+        max_items: int,
+        max_bytes: int,
+        max_delay: float,
+        max_concurrent_batches: int,
+    ):
+        if max_items < 1:
+            raise ValueError("batches must hold at least one item")
+        max_request_bytes = MAX_MESSAGE_LENGTH - _REQUEST_OVERHEAD
+        if not 0 < max_bytes <= max_request_bytes:
+            raise ValueError(f"max_bytes must be between 1 and {max_request_bytes}")
+        if max_concurrent_batches < 1:
+            raise ValueError("at least one batch must be sent at a time")
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(max_concurrent_batches)
+        self._items: list = []
+        self._bytes = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+        self._closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def _add(self, item, size: int) -> None:
+        if self._closed:
+            raise RuntimeError("the batcher is closed")
+        if size > self.max_bytes:
+            raise ValueError(f"item of {size} bytes exceeds max_bytes {self.max_bytes}")
+        if self._bytes + size > self.max_bytes:
+            self._send_buffered()
+        self._items.append(item)
+        self._bytes += size
+        if len(self._items) >= self.max_items:
+            self._send_buffered()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.max_delay, self._send_buffered
+            )
+
+    def _send_buffered(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._items:
+            return
+        items, self._items, self._bytes = self._items, [], 0
+        task = asyncio.ensure_future(self._send_limited(items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_limited(self, items: list) -> None:
+        async with self._semaphore:
+            try:
+                await self._send(items)
+            except asyncio.CancelledError:
+                for item in items:
+                    item.future.cancel()
+                raise
+            except Exception as e:
+                for item in items:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+
+    @abc.abstractmethod
+    async def _send(self, items: list) -> None:
+        """Sends one batch and completes the futures of its items."""
+
+    async def flush(self) -> None:
+        """Sends the buffered items and waits until all batches are done. Failed batches
+        only fail the futures of their items."""
+        self._send_buffered()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def close(self) -> None:
+        await self.flush()
+        self._closed = True
+
+
+class _PendingPut:
+    __slots__ = ("entry", "future")
+
+    def __init__(self, entry: VersionedKeyValue, future: asyncio.Future):
+        self.entry = entry
+        self.future = future
+
+
+class _PendingGet:
+    __slots__ = ("key", "future")
+
+    def __init__(self, key: str, future: asyncio.Future):
+        self.key = key
+        self.future = future
+
+
+class BatchingWriter(_Batcher):
+    """Collects puts to one collection into PutMultipleKeysWithMultipleVersions requests.
+
+    Usage:
+
+        async with BatchingWriter(client, "volumeData") as writer:
+            for key, version, value in records:
+                writer.put(key, version, value)
+
+    put returns a future that completes once the batch of the entry is written, or fails with
+    the error of the batch. Leaving the context flushes the remaining puts. Each batch is one
+    atomic write on the server. Batches are sent in the background, a producer that is faster
+    than the server should await the futures or flush from time to time.
+    """
+
+    def __init__(
+        self,
+        client: AsyncFossilDBClient,
+        collection: str,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_delay: float = 0.05,
+        max_concurrent_batches: int = 4,
+    ):
+        super().__init__(max_entries, max_bytes, max_delay, max_concurrent_batches)
+        self.client = client
+        self.collection = collection
+
+    def put(self, key: str, version: int, value: bytes) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        entry = VersionedKeyValue(key, version, value)
+        self._add(
+            _PendingPut(entry, future),
+            len(key.encode()) + len(value) + _ENTRY_OVERHEAD,
+        )
+        return future
+
+    async def _send(self, items: list) -> None:
+        await self.client.put_multiple_keys_with_multiple_versions(
+            self.collection, [item.entry for item in items]
+        )
+        for item in items:
+            if not item.future.done():
+                item.future.set_result(None)
+
+
+class BatchingReader(_Batcher):
+    """Collects lookups of the newest version (not newer than version) of keys of one
+    collection into GetMultipleKeysByList requests.
+
+    get returns a future of the value, None if the key has no matching version. Identical
+    keys in a batch are requested once. max_bytes bounds the request, which only holds the
+    keys. The reply holds all values of the batch and is limited to MAX_MESSAGE_LENGTH as
+    well: a batch whose reply exceeds it is split in halves, which are requested one after
+    the other, down to single keys. Only a single value above the limit fails its future.
+    """
+
+    def __init__(
+        self,
+        client: AsyncFossilDBClient,
+        collection: str,
+        version: Optional[int] = None,
+        snapshot: Optional[int] = None,
+        max_keys: int = 1000,
+        max_bytes: int = 16 * 1024 * 1024,
+        max_delay: float = 0.005,
+        max_concurrent_batches: int = 4,
+    ):
+        super().__init__(max_keys, max_bytes, max_delay, max_concurrent_batches)
+        self.client = client
+        self.collection = collection
+        self.version = version
+        self.snapshot = snapshot
+
+    def get(self, key: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._add(_PendingGet(key, future), len(key.encode()) + _ENTRY_OVERHEAD)
+        return future
+
+    async def _send(self, items: list) -> None:
+        by_key = await self._get(list(dict.fromkeys(item.key for item in items)))
+        for item in items:
+            if not item.future.done():
+                item.future.set_result(by_key[item.key])
+
+    async def _get(self, keys: list[str]) -> dict[str, Optional[VersionedValue]]:
+        try:
+            values = await self.client.get_multiple_keys_by_list(
+                self.collection, keys, version=self.version, snapshot=self.snapshot
+            )
+        except grpc.aio.AioRpcError as e:
+            if len(keys) == 1 or not is_message_too_large(e):
+                raise
+            half = len(keys) // 2
+            by_key = await self._get(keys[:half])
+            by_key.update(await self._get(keys[half:]))
+            return by_key
+        return dict(zip(keys, values))
@@ -0,0 +1,569 @@
+import asyncio
+import contextlib
+import random
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, Optional
+
+import grpc
+
+from . import fossildbapi_pb2 as proto
+from .pool import ChannelPool, is_message_too_large
+from .types import (
+    BackupInfo,
+    BackupJobStatus,
+    CacheStats,
+    CompressionStats,
+    ExportStatus,
+    KeyCount,
+    KeyVersions,
+    ReadCacheStats,
+    SnapshotToken,
+    VersionedKeyValue,
+    VersionedValue,
+)
+
+
+class FossilDBError(Exception):
+    """The server answered, but reported that the request failed."""
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Exponential backoff with full jitter for calls that failed with one of retryable_codes.
+
+    The default codes are returned before the server processed the request (no connection,
+    or the request was rejected because the server is overloaded), so retrying them is
+    safe for writes as well. Messages above the size limit are not retried, as they would
+    fail again.
+    """
+
+    max_attempts: int = 5
+    initial_backoff: float = 0.1
+    max_backoff: float = 5.0
+    multiplier: float = 2.0
+    retryable_codes: tuple = (
+        grpc.StatusCode.UNAVAILABLE,
+        grpc.StatusCode.RESOURCE_EXHAUSTED,
+    )
+
+    def retryable(self, error: grpc.aio.AioRpcError) -> bool:
+        return error.code() in self.retryable_codes and not is_message_too_large(error)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(
+            0, min(self.max_backoff, self.initial_backoff * self.multiplier**attempt)
+        )
+
+
+class AsyncFossilDBClient:
+    """Typed async access to all FossilDB RPCs over a pool of grpc.aio channels.
+
+    At most max_concurrency calls are in flight at any time, further calls wait for a free
+    slot. Failed calls are retried according to retry_policy, replies with success=false
+    raise a FossilDBError. Create the client from within the event loop that uses it.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        pool_size: int = 4,
+        max_concurrency: int = 256,
+        retry_policy: RetryPolicy = RetryPolicy(),
+        timeout: Optional[float] = None,
+    ):
+        self.pool = ChannelPool(host, pool_size)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.retry_policy = retry_policy
+        self.timeout = timeout
+
+    async def __aenter__(self) -> "AsyncFossilDBClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    async def _call(self, method: str, request):
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    rpc = getattr(self.pool.stub(), method)
+                    reply = await rpc(request, timeout=self.timeout)
+            except grpc.aio.AioRpcError as e:
+                attempt += 1
+                if (
+                    not self.retry_policy.retryable(e)
+                    or attempt >= self.retry_policy.max_attempts
+                ):
+                    raise
+                await asyncio.sleep(self.retry_policy.backoff(attempt - 1))
+                continue
+            if not reply.success:
+                raise FossilDBError(reply.errorMessage)
+            return reply
+
+    async def health(self) -> None:
+        await self._call("Health", proto.HealthRequest())
+
+    async def get(
+        self,
+        collection: str,
+        key: str,
+        version: Optional[int] = None,
+        may_be_empty: bool = False,
+    ) -> Optional[VersionedValue]:
+        """The newest version of key not newer than version. If may_be_empty is set, a missing key yields None."""
+        try:
+            reply = await self._call(
+                "Get",
+                proto.GetRequest(
+                    collection=collection,
+                    key=key,
+                    version=version,
+                    mayBeEmpty=may_be_empty,
+                ),
+            )
+        except FossilDBError as e:
+            if may_be_empty and str(e) == "No such element":
+                return None
+            raise
+        return VersionedValue(reply.actualVersion, reply.value)
+
+    async def get_multiple_versions(
+        self,
+        collection: str,
+        key: str,
+        newest_version: Optional[int] = None,
+        oldest_version: Optional[int] = None,
+    ) -> list[VersionedValue]:
+        reply = await self._call(
+            "GetMultipleVersions",
+            proto.GetMultipleVersionsRequest(
+                collection=collection,
+                key=key,
+                newestVersion=newest_version,
+                oldestVersion=oldest_version,
+            ),
+        )
+        return [
+            VersionedValue(version, value)
+            for version, value in zip(reply.versions, reply.values)
+        ]
+
+    async def get_multiple_keys(
+        self,
+        collection: str,
+        start_after_key: Optional[str] = None,
+        prefix: Optional[str] = None,
+        version: Optional[int] = None,
+        limit: Optional[int] = None,
+        snapshot: Optional[int] = None,
+    ) -> list[VersionedKeyValue]:
+        reply = await self._call(
+            "GetMultipleKeys",
+            proto.GetMultipleKeysRequest(
+                collection=collection,
+                startAfterKey=start_after_key,
+                prefix=prefix,
+                version=version,
+                limit=limit,
+                snapshot=snapshot,
+            ),
+        )
+        return [
+            VersionedKeyValue(key, version, value)
+            for key, version, value in zip(
+                reply.keys, reply.actualVersions, reply.values
+            )
+        ]
+
+    async def get_multiple_keys_by_list(
+        self,
+        collection: str,
+        keys: list[str],
+        version: Optional[int] = None,
+        snapshot: Optional[int] = None,
+    ) -> list[Optional[VersionedValue]]:
+        """One entry per requested key, None for keys without a matching version."""
+        reply = await self._call(
+            "GetMultipleKeysByList",
+            proto.GetMultipleKeysByListRequest(
+                collection=collection, keys=keys, version=version, snapshot=snapshot
+            ),
+        )
+        return [
+            (
+                VersionedValue(
+                    box.versionValuePair.actualVersion, box.versionValuePair.value
+                )
+                if box.HasField("versionValuePair")
+                else None
+            )
+            for box in reply.versionValueBoxes
+        ]
+
+    async def get_multiple_keys_by_list_with_multiple_versions(
+        self,
+        collection: str,
+        keys: list[str],
+        newest_version: Optional[int] = None,
+        oldest_version: Optional[int] = None,
+        snapshot: Optional[int] = None,
+    ) -> list[KeyVersions]:
+        """Keys without any version in the requested range are omitted."""
+        reply = await self._call(
+            "GetMultipleKeysByListWithMultipleVersions",
+            proto.GetMultipleKeysByListWithMultipleVersionsRequest(
+                collection=collection,
+                keys=keys,
+                newestVersion=newest_version,
+                oldestVersion=oldest_version,
+                snapshot=snapshot,
+            ),
+        )
+        return [
+            KeyVersions(
+                pair.key,
+                [
+                    VersionedValue(version_value.actualVersion, version_value.value)
+                    for version_value in pair.versionValuePairs
+                ],
+            )
+            for pair in reply.keyVersionsValuesPairs
+        ]
+
+    async def put(
+        self,
+        collection: str,
+        key: str,
+        value: bytes,
+        version: Optional[int] = None,
+    ) -> None:
+        """Without a version, the value is stored as the version following the newest one."""
+        await self._call(
+            "Put",
+            proto.PutRequest(
+                collection=collection, key=key, version=version, value=value
+            ),
+        )
+
+    async def put_multiple_versions(
+        self, collection: str, key: str, versions: list[int], values: list[bytes]
+    ) -> None:
+        await self._call(
+            "PutMultipleVersions",
+            proto.PutMultipleVersionsRequest(
+                collection=collection, key=key, versions=versions, values=values
+            ),
+        )
+
+    async def put_multiple_keys_with_multiple_versions(
+        self, collection: str, entries: Iterable[VersionedKeyValue]
+    ) -> None:
+        await self._call(
+            "PutMultipleKeysWithMultipleVersions",
+            proto.PutMultipleKeysWithMultipleVersionsRequest(
+                collection=collection,
+                versionedKeyValuePairs=[
+                    proto.VersionedKeyValuePairProto(
+                        key=entry.key, version=entry.version, value=entry.value
+                    )
+                    for entry in entries
+                ],
+            ),
+        )
+
+    async def delete(self, collection: str, key: str, version: int) -> None:
+        await self._call(
+            "Delete",
+            proto.DeleteRequest(collection=collection, key=key, version=version),
+        )
+
+    async def delete_multiple_versions(
+        self,
+        collection: str,
+        key: str,
+        newest_version: Optional[int] = None,
+        oldest_version: Optional[int] = None,
+    ) -> None:
+        await self._call(
+            "DeleteMultipleVersions",
+            proto.DeleteMultipleVersionsRequest(
+                collection=collection,
+                key=key,
+                newestVersion=newest_version,
+                oldestVersion=oldest_version,
+            ),
+        )
+
+    async def delete_all_by_prefix(self, collection: str, prefix: str) -> None:
+        await self._call(
+            "DeleteAllByPrefix",
+            proto.DeleteAllByPrefixRequest(collection=collection, prefix=prefix),
+        )
+
+    async def list_keys(
+        self,
+        collection: str,
+        limit: Optional[int] = None,
+        start_after_key: Optional[str] = None,
+        prefix: Optional[str] = None,
+        snapshot: Optional[int] = None,
+    ) -> list[str]:
+        reply = await self._call(
+            "ListKeys",
+            proto.ListKeysRequest(
+                collection=collection,
+                limit=limit,
+                startAfterKey=start_after_key,
+                prefix=prefix,
+                snapshot=snapshot,
+            ),
+        )
+        return list(reply.keys)
+
+    async def list_versions(
+        self,
+        collection: str,
+        key: str,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        newest_version: Optional[int] = None,
+        oldest_version: Optional[int] = None,
+        oldest_first: bool = False,
+    ) -> list[int]:
+        """The versions of key within the bounds, newest first unless oldest_first is set."""
+        reply = await self._call(
+            "ListVersions",
+            proto.ListVersionsRequest(
+                collection=collection,
+                key=key,
+                limit=limit,
+                offset=offset,
+                newestVersion=newest_version,
+                oldestVersion=oldest_version,
+                oldestFirst=oldest_first,
+            ),
+        )
+        return list(reply.versions)
+
+    async def list_versions_with_value_sizes(
+        self,
+        collection: str,
+        key: str,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        newest_version: Optional[int] = None,
+        oldest_version: Optional[int] = None,
+        oldest_first: bool = False,
+    ) -> list[tuple[int, int]]:
+        """Like list_versions, but returns (version, value size in bytes) pairs."""
+        reply = await self._call(
+            "ListVersions",
+            proto.ListVersionsRequest(
+                collection=collection,
+                key=key,
+                limit=limit,
+                offset=offset,
+                newestVersion=newest_version,
+                oldestVersion=oldest_version,
+                oldestFirst=oldest_first,
+                includeValueSizes=True,
+            ),
+        )
+        return list(zip(reply.versions, reply.valueSizes))
+
+    async def count(
+        self,
+        collection: str,
+        prefix: Optional[str] = None,
+        key: Optional[str] = None,
+        estimate: bool = False,
+    ) -> KeyCount:
+        """Number of keys and versions in the collection, of keys with prefix, or of versions of key.
+
+        With estimate, the count of a whole collection is taken from RocksDB statistics.
+        """
+        reply = await self._call(
+            "Count",
+            proto.CountRequest(
+                collection=collection, prefix=prefix, key=key, estimate=estimate
+            ),
+        )
+        return KeyCount(reply.keyCount, reply.versionCount, reply.estimated)
+
+    async def scan(
+        self,
+        collection: str,
+        prefix: Optional[str] = None,
+        start_after_key: Optional[str] = None,
+        version: Optional[int] = None,
+        all_versions: bool = True,
+        max_chunk_entries: Optional[int] = None,
+        max_chunk_bytes: Optional[int] = None,
+    ) -> AsyncIterator[VersionedKeyValue]:
+        """Iterates over a whole collection in one streaming call.
+
+        The stream holds one slot of max_concurrency until it is exhausted or closed.
+        It is only retried if it fails before the first entry arrived.
+        """
+        request = proto.ScanRequest(
+            collection=collection,
+            prefix=prefix,
+            startAfterKey=start_after_key,
+            version=version,
+            allVersions=all_versions,
+            maxChunkEntries=max_chunk_entries,
+            maxChunkBytes=max_chunk_bytes,
+        )
+        attempt = 0
+        received = False
+        while True:
+            try:
+                async with self.semaphore:
+                    async for reply in self.pool.stub().Scan(
+                        request, timeout=self.timeout
+                    ):
+                        if not reply.success:
+                            raise FossilDBError(reply.errorMessage)
+                        for pair in reply.versionedKeyValuePairs:
+                            received = True
+                            yield VersionedKeyValue(pair.key, pair.version, pair.value)
+                return
+            except grpc.aio.AioRpcError as e:
+                attempt += 1
+                if (
+                    received
+                    or not self.retry_policy.retryable(e)
+                    or attempt >= self.retry_policy.max_attempts
+                ):
+                    raise
+                await asyncio.sleep(self.retry_policy.backoff(attempt - 1))
+
+    async def backup(self) -> BackupInfo:
+        reply = await self._call("Backup", proto.BackupRequest())
+        return BackupInfo(reply.id, reply.timestamp, reply.size)
+
+    async def start_backup(self) -> int:
+        """Starts a backup in the background and returns its job id."""
+        reply = await self._call("StartBackup", proto.StartBackupRequest())
+        return reply.jobId
+
+    async def backup_status(self, job_id: Optional[int] = None) -> BackupJobStatus:
+        """Status of the backup job, or of the latest one."""
+        reply = await self._call(
+            "GetBackupStatus", proto.GetBackupStatusRequest(jobId=job_id)
+        )
+        return BackupJobStatus(
+            reply.jobId,
+            reply.state,
+            reply.startTime,
+            reply.endTime if reply.HasField("endTime") else None,
+            reply.bytesCopied,
+            reply.dbBytes,
+            BackupInfo(reply.backup.id, reply.backup.timestamp, reply.backup.size)
+            if reply.HasField("backup")
+            else None,
+            reply.jobError if reply.HasField("jobError") else None,
+        )
+
+    async def restore_from_backup(self) -> None:
+        await self._call("RestoreFromBackup", proto.RestoreFromBackupRequest())
+
+    async def compact_all_data(self) -> None:
+        await self._call("CompactAllData", proto.CompactAllDataRequest())
+
+    async def export_db(
+        self, new_data_dir: str, options_file: Optional[str] = None
+    ) -> None:
+        await self._call(
+            "ExportDB",
+            proto.ExportDBRequest(newDataDir=new_data_dir, optionsFile=options_file),
+        )
+
+    async def export_status(self) -> ExportStatus:
+        """Progress of the running export, or the result of the last one."""
+        reply = await self._call("GetExportStatus", proto.GetExportStatusRequest())
+        return ExportStatus(
+            reply.newDataDir,
+            reply.state,
+            reply.method,
+            reply.startTime,
+            reply.endTime if reply.HasField("endTime") else None,
+            reply.entriesWritten,
+            reply.bytesWritten,
+            reply.estimatedEntries,
+            reply.collection if reply.HasField("collection") else None,
+            reply.exportError if reply.HasField("exportError") else None,
+        )
+
+    async def apply_retention(self, collection: Optional[str] = None) -> int:
+        """Applies the retention policy of collection, or of all collections with one, now.
+
+        Returns the number of deleted versions.
+        """
+        reply = await self._call(
+            "ApplyRetention", proto.ApplyRetentionRequest(collection=collection)
+        )
+        return reply.deletedVersions
+
+    async def acquire_snapshot(self, ttl_seconds: Optional[int] = None) -> SnapshotToken:
+        """Pins the current state of the db for ttl_seconds (60 by default).
+
+        Pass the id as snapshot to get_multiple_keys, get_multiple_keys_by_list(_with_multiple_versions)
+        and list_keys to read that state, e.g. from several pages fetched in parallel.
+        """
+        reply = await self._call(
+            "AcquireSnapshot", proto.AcquireSnapshotRequest(ttlSeconds=ttl_seconds)
+        )
+        return SnapshotToken(reply.snapshot, reply.expiresAt)
+
+    async def release_snapshot(self, snapshot: int) -> None:
+        await self._call(
+            "ReleaseSnapshot", proto.ReleaseSnapshotRequest(snapshot=snapshot)
+        )
+
+    @contextlib.asynccontextmanager
+    async def snapshot(self, ttl_seconds: Optional[int] = None) -> AsyncIterator[int]:
+        """Yields the id of a new snapshot and releases it afterwards."""
+        token = await self.acquire_snapshot(ttl_seconds)
+        try:
+            yield token.id
+        finally:
+            await self.release_snapshot(token.id)
+
+    async def compression_stats(
+        self, collection: Optional[str] = None
+    ) -> list[CompressionStats]:
+        """Compressed and raw size of every collection, or only of collection."""
+        reply = await self._call(
+            "CompressionStats", proto.CompressionStatsRequest(collection=collection)
+        )
+        return [
+            CompressionStats(
+                stats.collection,
+                list(stats.compressions),
+                stats.sstFiles,
+                stats.entries,
+                stats.rawBytes,
+                stats.compressedBytes,
+            )
+            for stats in reply.collections
+        ]
+
+    async def cache_stats(self) -> CacheStats:
+        reply = await self._call("CacheStats", proto.CacheStatsRequest())
+        return CacheStats(
+            reply.blockCacheCapacity,
+            reply.blockCacheUsage,
+            {ticker.name: ticker.count for ticker in reply.tickers},
+            {
+                cache.collection: ReadCacheStats(
+                    cache.hits, cache.misses, cache.coalesced, cache.entries, cache.bytes
+                )
+                for cache in reply.readCaches
+            },
+        )
@@ -0,0 +1,46 @@
+import itertools
+
+import grpc
+
+from . import fossildbapi_pb2_grpc as proto_rpc
+
+MAX_MESSAGE_LENGTH = 1073741824
+
+
+def is_message_too_large(error: grpc.aio.AioRpcError) -> bool:
+    """Whether the call failed because its request or reply exceeded MAX_MESSAGE_LENGTH."""
+    return (
+        error.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+        and "message larger than max" in (error.details() or "")
+    )
+
+
+class ChannelPool:
+    """A fixed number of grpc.aio channels to one server, handed out round-robin.
+
+    A single channel multiplexes all calls over one HTTP/2 connection, which limits
+    the number of concurrent streams. Every channel of the pool uses its own subchannel
+    pool, so each one really opens a separate connection.
+    """
+
+    def __init__(self, host: str, size: int = 4):
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        options = [
+            ("grpc.max_send_message_length", MAX_MESSAGE_LENGTH),
+            ("grpc.max_receive_message_length", MAX_MESSAGE_LENGTH),
+            ("grpc.use_local_subchannel_pool", 1),
+        ]
+        self.host = host
+        self.channels = [
+            grpc.aio.insecure_channel(host, options=options) for _ in range(size)
+        ]
+        self.stubs = [proto_rpc.FossilDBStub(channel) for channel in self.channels]
+        self._next = itertools.cycle(range(size))
+
+    def stub(self) -> proto_rpc.FossilDBStub:
+        return self.stubs[next(self._next)]
+
+    async def close(self) -> None:
+        for channel in self.channels:
+            await channel.close()
@@ -0,0 +1,119 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class VersionedValue:
+    version: int
+    value: bytes
+
+
+@dataclass(frozen=True)
+class VersionedKeyValue:
+    key: str
+    version: int
+    value: bytes
+
+
+@dataclass(frozen=True)
+class KeyVersions:
+    """All requested versions of one key, newest first."""
+
+    key: str
+    versions: list[VersionedValue]
+
+
+@dataclass(frozen=True)
+class BackupInfo:
+    id: int
+    timestamp: int
+    size: int
+
+
+@dataclass(frozen=True)
+class BackupJobStatus:
+    """Progress of a background backup, backup is only set once it succeeded.
+
+    db_bytes is the size of the db when the job started, an upper bound of bytes_copied,
+    as files that are part of earlier backups are not copied again.
+    """
+
+    job_id: int
+    state: str
+    start_time: int
+    end_time: Optional[int]
+    bytes_copied: int
+    db_bytes: int
+    backup: Optional[BackupInfo]
+    error: Optional[str]
+
+    @property
+    def running(self) -> bool:
+        return self.state == "RUNNING"
+
+
+@dataclass(frozen=True)
+class ExportStatus:
+    """Progress of the running or the last export.
+
+    method is checkpoint, sst or batch. Entries and bytes are not counted for checkpoints.
+    """
+
+    new_data_dir: str
+    state: str
+    method: str
+    start_time: int
+    end_time: Optional[int]
+    entries_written: int
+    bytes_written: int
+    estimated_entries: int
+    collection: Optional[str]
+    error: Optional[str]
+
+
+@dataclass(frozen=True)
+class KeyCount:
+    keys: int
+    versions: int
+    estimated: bool
+
+
+@dataclass(frozen=True)
+class CompressionStats:
+    """Table properties of the flushed data of one collection."""
+
+    collection: str
+    compressions: list[str]
+    sst_files: int
+    entries: int
+    raw_bytes: int
+    compressed_bytes: int
+
+
+@dataclass(frozen=True)
+class SnapshotToken:
+    """A snapshot of the db acquired with acquire_snapshot, expires_at is in milliseconds since epoch."""
+
+    id: int
+    expires_at: int
+
+
+@dataclass(frozen=True)
+class ReadCacheStats:
+    """Get requests of one collection answered from the read cache, read from RocksDB, or merged with an identical one."""
+
+    hits: int
+    misses: int
+    coalesced: int
+    entries: int
+    bytes: int
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    """Block cache usage and RocksDB ticker counts since the server opened the db, and the read cache of each collection."""
+
+    block_cache_capacity: int
+    block_cache_usage: int
+    tickers: dict[str, int]
+    read_caches: dict[str, ReadCacheStats] = field(default_factory=dict)
@@ -1,9 +1,14 @@
 import argparse
 import asyncio
 import logging
+import os
 import random
+import sys
 
-from db_connection import connect, getMultipleKeys, listKeys, listVersions
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from db_connection import connect, count, getMultipleKeys, listKeys, listVersions
+from fossildb import AsyncFossilDBClient
 from record_explorer import RecordExplorer
 from rich.text import Text
 from textual import on, work
@@ -82,28 +87,30 @@ class KeyInfoWidget(Widget):
             return
 
         try:
-            self.versions = listVersions(stub, self.collection, key)
-            self.versions.sort()
+            version_count = count(self.stub, self.collection, key=key).versionCount
+            # Newest first from the server, only the newest ones are shown
+            self.versions = sorted(
+                listVersions(self.stub, self.collection, key, limit=500)
+            )
             num_versions = (
-                f"{len(self.versions)} versions"
-                if len(self.versions) > 1
-                else "1 version"
+                f"{version_count} versions" if version_count > 1 else "1 version"
             )
             key_info_text.append(Text(f"\n{num_versions}: "))
-            versions_to_list = self.versions
-            if len(self.versions) > 500:
-                versions_to_list = self.versions[-500:]
+            if version_count > len(self.versions):
                 key_info_text.append(
-                    Text("Showing only last 500 versions. ", style="italic")
+                    Text(
+                        f"Showing only last {len(self.versions)} versions. ",
+                        style="italic",
+                    )
                 )
             key_info_text.append(
-                Text(",".join(map(str, versions_to_list)), style="bold white")
+                Text(",".join(map(str, self.versions)), style="bold white")
             )
             self.sanitized_key_name = RecordExplorer.sanitize_filename(
                 f"{self.collection}_{key}_{self.versions[-1]}"
             )
             self.app.query_one(RecordBrowser).update_table_version_number(
-                key, len(self.versions)
+                key, version_count
             )
         except Exception as e:
             key_info_text.append(Text("\nCould not load versions: " + str(e)))
@@ -264,9 +271,8 @@ class RecordBrowser(Static):
             random.random() * 2
         )  # Having all updates at once slows down the app
         try:
-            versions = listVersions(self.stub, self.collection, key)
-            numVersions = len(versions)
-            table.update_cell_at((key_index, 1), str(numVersions))
+            key_count = await self.app.async_client().count(self.collection, key=key)
+            table.update_cell_at((key_index, 1), str(key_count.versions))
         except Exception as e:
             table.update_cell_at((key_index, 1), "Could not load versions: " + str(e))
 
@@ -358,41 +364,28 @@ class RecordBrowser(Static):
 
     @work(exclusive=True)
     async def estimate_key_count(self) -> None:
-        """Estimate the number of keys in the collection."""
-
-        def update_count(count, more_available=False):
-            if self.more_keys_available:
-                # This note is only shown if there are more keys available
-                table = self.query_one(DataTable)
-                more_keys_coords = (self.key_list_limit, 0)
-                if more_available:
-                    table.update_cell_at(
-                        more_keys_coords,
-                        f"Found at least {count} keys, more on the next page...",
-                    )
-                else:
-                    table.update_cell_at(
-                        more_keys_coords,
-                        f"Found {count} keys, more on the next page...",
-                    )
-
-        # For huge collections, don't request more than TOTAL_REQUEST_COUNT times, as to not overload the server
-        TOTAL_REQUEST_COUNT = 25
-        KEY_LIST_LIMIT = 100
-        request_count = 0
-        count = len(self.found_keys)
-        last_key = self.found_keys[-1]
-        while request_count < TOTAL_REQUEST_COUNT:
-            keys = self.fetch_keys(last_key, KEY_LIST_LIMIT)
-            count += len(keys)
-            if len(keys) < KEY_LIST_LIMIT:
-                break
-            last_key = keys[-1]
-            request_count += 1
-            update_count(count)
-            # Wait here to not send all requests at once
-            await asyncio.sleep(0.2)
-        update_count(count, more_available=request_count == TOTAL_REQUEST_COUNT)
+        """Count the keys of the collection (or prefix) server-side, estimating for whole collections."""
+        try:
+            key_count = await self.app.async_client().count(
+                self.collection,
+                prefix=self.prefix or None,
+                estimate=self.prefix == "",
+            )
+        except Exception:
+            return
+        if self.more_keys_available:
+            # This note is only shown if there are more keys available
+            table = self.query_one(DataTable)
+            more_keys_coords = (self.key_list_limit, 0)
+            count_text = (
+                f"About {key_count.keys}"
+                if key_count.estimated
+                else str(key_count.keys)
+            )
+            table.update_cell_at(
+                more_keys_coords,
+                f"Found {count_text} keys, more on the next page...",
+            )
 
     def _on_mount(self, event):
         # Used when the collection is specified using the -c argument
@@ -459,9 +452,11 @@ class FossilDBClient(App):
 
     title = "FossilDB Client"
 
-    def __init__(self, stub, collection, prefix, count, performance_mode):
+    def __init__(self, host, stub, collection, prefix, count, performance_mode):
         super().__init__()
+        self.host = host
         self.stub = stub
+        self._async_client = None
         self.collection = collection
         self.prefix = prefix
         self.key_list_limit = int(count)
@@ -482,6 +477,16 @@ class FossilDBClient(App):
                 )
         yield Footer()
 
+    def async_client(self) -> AsyncFossilDBClient:
+        """Client for requests from async workers, created lazily inside the app's event loop."""
+        if self._async_client is None:
+            self._async_client = AsyncFossilDBClient(self.host)
+        return self._async_client
+
+    async def on_unmount(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.close()
+
     def action_set_version(self, version) -> None:
         """An action to set the version of the record.
         Defined here because we can only access the app from the link.
@@ -519,6 +524,11 @@ if __name__ == "__main__":
     args = parser.parse_args()
     stub = connect(args.host)
     app = FossilDBClient(
-        stub, args.collection, args.prefix, args.count, not args.no_performance_mode
+        args.host,
+        stub,
+        args.collection,
+        args.prefix,
+        args.count,
+        not args.no_performance_mode,
     )
     app.run()
@@ -0,0 +1,397 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import fossildbapi_pb2 as proto
+from db_connection import (
+    MAX_MESSAGE_LENGTH,
+    connect,
+    getMultipleKeysByListWithMultipleVersions,
+    listKeys,
+    putMultipleKeysWithMultipleVersions,
+)
+
+DEFAULT_COLLECTIONS = ["skeletons", "volumes", "volumeData", "skeletonUpdates"]
+
+# Rough per-entry overhead of a VersionedKeyValuePairProto besides key and value
+ENTRY_OVERHEAD_BYTES = 16
+
+
+class CopyStats:
+    """Thread-safe counters for copied keys, versions and bytes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = 0
+        self.versions = 0
+        self.bytes = 0
+        self.start_time = time.monotonic()
+
+    def add(self, keys: int, versions: int, num_bytes: int) -> None:
+        with self.lock:
+            self.keys += keys
+            self.versions += versions
+            self.bytes += num_bytes
+
+    def report(self) -> str:
+        with self.lock:
+            elapsed = max(time.monotonic() - self.start_time, 1e-6)
+            return "{} keys, {} versions, {:.1f} MB in {:.0f}s ({:.1f} keys/s, {:.2f} MB/s)".format(
+                self.keys,
+                self.versions,
+                self.bytes / 1e6,
+                elapsed,
+                self.keys / elapsed,
+                self.bytes / 1e6 / elapsed,
+            )
+
+
+class Checkpoint:
+    """Durable copy progress, rewritten atomically after every committed batch.
+
+    Per collection, startAfterKey is the cursor up to which all keys have been copied
+    completely, and watermarks holds the oldest version already written for keys after
+    that cursor. Versions are copied newest first, so after a restart only versions
+    below a key's watermark still have to be copied.
+    """
+
+    def __init__(self, path: str, src: str, dst: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {"src": src, "dst": dst, "collections": {}}
+        # Pages that were handed out but are not yet part of the cursor, in listing order
+        self.pending_pages = {}
+        self.next_page_id = 0
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state["src"] != src or state["dst"] != dst:
+                raise Exception(
+                    "checkpoint {} belongs to a copy from {} to {}".format(
+                        path, state["src"], state["dst"]
+                    )
+                )
+            self.state = state
+            print("resuming from checkpoint " + path)
+
+    def collection_state(self, collection: str) -> dict:
+        return self.state["collections"].setdefault(
+            collection, {"startAfterKey": "", "watermarks": {}, "done": False}
+        )
+
+    def start_after_key(self, collection: str) -> str:
+        with self.lock:
+            return self.collection_state(collection)["startAfterKey"]
+
+    def is_done(self, collection: str) -> bool:
+        with self.lock:
+            return self.collection_state(collection)["done"]
+
+    def watermark(self, collection: str, key: str):
+        with self.lock:
+            return self.collection_state(collection)["watermarks"].get(key)
+
+    def register_page(self, collection: str, keys: list) -> int:
+        with self.lock:
+            page_id = self.next_page_id
+            self.next_page_id += 1
+            self.pending_pages.setdefault(collection, OrderedDict())[page_id] = [
+                keys,
+                False,
+            ]
+            return page_id
+
+    def commit_batch(self, collection: str, batch: list) -> None:
+        with self.lock:
+            watermarks = self.collection_state(collection)["watermarks"]
+            for pair in batch:
+                current = watermarks.get(pair.key)
+                if current is None or pair.version < current:
+                    watermarks[pair.key] = pair.version
+            self.save()
+
+    def complete_page(self, collection: str, page_id: int) -> None:
+        with self.lock:
+            pages = self.pending_pages[collection]
+            pages[page_id][1] = True
+            state = self.collection_state(collection)
+            # Only a contiguous run of completed pages may move the cursor
+            while pages and next(iter(pages.values()))[1]:
+                _, (keys, _) = pages.popitem(last=False)
+                state["startAfterKey"] = keys[-1]
+                for key in keys:
+                    state["watermarks"].pop(key, None)
+            self.save()
+
+    def complete_collection(self, collection: str) -> None:
+        with self.lock:
+            self.collection_state(collection)["done"] = True
+            self.save()
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class CollectionCopier:
+    """Copies collections from one FossilDB to another.
+
+    Keys are listed page by page with ListKeys (or taken from a given key list).
+    Every page is a unit of work for the worker pool: its values are fetched with
+    GetMultipleKeysByListWithMultipleVersions and written with
+    PutMultipleKeysWithMultipleVersions in batches capped by byte size.
+    """
+
+    def __init__(
+        self,
+        src_stub,
+        dst_stub,
+        checkpoint: Checkpoint,
+        workers: int,
+        list_batch_size: int,
+        fetch_batch_size: int,
+        max_batch_bytes: int,
+        verbose: bool = False,
+    ):
+        self.src_stub = src_stub
+        self.dst_stub = dst_stub
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.list_batch_size = list_batch_size
+        self.fetch_batch_size = fetch_batch_size
+        self.max_batch_bytes = min(max_batch_bytes, MAX_MESSAGE_LENGTH // 2)
+        self.verbose = verbose
+        self.stats = CopyStats()
+
+    def copy(self, key_lists_by_collection: dict) -> None:
+        """Copies the given collections. A key list of None means all keys of the collection."""
+        # Bound the number of listed but not yet copied pages, so listing cannot run away from copying
+        in_flight = threading.BoundedSemaphore(self.workers * 2)
+        futures_by_collection = {}
+
+        def release(_future):
+            in_flight.release()
+
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for collection, keys in key_lists_by_collection.items():
+                if self.checkpoint.is_done(collection):
+                    print("skipping collection {}, already copied".format(collection))
+                    continue
+                print("copying collection " + collection)
+                futures = futures_by_collection.setdefault(collection, [])
+                for page in self.key_pages(collection, keys):
+                    in_flight.acquire()
+                    page_id = self.checkpoint.register_page(collection, page)
+                    future = executor.submit(self.copy_page, collection, page_id, page)
+                    future.add_done_callback(release)
+                    futures.append(future)
+                    self.raise_first_exception(futures)
+            for collection, futures in futures_by_collection.items():
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                self.raise_first_exception(done)
+                self.checkpoint.complete_collection(collection)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def key_pages(self, collection: str, keys):
+        start_after_key = self.checkpoint.start_after_key(collection)
+        if keys is not None:
+            start = keys.index(start_after_key) + 1 if start_after_key in keys else 0
+            for i in range(start, len(keys), self.list_batch_size):
+                yield keys[i : i + self.list_batch_size]
+            return
+        while True:
+            page = list(
+                listKeys(
+                    self.src_stub, collection, start_after_key, self.list_batch_size
+                )
+            )
+            if len(page) == 0:
+                return
+            yield page
+            start_after_key = page[-1]
+
+    def copy_page(self, collection: str, page_id: int, keys: list) -> None:
+        fresh_keys = []
+        for key in keys:
+            watermark = self.checkpoint.watermark(collection, key)
+            if watermark is None:
+                fresh_keys.append(key)
+            elif watermark > 0:
+                # Partially copied before a restart, versions are copied newest first
+                self.copy_keys(collection, [key], newest_version=watermark - 1)
+        for i in range(0, len(fresh_keys), self.fetch_batch_size):
+            self.copy_keys(collection, fresh_keys[i : i + self.fetch_batch_size])
+        self.checkpoint.complete_page(collection, page_id)
+        self.stats.add(len(keys), 0, 0)
+        if self.verbose:
+            print("  copied keys {} .. {}".format(keys[0], keys[-1]))
+
+    def copy_keys(self, collection: str, keys: list, newest_version: int = None) -> None:
+        key_versions_values_pairs = getMultipleKeysByListWithMultipleVersions(
+            self.src_stub, collection, keys, newestVersion=newest_version
+        )
+        if newest_version is None and len(key_versions_values_pairs) < len(keys):
+            found_keys = set(pair.key for pair in key_versions_values_pairs)
+            for key in keys:
+                if key not in found_keys:
+                    print("[warn] no data for", key, "in", collection)
+        batch = []
+        batch_bytes = 0
+        for pair in key_versions_values_pairs:
+            for version_value_pair in pair.versionValuePairs:
+                entry_bytes = (
+                    len(pair.key) + len(version_value_pair.value) + ENTRY_OVERHEAD_BYTES
+                )
+                if batch and batch_bytes + entry_bytes > self.max_batch_bytes:
+                    self.write_batch(collection, batch, batch_bytes)
+                    batch = []
+                    batch_bytes = 0
+                batch.append(
+                    proto.VersionedKeyValuePairProto(
+                        key=pair.key,
+                        version=version_value_pair.actualVersion,
+                        value=version_value_pair.value,
+                    )
+                )
+                batch_bytes += entry_bytes
+        if batch:
+            self.write_batch(collection, batch, batch_bytes)
+
+    def write_batch(self, collection: str, batch: list, batch_bytes: int) -> None:
+        putMultipleKeysWithMultipleVersions(self.dst_stub, collection, batch)
+        self.checkpoint.commit_batch(collection, batch)
+        self.stats.add(0, len(batch), batch_bytes)
+
+    @staticmethod
+    def raise_first_exception(futures) -> None:
+        for future in futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+
+def report_progress(stats: CopyStats, interval: float, stop: threading.Event) -> None:
+    while not stop.wait(interval):
+        print("progress: " + stats.report())
+
+
+def add_copy_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=8,
+        help="number of parallel copy workers (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--list-batch-size",
+        type=int,
+        default=300,
+        help="keys per page, one page is one unit of work (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fetch-batch-size",
+        type=int,
+        default=20,
+        help="keys per GetMultipleKeysByListWithMultipleVersions request (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-batch-bytes",
+        type=int,
+        default=64 * 1024 * 1024,
+        help="maximum payload of one PutMultipleKeysWithMultipleVersions request (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default="copy-checkpoint.json",
+        help="file to record progress in and to resume from (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        default=False,
+        help="ignore an existing checkpoint file and copy everything again",
+    )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=10,
+        help="seconds between progress reports (default: %(default)s)",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", default=False)
+
+
+def run_copy(args, key_lists_by_collection: dict) -> None:
+    """Copies from args.src to args.dst, with the options added by add_copy_arguments."""
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    try:
+        checkpoint = Checkpoint(args.checkpoint, args.src, args.dst)
+    except Exception as e:
+        print(str(e) + ", use --restart to discard it")
+        sys.exit(1)
+
+    src_stub = connect(args.src, "source")
+    dst_stub = connect(args.dst, "destination")
+    copier = CollectionCopier(
+        src_stub,
+        dst_stub,
+        checkpoint,
+        workers=args.workers,
+        list_batch_size=args.list_batch_size,
+        fetch_batch_size=args.fetch_batch_size,
+        max_batch_bytes=args.max_batch_bytes,
+        verbose=args.verbose,
+    )
+
+    stop_reporting = threading.Event()
+    reporter = threading.Thread(
+        target=report_progress,
+        args=(copier.stats, args.report_interval, stop_reporting),
+        daemon=True,
+    )
+    reporter.start()
+    try:
+        copier.copy(key_lists_by_collection)
+    finally:
+        stop_reporting.set()
+    print("Done. " + copier.stats.report())
+
+
+def init_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Copy collections from one FossilDB to another"
+    )
+    parser.add_argument("src", help="source fossildb host and port, e.g. localhost:2000")
+    parser.add_argument(
+        "dst", help="destination fossildb host and port, e.g. localhost:7155"
+    )
+    parser.add_argument(
+        "-c",
+        "--collections",
+        help="comma-separated list of collections to copy (default: %(default)s)",
+        default=",".join(DEFAULT_COLLECTIONS),
+    )
+    add_copy_arguments(parser)
+    return parser
+
+
+def main() -> None:
+    args = init_argument_parser().parse_args()
+    run_copy(args, {collection: None for collection in args.collections.split(",")})
+
+
+if __name__ == "__main__":
+    main()
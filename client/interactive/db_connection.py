@@ -7,7 +7,7 @@ import grpc
 MAX_MESSAGE_LENGTH = 1073741824
 
 
-def connect(host: str) -> proto_rpc.FossilDBStub:
+def connect(host: str, label: str = "destination") -> proto_rpc.FossilDBStub:
     channel = grpc.insecure_channel(
         host,
         options=[
@@ -16,7 +16,7 @@ def connect(host: str) -> proto_rpc.FossilDBStub:
         ],
     )
     stub = proto_rpc.FossilDBStub(channel)
-    testHealth(stub, "destination fossildb at {}".format(host))
+    testHealth(stub, "{} fossildb at {}".format(label, host))
     return stub
 
 
@@ -82,12 +82,128 @@ def getMultipleKeys(
     return reply.keys
 
 
-def listVersions(stub: proto_rpc.FossilDBStub, collection: str, key: str):
-    reply = stub.ListVersions(proto.ListVersionsRequest(collection=collection, key=key))
+def scan(
+    stub: proto_rpc.FossilDBStub,
+    collection: str,
+    prefix: str = None,
+    startAfterKey: str = None,
+    version: int = None,
+    allVersions: bool = True,
+    maxChunkEntries: int = None,
+    maxChunkBytes: int = None,
+):
+    """Iterates over a whole collection in one streaming call, yielding VersionedKeyValuePairProtos."""
+    replies = stub.Scan(
+        proto.ScanRequest(
+            collection=collection,
+            prefix=prefix,
+            startAfterKey=startAfterKey,
+            version=version,
+            allVersions=allVersions,
+            maxChunkEntries=maxChunkEntries,
+            maxChunkBytes=maxChunkBytes,
+        )
+    )
+    for reply in replies:
+        assertSuccess(reply)
+        yield from reply.versionedKeyValuePairs
+
+
+def listVersions(
+    stub: proto_rpc.FossilDBStub,
+    collection: str,
+    key: str,
+    limit: int = None,
+    newestVersion: int = None,
+    oldestVersion: int = None,
+    oldestFirst: bool = None,
+):
+    """The versions of key, newest first unless oldestFirst is set."""
+    reply = stub.ListVersions(
+        proto.ListVersionsRequest(
+            collection=collection,
+            key=key,
+            limit=limit,
+            newestVersion=newestVersion,
+            oldestVersion=oldestVersion,
+            oldestFirst=oldestFirst,
+        )
+    )
     assertSuccess(reply)
     return reply.versions
 
 
+def listVersionsWithValueSizes(
+    stub: proto_rpc.FossilDBStub,
+    collection: str,
+    key: str,
+    limit: int = None,
+    newestVersion: int = None,
+    oldestVersion: int = None,
+    oldestFirst: bool = None,
+):
+    """Like listVersions, but returns (version, value size) pairs."""
+    reply = stub.ListVersions(
+        proto.ListVersionsRequest(
+            collection=collection,
+            key=key,
+            limit=limit,
+            newestVersion=newestVersion,
+            oldestVersion=oldestVersion,
+            oldestFirst=oldestFirst,
+            includeValueSizes=True,
+        )
+    )
+    assertSuccess(reply)
+    return list(zip(reply.versions, reply.valueSizes))
+
+
+def count(
+    stub: proto_rpc.FossilDBStub,
+    collection: str,
+    prefix: str = None,
+    key: str = None,
+    estimate: bool = None,
+):
+    reply = stub.Count(
+        proto.CountRequest(
+            collection=collection, prefix=prefix, key=key, estimate=estimate
+        )
+    )
+    assertSuccess(reply)
+    return reply
+
+
+def getMultipleKeysByListWithMultipleVersions(
+    stub: proto_rpc.FossilDBStub,
+    collection: str,
+    keys: list,
+    newestVersion: int = None,
+    oldestVersion: int = None,
+):
+    reply = stub.GetMultipleKeysByListWithMultipleVersions(
+        proto.GetMultipleKeysByListWithMultipleVersionsRequest(
+            collection=collection,
+            keys=keys,
+            newestVersion=newestVersion,
+            oldestVersion=oldestVersion,
+        )
+    )
+    assertSuccess(reply)
+    return reply.keyVersionsValuesPairs
+
+
+def putMultipleKeysWithMultipleVersions(
+    stub: proto_rpc.FossilDBStub, collection: str, versionedKeyValuePairs: list
+) -> None:
+    reply = stub.PutMultipleKeysWithMultipleVersions(
+        proto.PutMultipleKeysWithMultipleVersionsRequest(
+            collection=collection, versionedKeyValuePairs=versionedKeyValuePairs
+        )
+    )
+    assertSuccess(reply)
+
+
 def deleteVersion(
     stub: proto_rpc.FossilDBStub, collection: str, key: str, version: int
 ) -> None:
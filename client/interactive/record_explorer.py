@@ -1,26 +1,33 @@
 import re
-from typing import Generator
 
-from db_connection import deleteVersion, getKey, listVersions
-from protobuf_decoder.protobuf_decoder import Parser
+from db_connection import deleteVersion, getKey
 from rich.text import Text
-from textual import on
+from textual import on, work
 from textual.app import ComposeResult
 from textual.binding import Binding
-from textual.containers import Horizontal, Vertical
+from textual.containers import Horizontal, Vertical, VerticalScroll
 from textual.css.query import NoMatches
 from textual.reactive import reactive
 from textual.screen import Screen
+from textual.widget import Widget
 from textual.widgets import (
     Button,
     Collapsible,
-    DataTable,
     Input,
     Label,
     Rule,
     Static,
     TabbedContent,
 )
+from value_cache import ValueCache
+from version_pager import VersionPager
+from wire_decoder import parse_message
+from wire_view import HexDumpView, render_fields
+
+# Upper bound for the cached values of one explorer tab
+VALUE_CACHE_BYTES = 128 * 1024 * 1024
+# Number of versions on each side of the selected one that are prefetched
+PREFETCH_RADIUS = 2
 
 
 class RecordExplorer(Static):
@@ -29,15 +36,20 @@ class RecordExplorer(Static):
         self.stub = stub
         self.key = key
         self.collection = collection
-        self.parser = Parser()
+        self.value_cache = ValueCache(VALUE_CACHE_BYTES)
 
+        self.pager = VersionPager(stub, collection, key)
         try:
-            self.versions = listVersions(stub, self.collection, key)
-            self.versions.sort()
+            self.pager.load_newest()
             self.selected_version = self.versions[-1]
         except Exception as e:
             print("Could not load versions: " + str(e))
 
+    @property
+    def versions(self) -> list:
+        """The currently loaded page of versions, ascending."""
+        return self.pager.versions
+
     BINDINGS = {
         Binding("d", "download_data", "Download the selected version", show=True),
         Binding("delete", "delete_data", "Delete the selected version", show=True),
@@ -46,15 +58,56 @@ class RecordExplorer(Static):
         Binding("x", "close_tab", "Close tab", show=True),
     }
 
-    cached_data = {}
-
     def get_data(self) -> bytes:
-        if self.selected_version in self.cached_data:
-            return self.cached_data[self.selected_version]
-        self.cached_data[self.selected_version] = getKey(
-            self.stub, self.collection, self.key, self.selected_version
-        )
-        return self.cached_data[self.selected_version]
+        data = self.value_cache.get(self.selected_version)
+        if data is None:
+            data = getKey(self.stub, self.collection, self.key, self.selected_version)
+            self.value_cache.put(self.selected_version, data)
+        return data
+
+    def versions_to_prefetch(self) -> list:
+        """Uncached neighbours of the selected version, closest first, using at most half of the cache."""
+        if self.selected_version not in self.versions:
+            return []
+        index = self.versions.index(self.selected_version)
+        neighbours = [
+            version
+            for version in self.versions[
+                max(0, index - PREFETCH_RADIUS) : index + PREFETCH_RADIUS + 1
+            ]
+            if version not in self.value_cache
+        ]
+        neighbours.sort(key=lambda version: abs(version - self.selected_version))
+        selected = []
+        total_bytes = 0
+        for version in neighbours:
+            total_bytes += self.pager.value_sizes.get(version, 0)
+            if total_bytes > self.value_cache.max_bytes // 2:
+                break
+            selected.append(version)
+        return selected
+
+    @work(exclusive=True, group="prefetch")
+    async def prefetch_neighbours(self) -> None:
+        """Loads the versions around the selected one in the background, with one GetMultipleVersions call."""
+        versions = self.versions_to_prefetch()
+        if len(versions) == 0:
+            return
+        try:
+            values = await self.app.async_client().get_multiple_versions(
+                self.collection,
+                self.key,
+                newest_version=max(versions),
+                oldest_version=min(versions),
+            )
+        except Exception as e:
+            print("Could not prefetch versions: " + str(e))
+            return
+        for versioned_value in values:
+            if versioned_value.version in versions:
+                self.value_cache.put(
+                    versioned_value.version, versioned_value.value, prefetched=True
+                )
 
     def sanitize_filename(name: str) -> str:
         s = str(name).strip().replace(" ", "_")
@@ -78,8 +131,8 @@ class RecordExplorer(Static):
                 deleteVersion(
                     self.stub, self.collection, self.key, self.selected_version
                 )
-                self.versions = listVersions(self.stub, self.collection, self.key)
-                self.versions.sort()
+                self.value_cache.discard(self.selected_version)
+                self.pager.load_newest()
                 if len(self.versions) == 0:
                     self.app.pop_screen()
                 else:
@@ -96,114 +149,20 @@ class RecordExplorer(Static):
             delete_callback,
         )
 
-    def display_record(self) -> Vertical:
+    def display_record(self) -> Widget:
         data = self.get_data()
-        parsed = self.parser.parse(data.hex()).to_dict()
-        if len(parsed["results"]) == 0 and "remain_data" in parsed:
-            return self.render_hex_dump(parsed["remain_data"])
-        return Vertical(*self.render_wire(parsed), id="record-explorer-display")
-
-    def decode_varint(self, value: int) -> list:
-        def interpret_as_twos_complement(val: int, bits: int) -> int:
-            """Interprets an unsigned integer as a two's complement signed integer with the given bit width."""
-            if val >= (1 << (bits - 1)):
-                return val - (1 << bits)
-            return val
-
-        def interpret_as_signed_type(val: int) -> int:
-            """Custom logic to interpret as a signed type (similar to sint in proto)."""
-            if val % 2 == 0:
-                return val // 2
-            else:
-                return -(val // 2) - 1
-
-        result = []
-        uint_val = value
-        result.append({"type": "uint", "value": str(uint_val)})
-
-        for bits in [8, 16, 32, 64]:
-            int_val = interpret_as_twos_complement(uint_val, bits)
-            if int_val != uint_val:
-                result.append({"type": f"int{bits}", "value": str(int_val)})
-
-        signed_int_val = interpret_as_signed_type(uint_val)
-        if signed_int_val != uint_val:
-            result.append({"type": "sint", "value": str(signed_int_val)})
-
-        return result
-
-    def render_hex_dump(self, data: str) -> DataTable:
-        print("render hexdump!")
-        table = DataTable(id="hexdump-table", zebra_stripes=True)
-        table.add_column("Bytes")
-        table.add_column("ASCII")
-
-        hex_str = data.replace(
-            "\n", " "
-        ).split()  # Convert the data into a list of bytes
-        addr = 0
-
-        while hex_str:
-            line_data = hex_str[:16]  # Process 16 bytes per line
-            hex_bytes = " ".join(f"{b}" for b in line_data)
-            ascii_repr = "".join(
-                chr(int(b, 16)) if 32 <= int(b, 16) <= 126 else "." for b in line_data
-            )
-
-            table.add_row(hex_bytes, ascii_repr, label=f"{addr:07x}")
-            hex_str = hex_str[16:]  # Move to the next 16 bytes
-            addr += 16
-        return table
-
-    def render_wire(self, spec: dict) -> Generator[Collapsible, None, None]:
-        for field in spec["results"]:
-            field_number = field["field"]
-            field_type = field["wire_type"]
-            field_data = field["data"]
-            if field_type == "length_delimited":
-                yield Collapsible(
-                    *self.render_wire(field_data),
-                    title=f"Field {field_number} (Type protobuf)",
-                    classes="protobuf",
-                )
-            elif field_type == "varint":
-                values = self.decode_varint(field_data)
-                text = "\n".join([f"({val['type']}) {val['value']}" for val in values])
-                yield Collapsible(
-                    Static(text),
-                    title=f"Field {field_number} (Type {field_type})",
-                    classes="varint",
-                )
-            elif field_type == "fixed64":
-                double = field_data["value"]
-                integer = field_data["signed_int"]
-                yield Collapsible(
-                    Static(f"(double) {double}\n(int) {integer}"),
-                    title=f"Field {field_number} (Type {field_type})",
-                    classes="fixed64",
-                )
-            elif field_type == "string":
-                yield Collapsible(
-                    Label(f"{field_data}"),
-                    title=f"Field {field_number} (Type {field_type})",
-                    classes="string",
-                )
-            else:
-                yield Collapsible(
-                    Label(f"{field_data}"),
-                    title=f"Field {field_number} (Type {field_type})",
-                )
+        fields = parse_message(data)
+        if fields is None:
+            return HexDumpView(data, id="hexdump-view")
+        return VerticalScroll(*render_fields(fields), id="record-explorer-display")
 
     def render_version_list(self) -> Static:
         versions = list(self.versions)
-        if len(versions) >= 500:
-            # Do not render links if there are too many versions (slows everything down)
-            return Static(
-                "Available versions: " + ", ".join(f"{v}" for v in versions),
-                id="version_list",
-            )
+        label = "Available versions: "
+        if len(versions) >= self.pager.page_size:
+            label = "Loaded versions (j/k at either end loads more): "
         return Static(
-            "Available versions: "
+            label
             + ", ".join(f"[@click=app.set_version({v})]{v}[/]" for v in versions),
             id="version_list",
         )
@@ -215,6 +174,10 @@ class RecordExplorer(Static):
         info_text.append(self.key, style="bold magenta")
         info_text.append(".\nCurrently viewing version ")
         info_text.append(str(self.selected_version), style="bold blue")
+        if self.selected_version in self.pager.value_sizes:
+            info_text.append(
+                f" ({self.pager.value_sizes[self.selected_version]} bytes)"
+            )
 
         return Vertical(
             Static(info_text),
@@ -233,6 +196,8 @@ class RecordExplorer(Static):
         with Horizontal():
             yield self.display_record()
             yield self.render_info_panel()
+        # Runs on every (re)composition, i.e. whenever another version was selected
+        self.prefetch_neighbours()
 
     @on(Input.Submitted)
     async def on_input_submitted(self, event: Input.Submitted) -> None:
@@ -244,7 +209,7 @@ class RecordExplorer(Static):
                 pass
 
     async def set_version(self, version: int) -> None:
-        if version in self.versions:
+        if version in self.versions or self.pager.load_ending_at(version):
             self.selected_version = version
             await self.recompose()
 
@@ -271,12 +236,16 @@ class RecordExplorer(Static):
     async def action_previous_version(self) -> None:
         current_index = list(self.versions).index(self.selected_version)
         if current_index == 0:
+            if self.pager.load_older():
+                await self.set_version(self.versions[-1])
             return
         await self.set_version(self.versions[current_index - 1])
 
     async def action_next_version(self) -> None:
         current_index = list(self.versions).index(self.selected_version)
         if current_index == len(self.versions) - 1:
+            if self.pager.load_newer():
+                await self.set_version(self.versions[0])
             return
         await self.set_version(self.versions[current_index + 1])
 
@@ -287,8 +256,7 @@ class RecordExplorer(Static):
 
     def acquire_focus(self) -> None:
         try:
-            table = self.query_one(DataTable)
-            table.focus()
+            self.query_one(HexDumpView).focus()
         except NoMatches:
             collapsible = self.query_one(Collapsible)
             collapsible.focus()
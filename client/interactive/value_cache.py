@@ -0,0 +1,40 @@
+from collections import OrderedDict
+
+
+class ValueCache:
+    """LRU cache of the values of one key by version, bounded by the total size of the values.
+
+    Prefetched values are inserted as least recently used, so they never push out
+    values that were actually viewed, and are evicted first unless they get viewed.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def __contains__(self, version: int) -> bool:
+        return version in self.entries
+
+    def get(self, version: int):
+        value = self.entries.get(version)
+        if value is not None:
+            self.entries.move_to_end(version)
+        return value
+
+    def put(self, version: int, value: bytes, prefetched: bool = False) -> None:
+        if len(value) > self.max_bytes:
+            return
+        self.discard(version)
+        while self.size + len(value) > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+        self.entries[version] = value
+        self.size += len(value)
+        if prefetched:
+            self.entries.move_to_end(version, last=False)
+
+    def discard(self, version: int) -> None:
+        value = self.entries.pop(version, None)
+        if value is not None:
+            self.size -= len(value)
@@ -0,0 +1,61 @@
+from db_connection import listVersionsWithValueSizes
+
+PAGE_SIZE = 200
+
+
+class VersionPager:
+    """A window of at most page_size consecutive versions of one key, loaded page by page.
+
+    versions holds the current page in ascending order, value_sizes maps each of them
+    to the size of its value. Only the current page is ever transferred, so keys with
+    huge numbers of versions stay cheap to browse.
+    """
+
+    def __init__(self, stub, collection: str, key: str, page_size: int = PAGE_SIZE):
+        self.stub = stub
+        self.collection = collection
+        self.key = key
+        self.page_size = page_size
+        self.versions = []
+        self.value_sizes = {}
+
+    def _fetch(self, **bounds) -> list:
+        return listVersionsWithValueSizes(
+            self.stub, self.collection, self.key, limit=self.page_size, **bounds
+        )
+
+    def _set_page(self, page: list) -> bool:
+        """Replaces the window by page (in any order), unless it is empty."""
+        if len(page) == 0:
+            return False
+        self.versions = sorted(version for version, _ in page)
+        self.value_sizes = dict(page)
+        return True
+
+    def load_newest(self) -> bool:
+        self.versions = []
+        self.value_sizes = {}
+        return self._set_page(self._fetch())
+
+    def load_older(self) -> bool:
+        """Moves the window to the versions directly before the current ones, if there are any."""
+        if len(self.versions) == 0 or self.versions[0] == 0:
+            return False
+        return self._set_page(self._fetch(newestVersion=self.versions[0] - 1))
+
+    def load_newer(self) -> bool:
+        """Moves the window to the versions directly after the current ones, if there are any."""
+        if len(self.versions) == 0:
+            return False
+        return self._set_page(
+            self._fetch(oldestVersion=self.versions[-1] + 1, oldestFirst=True)
+        )
+
+    def load_ending_at(self, version: int) -> bool:
+        """Moves the window to end at version, if that version exists."""
+        if version < 0:
+            return False
+        page = self._fetch(newestVersion=version)
+        if len(page) == 0 or page[0][0] != version:
+            return False
+        return self._set_page(page)
@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+from typing import Iterator, Optional, Union
+
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+WIRE_TYPE_NAMES = {
+    VARINT: "varint",
+    FIXED64: "fixed64",
+    LENGTH_DELIMITED: "length_delimited",
+    FIXED32: "fixed32",
+}
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class WireField:
+    """One field of a protobuf message in wire format.
+
+    value is the decoded int for varints, otherwise a zero-copy view of the field's bytes.
+    offset is the position of the field's tag within the enclosing message.
+    """
+
+    number: int
+    wire_type: int
+    value: Union[int, memoryview]
+    offset: int
+
+
+def read_varint(data: memoryview, pos: int) -> tuple:
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise WireFormatError("truncated varint")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 70:
+            raise WireFormatError("varint too long")
+
+
+def _take(data: memoryview, pos: int, length: int) -> tuple:
+    if pos + length > len(data):
+        raise WireFormatError("truncated field")
+    return data[pos : pos + length], pos + length
+
+
+def iter_fields(data) -> Iterator[WireField]:
+    """Decodes the top level fields of a message one at a time, without copying any bytes.
+
+    Nested messages are not decoded, length-delimited fields are yielded as views.
+    Groups (deprecated wire types 3 and 4) are not supported.
+    """
+    data = memoryview(data)
+    pos = 0
+    while pos < len(data):
+        offset = pos
+        tag, pos = read_varint(data, pos)
+        number, wire_type = tag >> 3, tag & 7
+        if number == 0:
+            raise WireFormatError("invalid field number 0")
+        if wire_type == VARINT:
+            value, pos = read_varint(data, pos)
+        elif wire_type == FIXED64:
+            value, pos = _take(data, pos, 8)
+        elif wire_type == LENGTH_DELIMITED:
+            length, pos = read_varint(data, pos)
+            value, pos = _take(data, pos, length)
+        elif wire_type == FIXED32:
+            value, pos = _take(data, pos, 4)
+        else:
+            raise WireFormatError("unsupported wire type {}".format(wire_type))
+        yield WireField(number, wire_type, value, offset)
+
+
+def parse_message(data) -> Optional[list]:
+    """The top level fields if all of data is a non-empty message, None otherwise."""
+    try:
+        fields = list(iter_fields(data))
+    except WireFormatError:
+        return None
+    return fields if len(fields) > 0 else None
+
+
+def decode_text(data: memoryview) -> Optional[str]:
+    """data as string, if it is valid UTF-8 without control characters other than whitespace."""
+    try:
+        text = bytes(data).decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    if any(not char.isprintable() and char not in "\n\r\t" for char in text):
+        return None
+    return text
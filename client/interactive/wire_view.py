@@ -0,0 +1,168 @@
+import struct
+from typing import Callable, Iterable
+
+from rich.segment import Segment
+from textual.geometry import Size
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from textual.widget import Widget
+from textual.widgets import Button, Collapsible, Label, Static
+from wire_decoder import (
+    FIXED32,
+    FIXED64,
+    LENGTH_DELIMITED,
+    VARINT,
+    WIRE_TYPE_NAMES,
+    decode_text,
+    parse_message,
+)
+
+BYTES_PER_ROW = 16
+# Address, hex bytes and ASCII columns of one hex dump row
+HEX_DUMP_WIDTH = 7 + 2 + (3 * BYTES_PER_ROW - 1) + 2 + BYTES_PER_ROW
+# Number of fields of one message that are shown before a "show more" button
+FIELD_BATCH_SIZE = 200
+
+
+class HexDumpView(ScrollView):
+    """Hex dump of a byte buffer that only formats the rows currently on screen."""
+
+    def __init__(self, data, **kwargs):
+        super().__init__(**kwargs)
+        self.data = memoryview(data)
+        self.rows = (len(self.data) + BYTES_PER_ROW - 1) // BYTES_PER_ROW
+        self.virtual_size = Size(HEX_DUMP_WIDTH, self.rows)
+
+    def format_row(self, row: int) -> str:
+        offset = row * BYTES_PER_ROW
+        chunk = self.data[offset : offset + BYTES_PER_ROW]
+        hex_bytes = chunk.hex(" ")
+        ascii_repr = "".join(chr(b) if 32 <= b <= 126 else "." for b in chunk)
+        return f"{offset:07x}  {hex_bytes:<{3 * BYTES_PER_ROW - 1}}  {ascii_repr}"
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        row = scroll_y + y
+        width = self.size.width
+        if row >= self.rows:
+            return Strip.blank(width, self.rich_style)
+        strip = Strip([Segment(self.format_row(row), self.rich_style)])
+        return strip.crop(scroll_x, scroll_x + width)
+
+
+class LazyCollapsible(Collapsible):
+    """Collapsible whose children are only created when it is expanded for the first time."""
+
+    def __init__(
+        self, build_children: Callable[[Collapsible], Iterable[Widget]], **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.build_children = build_children
+        self.built = False
+
+    async def on_collapsible_expanded(self, event: Collapsible.Expanded) -> None:
+        if event.collapsible is not self or self.built:
+            return
+        self.built = True
+        await self.query_one(Collapsible.Contents).mount_all(
+            self.build_children(self)
+        )
+
+
+class MoreFieldsButton(Button):
+    """Placeholder for the remaining fields of a message, replaced by the next batch when pressed."""
+
+    def __init__(self, fields: list, start: int):
+        super().__init__(f"Show {len(fields) - start} more fields")
+        self.fields = fields
+        self.start = start
+
+    async def on_button_pressed(self, event: Button.Pressed) -> None:
+        event.stop()
+        await self.parent.mount_all(
+            render_fields(self.fields, self.start), before=self
+        )
+        await self.remove()
+
+
+def decode_varint(value: int) -> list:
+    def interpret_as_twos_complement(val: int, bits: int) -> int:
+        """Interprets an unsigned integer as a two's complement signed integer with the given bit width."""
+        if val >= (1 << (bits - 1)):
+            return val - (1 << bits)
+        return val
+
+    def interpret_as_signed_type(val: int) -> int:
+        """Custom logic to interpret as a signed type (similar to sint in proto)."""
+        if val % 2 == 0:
+            return val // 2
+        else:
+            return -(val // 2) - 1
+
+    result = []
+    uint_val = value
+    result.append({"type": "uint", "value": str(uint_val)})
+
+    for bits in [8, 16, 32, 64]:
+        int_val = interpret_as_twos_complement(uint_val, bits)
+        if int_val != uint_val:
+            result.append({"type": f"int{bits}", "value": str(int_val)})
+
+    signed_int_val = interpret_as_signed_type(uint_val)
+    if signed_int_val != uint_val:
+        result.append({"type": "sint", "value": str(signed_int_val)})
+
+    return result
+
+
+def render_length_delimited(collapsible: Collapsible, data: memoryview) -> list:
+    """Decodes a length-delimited field as message, string or raw bytes, in that order."""
+    fields = parse_message(data)
+    if fields is not None:
+        collapsible.add_class("protobuf")
+        return list(render_fields(fields))
+    text = decode_text(data)
+    if text is not None:
+        collapsible.add_class("string")
+        return [Label(text, markup=False)]
+    return [HexDumpView(data, classes="hexdump-nested")]
+
+
+def render_fields(fields: list, start: int = 0) -> Iterable[Widget]:
+    """Widgets for one batch of fields, followed by a button for the rest if there are more."""
+    end = start + FIELD_BATCH_SIZE
+    for field in fields[start:end]:
+        yield render_field(field)
+    if end < len(fields):
+        yield MoreFieldsButton(fields, end)
+
+
+def render_field(field) -> Collapsible:
+    type_name = WIRE_TYPE_NAMES[field.wire_type]
+    title = f"Field {field.number} (Type {type_name})"
+    if field.wire_type == LENGTH_DELIMITED:
+        return LazyCollapsible(
+            lambda collapsible: render_length_delimited(collapsible, field.value),
+            title=f"{title}, {len(field.value)} bytes",
+        )
+    if field.wire_type == VARINT:
+        values = decode_varint(field.value)
+        text = "\n".join([f"({val['type']}) {val['value']}" for val in values])
+        return Collapsible(Static(text), title=title, classes="varint")
+    if field.wire_type == FIXED64:
+        (double,) = struct.unpack("<d", field.value)
+        (integer,) = struct.unpack("<q", field.value)
+        return Collapsible(
+            Static(f"(double) {double}\n(int) {integer}"),
+            title=title,
+            classes="fixed64",
+        )
+    if field.wire_type == FIXED32:
+        (single,) = struct.unpack("<f", field.value)
+        (integer,) = struct.unpack("<i", field.value)
+        return Collapsible(
+            Static(f"(float) {single}\n(int) {integer}"),
+            title=title,
+            classes="fixed32",
+        )
+    return Collapsible(Label(str(field.value)), title=title)
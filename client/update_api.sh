@@ -5,3 +5,6 @@ SCRIPTPATH="$( cd "$(dirname "$0")" ; pwd -P )"
 
 python3 -m grpc_tools.protoc -I$SCRIPTPATH/../src/main/protobuf --python_out=$SCRIPTPATH --grpc_python_out=$SCRIPTPATH $SCRIPTPATH/../src/main/protobuf/fossildbapi.proto
 cp $SCRIPTPATH/fossildbapi_pb2* $SCRIPTPATH/interactive/
+# The fossildb package imports the generated modules relative to itself
+cp $SCRIPTPATH/fossildbapi_pb2* $SCRIPTPATH/fossildb/
+sed -i 's/^import fossildbapi_pb2 as/from . import fossildbapi_pb2 as/' $SCRIPTPATH/fossildb/fossildbapi_pb2_grpc.py
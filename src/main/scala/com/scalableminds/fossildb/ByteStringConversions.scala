@@ -0,0 +1,47 @@
+package com.scalableminds.fossildb
+
+import com.google.protobuf.{ByteOutput, ByteString, UnsafeByteOperations}
+
+import java.nio.ByteBuffer
+
+/*
+   Conversions between stored values and protobuf ByteStrings that avoid copying the value on the JVM heap.
+   Arrays read from RocksDB are allocated by the JNI layer for this one read and never modified afterwards,
+   so replies can wrap them instead of copying. Values of parsed requests are usually backed by an array holding
+   exactly the value, which can be passed on to RocksDB as is (RocksDB copies it into native memory on write).
+ */
+object ByteStringConversions {
+
+  def wrap(value: Array[Byte]): ByteString = UnsafeByteOperations.unsafeWrap(value)
+
+  // The caller must not modify the returned array, it may be shared with byteString
+  def toByteArray(byteString: ByteString): Array[Byte] = {
+    val output = new BackingArrayOutput
+    UnsafeByteOperations.unsafeWriteTo(byteString, output)
+    output.backingArray.getOrElse(byteString.toByteArray)
+  }
+
+  // Captures the array behind a ByteString that consists of exactly one whole array
+  private class BackingArrayOutput extends ByteOutput {
+
+    private var chunks = 0
+    private var wholeArray: Option[Array[Byte]] = None
+
+    def backingArray: Option[Array[Byte]] = if (chunks == 1) wholeArray else None
+
+    override def writeLazy(value: Array[Byte], offset: Int, length: Int): Unit = {
+      chunks += 1
+      if (offset == 0 && length == value.length) wholeArray = Some(value)
+    }
+
+    override def write(value: Byte): Unit = chunks += 1
+
+    override def write(value: Array[Byte], offset: Int, length: Int): Unit = chunks += 1
+
+    override def write(value: ByteBuffer): Unit = chunks += 1
+
+    override def writeLazy(value: ByteBuffer): Unit = chunks += 1
+
+  }
+
+}
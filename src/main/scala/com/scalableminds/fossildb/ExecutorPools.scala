@@ -0,0 +1,115 @@
+package com.scalableminds.fossildb
+
+import io.grpc.Status
+
+import java.util.concurrent.atomic.{AtomicInteger, LongAdder}
+import java.util.concurrent.{ArrayBlockingQueue, RejectedExecutionException, ThreadFactory, ThreadPoolExecutor, TimeUnit}
+import scala.concurrent.{Future, Promise}
+import scala.util.Try
+
+trait RequestExecutor {
+  def submit[T](block: => T): Future[T]
+}
+
+// Runs requests on the calling gRPC thread, for cheap calls that must never be queued behind others
+object DirectExecutor extends RequestExecutor {
+  override def submit[T](block: => T): Future[T] = Future.fromTry(Try(block))
+}
+
+/*
+   A fixed number of threads with a bounded queue in front of them. Once the queue is full, further requests
+   fail immediately with RESOURCE_EXHAUSTED instead of piling up, clients are expected to back off and retry.
+ */
+class BoundedExecutor(val name: String, config: PoolConfig) extends RequestExecutor {
+
+  private val rejected = new LongAdder
+  private val threadCount = new AtomicInteger(0)
+
+  private val threadFactory: ThreadFactory = (runnable: Runnable) => {
+    val thread = new Thread(runnable, s"fossildb-$name-${threadCount.incrementAndGet()}")
+    thread.setDaemon(true)
+    thread
+  }
+
+  private val executor = new ThreadPoolExecutor(config.threads, config.threads, 0L, TimeUnit.MILLISECONDS,
+    new ArrayBlockingQueue[Runnable](config.queueCapacity), threadFactory, new ThreadPoolExecutor.AbortPolicy())
+
+  override def submit[T](block: => T): Future[T] = {
+    val promise = Promise[T]()
+    try {
+      executor.execute(() => promise.complete(Try(block)))
+    } catch {
+      case _: RejectedExecutionException =>
+        rejected.increment()
+        promise.failure(Status.RESOURCE_EXHAUSTED.withDescription(s"Too many pending $name requests, retry later").asRuntimeException())
+    }
+    promise.future
+  }
+
+  def queueSize: Int = executor.getQueue.size
+
+  def activeThreads: Int = executor.getActiveCount
+
+  def rejectedCount: Long = rejected.sum
+
+  def completedCount: Long = executor.getCompletedTaskCount
+
+  // Rejects new requests, queued and running ones still complete
+  def shutdown(): Unit = executor.shutdown()
+
+  // Interrupts the requests that are still running after timeoutSeconds
+  def awaitTermination(timeoutSeconds: Long): Unit =
+    if (!executor.awaitTermination(timeoutSeconds, TimeUnit.SECONDS)) executor.shutdownNow()
+
+}
+
+case class PoolConfig(threads: Int, queueCapacity: Int) {
+  override def toString: String = s"$threads/$queueCapacity"
+}
+
+/*
+   Separate executors for the different kinds of requests, so that long batch operations (scans, bulk writes,
+   admin operations like compaction) cannot starve point reads.
+ */
+class ExecutorPools(configs: Map[String, PoolConfig] = ExecutorPools.defaultConfigs) {
+
+  private val executors: Map[String, BoundedExecutor] = ExecutorPools.defaultConfigs.map { case (name, default) =>
+    name -> new BoundedExecutor(name, configs.getOrElse(name, default))
+  }
+
+  // Point reads of single keys or lists of keys
+  val read: BoundedExecutor = executors("read")
+  // Requests that iterate over ranges of keys
+  val scan: BoundedExecutor = executors("scan")
+  val write: BoundedExecutor = executors("write")
+  // Backups, restores, compactions, exports and statistics
+  val admin: BoundedExecutor = executors("admin")
+
+  def all: Seq[BoundedExecutor] = Seq(read, scan, write, admin)
+
+  def shutdown(): Unit = {
+    all.foreach(_.shutdown())
+    all.foreach(_.awaitTermination(ExecutorPools.shutdownTimeoutSeconds))
+  }
+
+}
+
+object ExecutorPools {
+  private val processors = Runtime.getRuntime.availableProcessors
+
+  val shutdownTimeoutSeconds: Long = 60
+
+  val defaultConfigs: Map[String, PoolConfig] = Map(
+    "read" -> PoolConfig(2 * processors, 1000),
+    "scan" -> PoolConfig(math.max(2, processors / 2), 100),
+    "write" -> PoolConfig(4, 1000),
+    "admin" -> PoolConfig(2, 10)
+  )
+
+  // Parses <threads>/<queue capacity>, e.g. "16/1000"
+  def parseConfig(spec: String): PoolConfig = spec.split("/", -1) match {
+    case Array(threads, queueCapacity) if threads.toIntOption.exists(_ > 0) && queueCapacity.toIntOption.exists(_ > 0) =>
+      PoolConfig(threads.toInt, queueCapacity.toInt)
+    case _ => throw new IllegalArgumentException(s"Invalid executor pool $spec, expected <threads>/<queue capacity>")
+  }
+}
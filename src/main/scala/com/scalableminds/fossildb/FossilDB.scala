@@ -2,16 +2,26 @@ package com.scalableminds.fossildb
 
 import java.nio.file.Paths
 
-import com.scalableminds.fossildb.db.StoreManager
+import com.scalableminds.fossildb.db.{BackupRetention, CompressionConfig, DeltaEncoding, GroupCommitConfig, RetentionPolicy, RocksDBManager, StoreManager}
 import com.typesafe.scalalogging.LazyLogging
 import fossildb.BuildInfo
 
 import scala.concurrent.ExecutionContext
+import scala.util.{Failure, Success, Try}
 
-object ConfigDefaults {val port: Int = 7155; val dataDir: String = "data"; val backupDir: String = "backup"; val columnFamilies: List[String] = List(); val rocksOptionsFile: Option[String] = None}
+object ConfigDefaults {val port: Int = 7155; val dataDir: String = "data"; val backupDir: String = "backup"; val columnFamilies: List[String] = List(); val rocksOptionsFile: Option[String] = None; val compression: Map[String, CompressionConfig] = Map(); val blockCacheSizeMB: Long = RocksDBManager.defaultBlockCacheBytes / 1024 / 1024; val bloomPrefixLengths: Map[String, Int] = Map(); val metricsPort: Option[Int] = None; val executorPools: Map[String, PoolConfig] = Map(); val backupRetention: BackupRetention = BackupRetention.default; val retention: Map[String, RetentionPolicy] = Map(); val retentionSweepIntervalMinutes: Long = StoreManager.defaultRetentionSweepIntervalSeconds / 60; val deltaEncoding: Map[String, Int] = Map(); val readCacheMB: Map[String, Long] = Map(); val groupCommit: Map[String, GroupCommitConfig] = Map()}
 case class Config(port: Int = ConfigDefaults.port, dataDir: String = ConfigDefaults.dataDir,
                   backupDir: String = ConfigDefaults.backupDir, columnFamilies: List[String] = ConfigDefaults.columnFamilies,
-                  rocksOptionsFile: Option[String] = ConfigDefaults.rocksOptionsFile)
+                  rocksOptionsFile: Option[String] = ConfigDefaults.rocksOptionsFile,
+                  compression: Map[String, CompressionConfig] = ConfigDefaults.compression,
+                  blockCacheSizeMB: Long = ConfigDefaults.blockCacheSizeMB, bloomPrefixLengths: Map[String, Int] = ConfigDefaults.bloomPrefixLengths,
+                  metricsPort: Option[Int] = ConfigDefaults.metricsPort, executorPools: Map[String, PoolConfig] = ConfigDefaults.executorPools,
+                  backupRetention: BackupRetention = ConfigDefaults.backupRetention,
+                  retention: Map[String, RetentionPolicy] = ConfigDefaults.retention,
+                  retentionSweepIntervalMinutes: Long = ConfigDefaults.retentionSweepIntervalMinutes,
+                  deltaEncoding: Map[String, Int] = ConfigDefaults.deltaEncoding,
+                  readCacheMB: Map[String, Long] = ConfigDefaults.readCacheMB,
+                  groupCommit: Map[String, GroupCommitConfig] = ConfigDefaults.groupCommit)
 
 object FossilDB extends LazyLogging {
   def main(args: Array[String]): Unit = {
@@ -25,9 +35,12 @@ object FossilDB extends LazyLogging {
           logger.info("BuildInfo: (" + BuildInfo + ")")
           logger.info("Config: " + config)
 
-          val storeManager = new StoreManager(Paths.get(config.dataDir), Paths.get(config.backupDir), config.columnFamilies, config.rocksOptionsFile)
+          val storeManager = new StoreManager(Paths.get(config.dataDir), Paths.get(config.backupDir), config.columnFamilies, config.rocksOptionsFile,
+            config.compression, config.blockCacheSizeMB * 1024 * 1024, config.bloomPrefixLengths, config.backupRetention,
+            config.retention, config.retentionSweepIntervalMinutes * 60, config.deltaEncoding,
+            config.readCacheMB.map { case (cf, sizeMB) => cf -> sizeMB * 1024 * 1024 }, config.groupCommit)
 
-          val server = new FossilDBServer(storeManager, config.port, ExecutionContext.global)
+          val server = new FossilDBServer(storeManager, config.port, ExecutionContext.global, config.metricsPort, config.executorPools)
 
           server.start()
           server.blockUntilShutdown()
@@ -53,6 +66,90 @@ object FossilDB extends LazyLogging {
 
       opt[String]('r', "rocksOptionsFile").valueName("<filepath>").action( (x, c) =>
         c.copy(rocksOptionsFile = Some(x)) ).text("rocksdb options file. Default: " + ConfigDefaults.rocksOptionsFile)
+
+      opt[Map[String, String]]("compression").valueName("<cf1>=<codec>[/<bottommost codec>][:<dict bytes>],...").validate( x =>
+        Try(x.values.foreach(CompressionConfig.parse)) match {
+          case Success(_) => success
+          case Failure(e) => failure(e.getMessage)
+        }).action( (x, c) =>
+        c.copy(compression = x.map { case (cf, spec) => cf -> CompressionConfig.parse(spec) }) ).text("block compression per column family, e.g. volumeData=lz4/zstd:16384 for lz4 on hot levels and zstd with a 16KB dictionary on the bottommost level. Codecs: " + CompressionConfig.codecNames.mkString(", ") + ". Default: rocksdb default")
+
+      opt[Long]("blockCacheSize").valueName("<MB>").validate( x =>
+        if (x > 0) success else failure("block cache size must be positive") ).action( (x, c) =>
+        c.copy(blockCacheSizeMB = x) ).text("size of the block cache shared by all column families, unless a rocksOptionsFile is used. Default: " + ConfigDefaults.blockCacheSizeMB)
+
+      opt[Map[String, Int]]("bloomPrefixLength").valueName("<cf1>=<bytes>,<cf2>=<bytes>...").validate( x =>
+        if (x.values.forall(_ > 0)) success else failure("bloom prefix lengths must be positive") ).action( (x, c) =>
+        c.copy(bloomPrefixLengths = x) ).text("build bloom filters on the first <bytes> bytes of each key, lookups of keys at least that long can then skip files without the key. Default: none")
+
+      opt[Int]("metricsPort").valueName("<num>").action( (x, c) =>
+        c.copy(metricsPort = Some(x)) ).text("port to serve prometheus metrics on, at /metrics. Default: disabled")
+
+      opt[Map[String, String]]("executorPools").valueName("<pool1>=<threads>/<queue>,...").validate( x =>
+        Try(x.values.foreach(ExecutorPools.parseConfig)) match {
+          case Success(_) if x.keySet.subsetOf(ExecutorPools.defaultConfigs.keySet) => success
+          case Success(_) => failure("unknown executor pools " + (x.keySet -- ExecutorPools.defaultConfigs.keySet).mkString(","))
+          case Failure(e) => failure(e.getMessage)
+        }).action( (x, c) =>
+        c.copy(executorPools = x.map { case (pool, spec) => pool -> ExecutorPools.parseConfig(spec) }) ).text("threads and queue capacity of the executors for read, scan, write and admin requests, requests are rejected with RESOURCE_EXHAUSTED while the queue is full. Default: " + ExecutorPools.defaultConfigs.toSeq.sortBy(_._1).map { case (pool, config) => s"$pool=$config" }.mkString(","))
+
+      opt[String]("backupRetention").valueName("last:<count>|daily:<days>").validate( x =>
+        Try(BackupRetention.parse(x)) match {
+          case Success(_) => success
+          case Failure(e) => failure(e.getMessage)
+        }).action( (x, c) =>
+        c.copy(backupRetention = BackupRetention.parse(x)) ).text("backups to keep after each new backup: the last <count> backups, or the newest backup of each of the last <days> days with backups. Default: " + ConfigDefaults.backupRetention)
+
+      opt[Map[String, String]]("retention").valueName("<cf1>=<rule>[+<rule>...],...").validate( x =>
+        Try(x.values.foreach(RetentionPolicy.parse)) match {
+          case Success(_) => success
+          case Failure(e) => failure(e.getMessage)
+        }).action( (x, c) =>
+        c.copy(retention = x.map { case (cf, spec) => cf -> RetentionPolicy.parse(spec) }) ).text("versions to keep per column family, older ones are deleted periodically. Rules: newest:<n> (the newest n versions of each key), recent:<d> (versions less than d below the newest one), every:<k> (versions divisible by k). A version is kept if any rule keeps it, e.g. annotationUpdates=newest:100+every:1000. Default: keep all versions")
+
+      opt[Long]("retentionSweepInterval").valueName("<minutes>").validate( x =>
+        if (x > 0) success else failure("retention sweep interval must be positive") ).action( (x, c) =>
+        c.copy(retentionSweepIntervalMinutes = x) ).text("how often the retention policies are applied. Default: " + ConfigDefaults.retentionSweepIntervalMinutes)
+
+      opt[Map[String, Int]]("deltaEncoding").valueName("<cf1>=<maxChainLength>,...").validate( x =>
+        if (x.values.forall(length => length >= 0 && length <= DeltaEncoding.maxChainLengthLimit)) success
+        else failure("max delta chain lengths must be between 0 and " + DeltaEncoding.maxChainLengthLimit) ).action( (x, c) =>
+        c.copy(deltaEncoding = x) ).text("store versions of these column families as binary deltas against the previous version of the key where that saves at least half of the size, with a full value after at most <maxChainLength> deltas to bound the cost of reads. Values written before remain readable. With 0, no new deltas are written but existing ones are still read. Keep the option with 0 instead of removing it: without it, deltas are still read, but deleting or overwriting the version a delta is based on makes that delta unreadable. Default: none")
+
+      opt[Map[String, Long]]("readCache").valueName("<cf1>=<MB>,<cf2>=<MB>...").validate( x =>
+        if (x.values.forall(_ > 0)) success else failure("read cache sizes must be positive") ).action( (x, c) =>
+        c.copy(readCacheMB = x) ).text("cache the results of Get requests for these column families in memory, up to <MB> per column family, until the key is written. Concurrent identical Get requests share one read in all column families. Default: none")
+
+      opt[Map[String, String]]("groupCommit").valueName("<cf1>=<windowMicros>[/<maxPuts>],...").validate( x =>
+        Try(x.values.foreach(GroupCommitConfig.parse)) match {
+          case Success(_) => success
+          case Failure(e) => failure(e.getMessage)
+        }).action( (x, c) =>
+        c.copy(groupCommit = x.map { case (cf, spec) => cf -> GroupCommitConfig.parse(spec) }) ).text("write Put requests to these column families in groups: puts arriving within <windowMicros> of the first one are written in one batch of at most <maxPuts> (default " + GroupCommitConfig.defaultMaxPuts + "), and versions of puts without one are assigned from an in-memory index of the newest versions. A longer window means fewer, larger writes at the cost of the latency of each put. Default: none")
+
+      checkConfig( c =>
+        if (c.groupCommit.keySet.subsetOf(c.columnFamilies.toSet)) success
+        else failure("group commit configured for unknown column families " + (c.groupCommit.keySet -- c.columnFamilies).mkString(",")) )
+
+      checkConfig( c =>
+        if (c.readCacheMB.keySet.subsetOf(c.columnFamilies.toSet)) success
+        else failure("read cache configured for unknown column families " + (c.readCacheMB.keySet -- c.columnFamilies).mkString(",")) )
+
+      checkConfig( c =>
+        if (c.deltaEncoding.keySet.subsetOf(c.columnFamilies.toSet)) success
+        else failure("delta encoding configured for unknown column families " + (c.deltaEncoding.keySet -- c.columnFamilies).mkString(",")) )
+
+      checkConfig( c =>
+        if (c.retention.keySet.subsetOf(c.columnFamilies.toSet)) success
+        else failure("retention configured for unknown column families " + (c.retention.keySet -- c.columnFamilies).mkString(",")) )
+
+      checkConfig( c =>
+        if (c.compression.keySet.subsetOf(c.columnFamilies.toSet)) success
+        else failure("compression configured for unknown column families " + (c.compression.keySet -- c.columnFamilies).mkString(",")) )
+
+      checkConfig( c =>
+        if (c.bloomPrefixLengths.keySet.subsetOf(c.columnFamilies.toSet)) success
+        else failure("bloom prefix length configured for unknown column families " + (c.bloomPrefixLengths.keySet -- c.columnFamilies).mkString(",")) )
     }
 
     parser.parse(args, Config())
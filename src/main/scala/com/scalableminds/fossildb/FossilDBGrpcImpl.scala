@@ -6,122 +6,177 @@ import com.scalableminds.fossildb.db.StoreManager
 import com.scalableminds.fossildb.proto.fossildbapi._
 import scalapb.GeneratedMessage
 import com.typesafe.scalalogging.LazyLogging
+import io.grpc.StatusRuntimeException
+import io.grpc.stub.{ServerCallStreamObserver, StreamObserver}
 
-import scala.concurrent.Future
+import scala.concurrent.{ExecutionContext, Future}
+import scala.util.{Failure, Success, Try}
 
-class FossilDBGrpcImpl(storeManager: StoreManager)
+class FossilDBGrpcImpl(storeManager: StoreManager, metrics: Option[Metrics] = None, pools: ExecutorPools = new ExecutorPools())
   extends FossilDBGrpc.FossilDB
     with LazyLogging {
 
-  override def health(req: HealthRequest): Future[HealthReply] = withExceptionHandler(req) {
+  override def health(req: HealthRequest): Future[HealthReply] = withExceptionHandler(req, DirectExecutor) {
     HealthReply(success = true)
   } { errorMsg => HealthReply(success = false, errorMsg) }
 
-  override def get(req: GetRequest): Future[GetReply] = withExceptionHandler(req) {
+  override def get(req: GetRequest): Future[GetReply] = withExceptionHandler(req, pools.read) {
     val store = storeManager.getStore(req.collection)
-    val versionedKeyValuePairOpt = store.withRawRocksIterator{rocksIt => store.get(rocksIt, req.key, req.version)}
+    val versionedKeyValuePairOpt = store.getShared(req.key, req.version)
     versionedKeyValuePairOpt match {
-      case Some(pair) => GetReply(success = true, None, ByteString.copyFrom(pair.value), pair.version)
+      case Some(pair) => GetReply(success = true, None, ByteStringConversions.wrap(pair.value), pair.version)
       case None =>
         if (!req.mayBeEmpty.getOrElse(false)) throw new NoSuchElementException
         GetReply(success = false, Some("No such element"), ByteString.EMPTY, 0)
     }
   } { errorMsg => GetReply(success = false, errorMsg, ByteString.EMPTY, 0) }
 
-  override def put(req: PutRequest): Future[PutReply] = withExceptionHandler(req) {
-    val store = storeManager.getStore(req.collection)
-    val version = store.withRawRocksIterator{rocksIt => req.version.getOrElse(store.get(rocksIt, req.key, None).map(_.version + 1).getOrElse(0L))}
-    require(version >= 0, "Version numbers must be non-negative")
-    store.put(req.key, version, req.value.toByteArray)
-    PutReply(success = true)
+  override def put(req: PutRequest): Future[PutReply] =
+    // Errors of getStore are reported by the handlers
+    if (Try(storeManager.getStore(req.collection).groupsCommits).getOrElse(false)) putGrouped(req)
+    else withExceptionHandler(req, pools.write) {
+      val store = storeManager.getStore(req.collection)
+      val version = store.withKeyIterator(req.key){rocksIt => req.version.getOrElse(store.listVersions(rocksIt, req.key, Some(1), None).headOption.map(_ + 1).getOrElse(0L))}
+      require(version >= 0, "Version numbers must be non-negative")
+      store.put(req.key, version, ByteStringConversions.toByteArray(req.value))
+      PutReply(success = true)
+    } { errorMsg => PutReply(success = false, errorMsg) }
+
+  // The put is queued for the group commit of the collection instead of taking a thread of the write pool
+  private def putGrouped(req: PutRequest): Future[PutReply] = withAsyncExceptionHandler(req) {
+    require(req.version.forall(_ >= 0), "Version numbers must be non-negative")
+    storeManager.getStore(req.collection).putGrouped(req.key, req.version, ByteStringConversions.toByteArray(req.value))
+      .map(_ => PutReply(success = true))(ExecutionContext.parasitic)
   } { errorMsg => PutReply(success = false, errorMsg) }
 
-  override def putMultipleVersions(req: PutMultipleVersionsRequest): Future[PutMultipleVersionsReply] = withExceptionHandler(req) {
+  override def putMultipleVersions(req: PutMultipleVersionsRequest): Future[PutMultipleVersionsReply] = withExceptionHandler(req, pools.write) {
     val store = storeManager.getStore(req.collection)
     require(req.versions.length == req.values.length, s"Must supply as many versions as values, got ${req.versions.length} versions vs ${req.values.length} values.")
     require(req.versions.forall(_ >= 0), "Version numbers must be non-negative")
-    req.versions.zip(req.values).foreach { case (version, value) =>
-      store.put(req.key, version, value.toByteArray)
-    }
+    store.putMultiple(req.versions.zip(req.values).map { case (version, value) => (req.key, version, ByteStringConversions.toByteArray(value)) })
     PutMultipleVersionsReply(success = true)
   } { errorMsg => PutMultipleVersionsReply(success = false, errorMsg)}
 
-  override def delete(req: DeleteRequest): Future[DeleteReply] = withExceptionHandler(req) {
+  override def delete(req: DeleteRequest): Future[DeleteReply] = withExceptionHandler(req, pools.write) {
     val store = storeManager.getStore(req.collection)
     store.delete(req.key, req.version)
     DeleteReply(success = true)
   } { errorMsg => DeleteReply(success = false, errorMsg) }
 
-  override def getMultipleVersions(req: GetMultipleVersionsRequest): Future[GetMultipleVersionsReply] = withExceptionHandler(req) {
+  override def getMultipleVersions(req: GetMultipleVersionsRequest): Future[GetMultipleVersionsReply] = withExceptionHandler(req, pools.read) {
     val store = storeManager.getStore(req.collection)
-    val (values, versions) = store.withRawRocksIterator{rocksIt => store.getMultipleVersions(rocksIt, req.key, req.oldestVersion, req.newestVersion)}
-    GetMultipleVersionsReply(success = true, None, values.map(ByteString.copyFrom), versions)
+    val (values, versions) = store.withKeySnapshotIterator(req.key){(readOptions, rocksIt) => store.getMultipleVersions(rocksIt, req.key, req.oldestVersion, req.newestVersion, readOptions)}
+    GetMultipleVersionsReply(success = true, None, values.map(ByteStringConversions.wrap), versions)
   } { errorMsg => GetMultipleVersionsReply(success = false, errorMsg) }
 
-  override def getMultipleKeys(req: GetMultipleKeysRequest): Future[GetMultipleKeysReply] = withExceptionHandler(req) {
+  override def getMultipleKeys(req: GetMultipleKeysRequest): Future[GetMultipleKeysReply] = withExceptionHandler(req, pools.scan) {
     val store = storeManager.getStore(req.collection)
-    val (keys, values, versions) = store.withRawRocksIterator{rocksIt => store.getMultipleKeys(rocksIt, req.startAfterKey, req.prefix, req.version, req.limit)}
-    GetMultipleKeysReply(success = true, None, keys, values.map(ByteString.copyFrom), versions)
+    val (keys, values, versions) = storeManager.withSnapshot(req.snapshot) { snapshot =>
+      store.withSnapshotIterator(snapshot) { (readOptions, rocksIt) =>
+        store.getMultipleKeys(rocksIt, req.startAfterKey, req.prefix, req.version, req.limit, Some(readOptions))
+      }
+    }
+    GetMultipleKeysReply(success = true, None, keys, values.map(ByteStringConversions.wrap), versions)
   } { errorMsg => GetMultipleKeysReply(success = false, errorMsg) }
 
-  override def getMultipleKeysByListWithMultipleVersions(req: GetMultipleKeysByListWithMultipleVersionsRequest): Future[GetMultipleKeysByListWithMultipleVersionsReply] = withExceptionHandler(req) {
+  override def getMultipleKeysByListWithMultipleVersions(req: GetMultipleKeysByListWithMultipleVersionsRequest): Future[GetMultipleKeysByListWithMultipleVersionsReply] = withExceptionHandler(req, pools.read) {
     val store = storeManager.getStore(req.collection)
-    val keyVersionsValuesPairs = req.keys.map { key =>
-      val (values, versions) = store.withRawRocksIterator{rocksIt => store.getMultipleVersions(rocksIt, key, req.oldestVersion, req.newestVersion)}
+    val results = storeManager.withSnapshot(req.snapshot)(store.getMultipleKeysByListWithMultipleVersions(req.keys, req.oldestVersion, req.newestVersion, _))
+    val keyVersionsValuesPairs = results.map { case (key, values, versions) =>
       val versionValuePairs = values.zip(versions).map { case (value, version) =>
-        VersionValuePairProto(version, ByteString.copyFrom(value))
+        VersionValuePairProto(version, ByteStringConversions.wrap(value))
       }
       KeyVersionsValuesPairProto(key, versionValuePairs)
     }.filter(_.versionValuePairs.nonEmpty)
     GetMultipleKeysByListWithMultipleVersionsReply(success = true, None, keyVersionsValuesPairs)
   } { errorMsg => GetMultipleKeysByListWithMultipleVersionsReply(success = false, errorMsg) }
 
-  override def getMultipleKeysByList(req: GetMultipleKeysByListRequest): Future[GetMultipleKeysByListReply] = withExceptionHandler(req) {
+  override def getMultipleKeysByList(req: GetMultipleKeysByListRequest): Future[GetMultipleKeysByListReply] = withExceptionHandler(req, pools.read) {
     val store = storeManager.getStore(req.collection)
-    val versionValueBoxes = req.keys.map { key =>
-      val versionedKeyValuePairOpt = store.withRawRocksIterator { rocksIt => store.get(rocksIt, key, req.version) }
-      versionedKeyValuePairOpt match {
-        case Some(pair) => VersionValueBoxProto(Some(VersionValuePairProto(pair.version, ByteString.copyFrom(pair.value))), errorMessage = None)
-        case None => VersionValueBoxProto(None, errorMessage = None)
-      }
+    val versionValueBoxes = storeManager.withSnapshot(req.snapshot)(store.getMultipleKeysByList(req.keys, req.version, _)).map {
+      case Some(pair) => VersionValueBoxProto(Some(VersionValuePairProto(pair.version, ByteStringConversions.wrap(pair.value))), errorMessage = None)
+      case None => VersionValueBoxProto(None, errorMessage = None)
     }
     GetMultipleKeysByListReply(success = true, None, versionValueBoxes)
   } { errorMsg => GetMultipleKeysByListReply(success = false, errorMsg) }
 
-  override def putMultipleKeysWithMultipleVersions(req: PutMultipleKeysWithMultipleVersionsRequest): Future[PutMultipleKeysWithMultipleVersionsReply] = withExceptionHandler(req) {
+  override def putMultipleKeysWithMultipleVersions(req: PutMultipleKeysWithMultipleVersionsRequest): Future[PutMultipleKeysWithMultipleVersionsReply] = withExceptionHandler(req, pools.write) {
     val store = storeManager.getStore(req.collection)
     require(req.versionedKeyValuePairs.forall(_.version >= 0), "Version numbers must be non-negative")
-    req.versionedKeyValuePairs.foreach { pair =>
-      store.put(pair.key, pair.version, pair.value.toByteArray)
-    }
+    store.putMultiple(req.versionedKeyValuePairs.map(pair => (pair.key, pair.version, ByteStringConversions.toByteArray(pair.value))))
     PutMultipleKeysWithMultipleVersionsReply(success = true, None)
   } { errorMsg => PutMultipleKeysWithMultipleVersionsReply(success = false, errorMsg) }
 
-  override def deleteMultipleVersions(req: DeleteMultipleVersionsRequest): Future[DeleteMultipleVersionsReply] = withExceptionHandler(req) {
+  override def deleteMultipleVersions(req: DeleteMultipleVersionsRequest): Future[DeleteMultipleVersionsReply] = withExceptionHandler(req, pools.write) {
     val store = storeManager.getStore(req.collection)
-    store.withRawRocksIterator{rocksIt => store.deleteMultipleVersions(rocksIt, req.key, req.oldestVersion, req.newestVersion)}
+    store.deleteMultipleVersions(req.key, req.oldestVersion, req.newestVersion)
     DeleteMultipleVersionsReply(success = true)
   } { errorMsg => DeleteMultipleVersionsReply(success = false, errorMsg) }
 
-  override def deleteAllByPrefix(req: DeleteAllByPrefixRequest): Future[DeleteAllByPrefixReply] = withExceptionHandler(req) {
+  override def deleteAllByPrefix(req: DeleteAllByPrefixRequest): Future[DeleteAllByPrefixReply] = withExceptionHandler(req, pools.write) {
     val store = storeManager.getStore(req.collection)
-    store.withRawRocksIterator{rocksIt => store.deleteAllByPrefix(rocksIt, req.prefix)}
+    store.deleteAllByPrefix(req.prefix)
     DeleteAllByPrefixReply(success = true)
   } { errorMsg => DeleteAllByPrefixReply(success = false, errorMsg)}
 
-  override def listKeys(req: ListKeysRequest): Future[ListKeysReply] = withExceptionHandler(req) {
+  override def listKeys(req: ListKeysRequest): Future[ListKeysReply] = withExceptionHandler(req, pools.scan) {
     val store = storeManager.getStore(req.collection)
-    val keys = store.withRawRocksIterator{rocksIt => store.listKeys(rocksIt, req.limit, req.startAfterKey, req.prefix)}
+    val keys = storeManager.withSnapshot(req.snapshot) {
+      case Some(snapshot) => store.withSnapshotIterator(Some(snapshot))((_, rocksIt) => store.listKeys(rocksIt, req.limit, req.startAfterKey, req.prefix))
+      case None => store.withRawRocksIterator(rocksIt => store.listKeys(rocksIt, req.limit, req.startAfterKey, req.prefix))
+    }
     ListKeysReply(success = true, None, keys)
   } { errorMsg => ListKeysReply(success = false, errorMsg) }
 
-  override def listVersions(req: ListVersionsRequest): Future[ListVersionsReply] = withExceptionHandler(req) {
+  override def listVersions(req: ListVersionsRequest): Future[ListVersionsReply] = withExceptionHandler(req, pools.read) {
     val store = storeManager.getStore(req.collection)
-    val versions = store.withRawRocksIterator{rocksIt => store.listVersions(rocksIt, req.key, req.limit, req.offset)}
-    ListVersionsReply(success = true, None, versions)
+    val oldestFirst = req.oldestFirst.getOrElse(false)
+    store.withKeyIterator(req.key) { rocksIt =>
+      if (req.includeValueSizes.getOrElse(false)) {
+        val versionsWithSizes = store.listVersionsWithValueSizes(rocksIt, req.key, req.limit, req.offset, req.oldestVersion, req.newestVersion, oldestFirst)
+        ListVersionsReply(success = true, None, versionsWithSizes.map(_._1), versionsWithSizes.map(_._2.toLong))
+      } else {
+        val versions = store.listVersions(rocksIt, req.key, req.limit, req.offset, req.oldestVersion, req.newestVersion, oldestFirst)
+        ListVersionsReply(success = true, None, versions)
+      }
+    }
   } { errorMsg => ListVersionsReply(success = false, errorMsg) }
 
-  override def backup(req: BackupRequest): Future[BackupReply] = withExceptionHandler(req) {
+  override def count(req: CountRequest): Future[CountReply] = withExceptionHandler(req, pools.scan) {
+    val store = storeManager.getStore(req.collection)
+    require(req.key.isEmpty || req.prefix.isEmpty, "Can count either the versions of one key or all keys with a prefix")
+    val keyCount = store.withRawRocksIterator { rocksIt =>
+      req.key match {
+        case Some(key) => store.countVersions(rocksIt, key)
+        case None if req.estimate.getOrElse(false) && req.prefix.isEmpty => store.estimateCount(rocksIt)
+        case None => store.count(rocksIt, req.prefix)
+      }
+    }
+    CountReply(success = true, None, keyCount.keys, keyCount.versions, estimated = !keyCount.exact)
+  } { errorMsg => CountReply(success = false, errorMsg, 0, 0, estimated = false) }
+
+  // The handlers of the call are registered here, opening the scan and producing the chunks runs on the scan executor
+  override def scan(req: ScanRequest, responseObserver: StreamObserver[ScanReply]): Unit = {
+    val startTime = System.nanoTime()
+    logger.debug("received " + requestToString(req))
+    new ScanStreamer(responseObserver.asInstanceOf[ServerCallStreamObserver[ScanReply]], pools.scan,
+      req.maxChunkEntries.getOrElse(ScanStreamer.defaultMaxChunkEntries),
+      req.maxChunkBytes.map(_.toLong).getOrElse(ScanStreamer.defaultMaxChunkBytes),
+      (sentBytes, success) => metrics.foreach(_.recordRpc("Scan", Some(req.collection), System.nanoTime() - startTime, req.serializedSize, sentBytes, success))
+    ).start {
+      val store = storeManager.getStore(req.collection)
+      val snapshotIt = store.newSnapshotIterator()
+      try {
+        (snapshotIt, store.scan(snapshotIt.rocksIt, req.startAfterKey, req.prefix, req.version, req.allVersions.getOrElse(false), Some(snapshotIt.readOptions)))
+      } catch {
+        case e: Exception =>
+          snapshotIt.close()
+          throw e
+      }
+    }
+  }
+
+  override def backup(req: BackupRequest): Future[BackupReply] = withExceptionHandler(req, pools.admin) {
     val backupInfoOpt = storeManager.backup
     backupInfoOpt match {
       case Some(backupInfo) => BackupReply(success = true, None, backupInfo.id, backupInfo.timestamp, backupInfo.size)
@@ -129,30 +184,104 @@ class FossilDBGrpcImpl(storeManager: StoreManager)
     }
   } { errorMsg => BackupReply(success = false, errorMsg, 0, 0, 0) }
 
-  override def restoreFromBackup(req: RestoreFromBackupRequest): Future[RestoreFromBackupReply] = withExceptionHandler(req) {
+  override def startBackup(req: StartBackupRequest): Future[StartBackupReply] = withExceptionHandler(req, pools.admin) {
+    StartBackupReply(success = true, None, storeManager.startBackup().jobId)
+  } { errorMsg => StartBackupReply(success = false, errorMsg, 0) }
+
+  // Status requests run directly, so they are answered even while the admin executor is busy with long operations
+  override def getBackupStatus(req: GetBackupStatusRequest): Future[GetBackupStatusReply] = withExceptionHandler(req, DirectExecutor) {
+    val status = storeManager.backupStatus(req.jobId)
+    GetBackupStatusReply(success = true, None, status.jobId, status.state, status.startTime, status.endTime, status.bytesCopied, status.dbBytes,
+      status.backupInfo.map(info => BackupReply(success = true, None, info.id, info.timestamp, info.size)), status.error)
+  } { errorMsg => GetBackupStatusReply(success = false, errorMsg, 0, "", 0, None, 0, 0) }
+
+  override def restoreFromBackup(req: RestoreFromBackupRequest): Future[RestoreFromBackupReply] = withExceptionHandler(req, pools.admin) {
     storeManager.restoreFromBackup()
     RestoreFromBackupReply(success = true)
   } { errorMsg => RestoreFromBackupReply(success = false, errorMsg) }
 
-  override def compactAllData(req: CompactAllDataRequest): Future[CompactAllDataReply] = withExceptionHandler(req) {
+  override def compactAllData(req: CompactAllDataRequest): Future[CompactAllDataReply] = withExceptionHandler(req, pools.admin) {
     storeManager.compactAllData()
     CompactAllDataReply(success = true)
   } { errorMsg => CompactAllDataReply(success = false, errorMsg) }
 
-  override def exportDB(req: ExportDBRequest): Future[ExportDBReply] = withExceptionHandler(req) {
+  override def exportDB(req: ExportDBRequest): Future[ExportDBReply] = withExceptionHandler(req, pools.admin) {
     storeManager.exportDB(req.newDataDir, req.optionsFile)
     ExportDBReply(success = true)
   } { errorMsg => ExportDBReply(success = false, errorMsg) }
 
-  private def withExceptionHandler[T, R <: GeneratedMessage](request: R)(tryBlock: => T)(onErrorBlock: Option[String] => T): Future[T] = {
-    try {
-      logger.debug("received " + requestToString(request))
-      Future.successful(tryBlock)
-    } catch {
-      case e: Exception =>
-        log(e, request)
-        Future.successful(onErrorBlock(Some(e.toString)))
+  override def getExportStatus(req: GetExportStatusRequest): Future[GetExportStatusReply] = withExceptionHandler(req, DirectExecutor) {
+    val status = storeManager.exportStatus
+    GetExportStatusReply(success = true, None, status.newDataDir, status.state, status.method, status.startTime, status.endTime,
+      status.entriesWritten, status.bytesWritten, status.estimatedEntries, status.columnFamily, status.error)
+  } { errorMsg => GetExportStatusReply(success = false, errorMsg, "", "", "", 0, None, 0, 0, 0) }
+
+  override def applyRetention(req: ApplyRetentionRequest): Future[ApplyRetentionReply] = withExceptionHandler(req, pools.admin) {
+    ApplyRetentionReply(success = true, None, storeManager.applyRetention(req.collection))
+  } { errorMsg => ApplyRetentionReply(success = false, errorMsg, 0) }
+
+  override def acquireSnapshot(req: AcquireSnapshotRequest): Future[AcquireSnapshotReply] = withExceptionHandler(req, pools.read) {
+    val token = storeManager.acquireSnapshot(req.ttlSeconds)
+    AcquireSnapshotReply(success = true, None, token.id, token.expiresAt)
+  } { errorMsg => AcquireSnapshotReply(success = false, errorMsg, 0, 0) }
+
+  override def releaseSnapshot(req: ReleaseSnapshotRequest): Future[ReleaseSnapshotReply] = withExceptionHandler(req, pools.read) {
+    storeManager.releaseSnapshot(req.snapshot)
+    ReleaseSnapshotReply(success = true, None)
+  } { errorMsg => ReleaseSnapshotReply(success = false, errorMsg) }
+
+  override def compressionStats(req: CompressionStatsRequest): Future[CompressionStatsReply] = withExceptionHandler(req, pools.admin) {
+    val collections = storeManager.compressionStats(req.collection).map { stats =>
+      CollectionCompressionStatsProto(stats.columnFamily, stats.compressions, stats.sstFiles, stats.entries, stats.rawBytes, stats.compressedBytes)
     }
+    CompressionStatsReply(success = true, None, collections)
+  } { errorMsg => CompressionStatsReply(success = false, errorMsg) }
+
+  override def cacheStats(req: CacheStatsRequest): Future[CacheStatsReply] = withExceptionHandler(req, pools.admin) {
+    val stats = storeManager.cacheStats
+    CacheStatsReply(success = true, None, stats.blockCacheCapacity, stats.blockCacheUsage,
+      stats.tickers.map { case (name, count) => TickerProto(name, count) },
+      stats.readCaches.map { case (collection, cache) =>
+        ReadCacheStatsProto(collection, cache.hits, cache.misses, cache.coalesced, cache.entries, cache.bytes)
+      })
+  } { errorMsg => CacheStatsReply(success = false, errorMsg, 0, 0) }
+
+  // Requests rejected by a saturated executor fail with RESOURCE_EXHAUSTED and are not counted in the rpc metrics
+  private def withExceptionHandler[T <: GeneratedMessage, R <: GeneratedMessage](request: R, executor: RequestExecutor)(tryBlock: => T)(onErrorBlock: Option[String] => T): Future[T] = {
+    val startTime = System.nanoTime()
+    executor.submit {
+      val (reply, success) = try {
+        logger.debug("received " + requestToString(request))
+        (tryBlock, true)
+      } catch {
+        case e: Exception =>
+          log(e, request)
+          (onErrorBlock(Some(e.toString)), false)
+      }
+      metrics.foreach(_.recordRpc(request, reply, System.nanoTime() - startTime, success))
+      reply
+    }
+  }
+
+  // As withExceptionHandler, for requests that complete asynchronously without blocking a thread of a pool
+  private def withAsyncExceptionHandler[T <: GeneratedMessage, R <: GeneratedMessage](request: R)(tryBlock: => Future[T])(onErrorBlock: Option[String] => T): Future[T] = {
+    val startTime = System.nanoTime()
+    logger.debug("received " + requestToString(request))
+    val replyFuture = try tryBlock catch {
+      case e: Exception => Future.failed(e)
+    }
+    replyFuture.transform {
+      case Success(reply) => Success((reply, true))
+      // Like rejections of a pool, the client is expected to back off and retry
+      case Failure(e: StatusRuntimeException) => Failure(e)
+      case Failure(e: Exception) =>
+        log(e, request)
+        Success((onErrorBlock(Some(e.toString)), false))
+      case Failure(e) => Failure(e)
+    }(ExecutionContext.parasitic).map { case (reply, success) =>
+      metrics.foreach(_.recordRpc(request, reply, System.nanoTime() - startTime, success))
+      reply
+    }(ExecutionContext.parasitic)
   }
 
   private def log[R <: GeneratedMessage](e: Exception, request: R): Unit = {
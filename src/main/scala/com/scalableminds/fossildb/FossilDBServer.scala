@@ -8,21 +8,29 @@ import io.grpc.Server
 import io.grpc.netty.NettyServerBuilder
 import io.grpc.protobuf.services.HealthStatusManager
 
+import java.util.concurrent.TimeUnit
 import scala.concurrent.ExecutionContext
 
-class FossilDBServer(storeManager: StoreManager, port: Int, executionContext: ExecutionContext) extends LazyLogging
+class FossilDBServer(storeManager: StoreManager, port: Int, executionContext: ExecutionContext, metricsPort: Option[Int] = None,
+                     poolConfigs: Map[String, PoolConfig] = Map.empty) extends LazyLogging
 { self =>
   private[this] var server: Server = null
   private[this] var healthStatusManager: HealthStatusManager = null
+  private[this] var metricsServer: Option[MetricsServer] = None
+  private[this] var pools: ExecutorPools = null
 
   def start(): Unit = {
     healthStatusManager = new HealthStatusManager()
+    pools = new ExecutorPools(poolConfigs)
+    val metrics = metricsPort.map(_ => new Metrics(storeManager.columnFamilies, pools.all))
+    metricsServer = metricsPort.zip(metrics).map { case (p, m) => new MetricsServer(m, storeManager, p) }
     server = NettyServerBuilder.forPort(port).maxInboundMessageSize(Int.MaxValue)
-      .addService(FossilDBGrpc.bindService(new FossilDBGrpcImpl(storeManager), executionContext))
+      .addService(FossilDBGrpc.bindService(new FossilDBGrpcImpl(storeManager, metrics, pools), executionContext))
       .addService(healthStatusManager.getHealthService)
       .build.start
     healthStatusManager.setStatus("", HealthCheckResponse.ServingStatus.SERVING)
     logger.info("Server started, listening on " + port)
+    metricsServer.foreach(_.start())
     sys.addShutdownHook {
       logger.info("Shutting down gRPC server since JVM is shutting down")
       self.stop()
@@ -31,10 +39,15 @@ class FossilDBServer(storeManager: StoreManager, port: Int, executionContext: Ex
   }
 
   def stop(): Unit = {
+    metricsServer.foreach(_.stop())
+    metricsServer = None
     if (server != null) {
+      healthStatusManager.setStatus("", HealthCheckResponse.ServingStatus.NOT_SERVING)
+      // The store is only closed once no request can use it anymore
       server.shutdown()
+      server.awaitTermination(ExecutorPools.shutdownTimeoutSeconds, TimeUnit.SECONDS)
+      pools.shutdown()
       storeManager.close
-      healthStatusManager.setStatus("", HealthCheckResponse.ServingStatus.NOT_SERVING)
     }
   }
 
@@ -0,0 +1,148 @@
+package com.scalableminds.fossildb
+
+import com.scalableminds.fossildb.db.{CacheStats, PropertySample, ReadCacheStats}
+import scalapb.GeneratedMessage
+import scalapb.descriptors.PString
+
+import java.util.concurrent.ConcurrentHashMap
+import java.util.concurrent.atomic.{DoubleAdder, LongAdder}
+import scala.jdk.CollectionConverters.ConcurrentMapHasAsScala
+
+class Histogram(val bucketBounds: Seq[Double]) {
+
+  private val bucketCounts = Array.fill(bucketBounds.length)(new LongAdder)
+  private val sum = new DoubleAdder
+  private val count = new LongAdder
+
+  def observe(value: Double): Unit = {
+    val bucket = bucketBounds.indexWhere(value <= _)
+    if (bucket >= 0) bucketCounts(bucket).increment()
+    sum.add(value)
+    count.increment()
+  }
+
+  // Cumulative counts per bucket bound, the sum and the total count, as in the text exposition format
+  def snapshot: (Seq[(Double, Long)], Double, Long) = {
+    val cumulativeCounts = bucketCounts.map(_.sum).scanLeft(0L)(_ + _).tail
+    (bucketBounds.zip(cumulativeCounts), sum.sum, math.max(count.sum, cumulativeCounts.lastOption.getOrElse(0L)))
+  }
+
+}
+
+class RpcMetrics {
+  val duration = new Histogram(Metrics.durationBucketsSeconds)
+  val requestBytes = new LongAdder
+  val responseBytes = new LongAdder
+  val errors = new LongAdder
+}
+
+/*
+   Collects per RPC and collection call durations, payload sizes and errors, and holds the latest sample of
+   RocksDB properties and statistics. Requests for collections that do not exist are counted under "unknown",
+   so clients cannot create arbitrarily many label values. The state of the request executors is read at render time.
+ */
+class Metrics(collections: Seq[String], executors: Seq[BoundedExecutor] = Seq.empty) {
+
+  private val knownCollections = collections.toSet
+  private val rpcs = new ConcurrentHashMap[(String, String), RpcMetrics]()
+
+  @volatile private var propertySamples: Seq[PropertySample] = Seq.empty
+  @volatile private var cacheStats: Option[CacheStats] = None
+
+  def recordRpc(request: GeneratedMessage, reply: GeneratedMessage, durationNanos: Long, success: Boolean): Unit =
+    recordRpc(Metrics.rpcName(request), Metrics.collectionOf(request), durationNanos, request.serializedSize, reply.serializedSize, success)
+
+  def recordRpc(rpc: String, collection: Option[String], durationNanos: Long, requestBytes: Long, responseBytes: Long, success: Boolean): Unit = {
+    val collectionLabel = collection.map(c => if (knownCollections.contains(c)) c else "unknown").getOrElse("")
+    val metrics = rpcs.computeIfAbsent((rpc, collectionLabel), _ => new RpcMetrics)
+    metrics.duration.observe(durationNanos / 1e9)
+    metrics.requestBytes.add(requestBytes)
+    metrics.responseBytes.add(responseBytes)
+    if (!success) metrics.errors.increment()
+  }
+
+  def updateDbStats(samples: Seq[PropertySample], stats: CacheStats): Unit = {
+    propertySamples = samples
+    cacheStats = Some(stats)
+  }
+
+  def render: String = {
+    val out = new StringBuilder
+    def header(name: String, kind: String, help: String): Unit = out ++= s"# HELP $name $help\n# TYPE $name $kind\n"
+    def line(name: String, labels: String, value: Any): Unit = out ++= s"$name${if (labels.isEmpty) "" else s"{$labels}"} $value\n"
+
+    val rpcEntries = rpcs.asScala.toSeq.sortBy(_._1)
+    def rpcLabels(key: (String, String)): String = s"""rpc="${Metrics.escape(key._1)}",collection="${Metrics.escape(key._2)}""""
+
+    header("fossildb_rpc_duration_seconds", "histogram", "Duration of gRPC calls, for Scan until the stream ended")
+    rpcEntries.foreach { case (key, metrics) =>
+      val (buckets, sum, count) = metrics.duration.snapshot
+      buckets.foreach { case (bound, cumulativeCount) =>
+        line("fossildb_rpc_duration_seconds_bucket", s"""${rpcLabels(key)},le="$bound"""", cumulativeCount)
+      }
+      line("fossildb_rpc_duration_seconds_bucket", s"""${rpcLabels(key)},le="+Inf"""", count)
+      line("fossildb_rpc_duration_seconds_sum", rpcLabels(key), sum)
+      line("fossildb_rpc_duration_seconds_count", rpcLabels(key), count)
+    }
+    header("fossildb_rpc_request_bytes_total", "counter", "Serialized size of gRPC requests")
+    rpcEntries.foreach { case (key, metrics) => line("fossildb_rpc_request_bytes_total", rpcLabels(key), metrics.requestBytes.sum) }
+    header("fossildb_rpc_response_bytes_total", "counter", "Serialized size of gRPC replies")
+    rpcEntries.foreach { case (key, metrics) => line("fossildb_rpc_response_bytes_total", rpcLabels(key), metrics.responseBytes.sum) }
+    header("fossildb_rpc_errors_total", "counter", "gRPC calls that failed with an error")
+    rpcEntries.foreach { case (key, metrics) => line("fossildb_rpc_errors_total", rpcLabels(key), metrics.errors.sum) }
+
+    def executorGauge(name: String, kind: String, help: String, value: BoundedExecutor => Any): Unit = if (executors.nonEmpty) {
+      header(name, kind, help)
+      executors.foreach(executor => line(name, s"""pool="${Metrics.escape(executor.name)}"""", value(executor)))
+    }
+    executorGauge("fossildb_executor_queue_size", "gauge", "Requests waiting for a thread of the executor", _.queueSize)
+    executorGauge("fossildb_executor_active_threads", "gauge", "Threads of the executor currently handling a request", _.activeThreads)
+    executorGauge("fossildb_executor_completed_total", "counter", "Requests handled by the executor", _.completedCount)
+    executorGauge("fossildb_executor_rejected_total", "counter", "Requests rejected with RESOURCE_EXHAUSTED because the executor queue was full", _.rejectedCount)
+
+    propertySamples.groupBy(_.property).toSeq.sortBy(_._1).foreach { case (property, samples) =>
+      val name = Metrics.metricName(property)
+      header(name, "gauge", s"RocksDB property $property")
+      samples.foreach(sample => line(name, sample.columnFamily.map(cf => s"""collection="${Metrics.escape(cf)}"""").getOrElse(""), sample.value))
+    }
+    cacheStats.foreach { stats =>
+      header("fossildb_block_cache_capacity_bytes", "gauge", "Capacity of the shared block cache")
+      line("fossildb_block_cache_capacity_bytes", "", stats.blockCacheCapacity)
+      header("fossildb_block_cache_usage_bytes", "gauge", "Memory used by the shared block cache")
+      line("fossildb_block_cache_usage_bytes", "", stats.blockCacheUsage)
+      stats.tickers.foreach { case (ticker, count) =>
+        val name = Metrics.metricName("rocksdb." + ticker) + "_total"
+        header(name, "counter", s"RocksDB ticker $ticker")
+        line(name, "", count)
+      }
+      def readCacheMetric(name: String, kind: String, help: String, value: ReadCacheStats => Long): Unit = if (stats.readCaches.nonEmpty) {
+        header(name, kind, help)
+        stats.readCaches.foreach { case (collection, cache) => line(name, s"""collection="${Metrics.escape(collection)}"""", value(cache)) }
+      }
+      readCacheMetric("fossildb_read_cache_hits_total", "counter", "Get requests answered from the read cache", _.hits)
+      readCacheMetric("fossildb_read_cache_misses_total", "counter", "Get requests that read from RocksDB", _.misses)
+      readCacheMetric("fossildb_read_cache_coalesced_total", "counter", "Get requests that waited for an identical concurrent one instead of reading", _.coalesced)
+      readCacheMetric("fossildb_read_cache_entries", "gauge", "Entries in the read cache", _.entries)
+      readCacheMetric("fossildb_read_cache_bytes", "gauge", "Estimated memory used by the read cache", _.bytes)
+    }
+    out.toString
+  }
+
+}
+
+object Metrics {
+  val durationBucketsSeconds: Seq[Double] = Seq(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+  def rpcName(request: GeneratedMessage): String = request.companion.scalaDescriptor.name.stripSuffix("Request")
+
+  def collectionOf(request: GeneratedMessage): Option[String] =
+    request.companion.scalaDescriptor.findFieldByName("collection").map(request.getField) match {
+      case Some(PString(collection)) => Some(collection)
+      case _ => None
+    }
+
+  // rocksdb.estimate-pending-compaction-bytes becomes fossildb_rocksdb_estimate_pending_compaction_bytes
+  def metricName(property: String): String = "fossildb_" + property.toLowerCase.replaceAll("[^a-z0-9_]", "_")
+
+  def escape(labelValue: String): String = labelValue.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+}
@@ -0,0 +1,57 @@
+package com.scalableminds.fossildb
+
+import com.scalableminds.fossildb.db.StoreManager
+import com.sun.net.httpserver.{HttpExchange, HttpServer}
+import com.typesafe.scalalogging.LazyLogging
+
+import java.net.InetSocketAddress
+import java.nio.charset.StandardCharsets
+import java.util.concurrent.{Executors, TimeUnit}
+
+/*
+   Serves the metrics in the Prometheus text exposition format at http://<host>:<port>/metrics and samples
+   the RocksDB properties and statistics in the background, so scrapes never touch the db.
+ */
+class MetricsServer(metrics: Metrics, storeManager: StoreManager, port: Int) extends LazyLogging {
+
+  private val server = HttpServer.create(new InetSocketAddress(port), 0)
+  private val sampler = Executors.newSingleThreadScheduledExecutor()
+
+  def start(): Unit = {
+    server.createContext("/metrics", (exchange: HttpExchange) => respond(exchange))
+    server.start()
+    sampler.scheduleAtFixedRate(() => sample(), 0, MetricsServer.samplingIntervalSeconds, TimeUnit.SECONDS)
+    logger.info("Metrics server started, listening on " + port)
+  }
+
+  private def respond(exchange: HttpExchange): Unit = {
+    val body = metrics.render.getBytes(StandardCharsets.UTF_8)
+    exchange.getResponseHeaders.set("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+    exchange.sendResponseHeaders(200, body.length)
+    val out = exchange.getResponseBody
+    try {
+      out.write(body)
+    } finally {
+      out.close()
+    }
+  }
+
+  // An exception would cancel all further runs of the scheduled task
+  private def sample(): Unit = {
+    try {
+      metrics.updateDbStats(storeManager.propertySamples, storeManager.cacheStats)
+    } catch {
+      case e: Exception => logger.debug("Could not sample RocksDB statistics: " + e.toString)
+    }
+  }
+
+  def stop(): Unit = {
+    sampler.shutdownNow()
+    server.stop(0)
+  }
+
+}
+
+object MetricsServer {
+  val samplingIntervalSeconds: Long = 10
+}
@@ -0,0 +1,141 @@
+package com.scalableminds.fossildb
+
+import com.scalableminds.fossildb.db.VersionedKeyValuePair
+import com.scalableminds.fossildb.proto.fossildbapi.{ScanReply, VersionedKeyValuePairProto}
+import com.typesafe.scalalogging.LazyLogging
+import io.grpc.StatusRuntimeException
+import io.grpc.stub.ServerCallStreamObserver
+
+import java.util.concurrent.atomic.AtomicBoolean
+import scala.collection.mutable
+import scala.concurrent.ExecutionContext
+import scala.util.Failure
+
+/*
+   Streams the entries of one scan in chunks, holding a single RocksDB iterator (and with it a snapshot of the
+   db) open for the whole call. Chunks are only produced while the client is ready to receive them,
+   so a slow reader does not make the server buffer the whole collection. Opening the scan and producing the
+   chunks run on executor, the handlers of the call are registered by start on the calling gRPC thread, as
+   they cannot be changed once the service method returned. onFinished is called once with the total size
+   of the sent replies and whether the scan completed successfully.
+ */
+class ScanStreamer(responseObserver: ServerCallStreamObserver[ScanReply],
+                   executor: RequestExecutor,
+                   maxChunkEntries: Int,
+                   maxChunkBytes: Long,
+                   onFinished: (Long, Boolean) => Unit = (_, _) => ()) extends LazyLogging {
+
+  // Guarded by this, like all calls of responseObserver
+  private var closed = false
+  private var source: Option[(AutoCloseable, Iterator[VersionedKeyValuePair[Array[Byte]]])] = None
+  private var sentBytes = 0L
+
+  // Whether a drain is submitted or running, so that ready events do not queue up several of them
+  private val draining = new AtomicBoolean(false)
+
+  /*
+     Must be called from the service method. If executor rejects the scan right away, the call fails with
+     that status on the calling thread, without counting as a finished scan.
+   */
+  def start(open: => (AutoCloseable, Iterator[VersionedKeyValuePair[Array[Byte]]])): Unit = {
+    responseObserver.setOnCancelHandler(() => close(success = false))
+    responseObserver.setOnReadyHandler(() => scheduleDrain())
+    draining.set(true)
+    val opened = executor.submit {
+      val (iterator, entries) = open
+      val keep = synchronized {
+        if (!closed) source = Some((iterator, entries))
+        !closed
+      }
+      if (!keep) iterator.close()
+    }
+    opened.value match {
+      case Some(Failure(e: StatusRuntimeException)) =>
+        synchronized { closed = true }
+        responseObserver.onError(e)
+      case _ =>
+        opened.onComplete { result =>
+          result.failed.foreach(fail)
+          finishDrain()
+        }(ExecutionContext.parasitic)
+    }
+  }
+
+  private def scheduleDrain(): Unit =
+    if (draining.compareAndSet(false, true)) {
+      executor.submit(drain()).failed.foreach { e =>
+        draining.set(false)
+        fail(e)
+      }(ExecutionContext.parasitic)
+    }
+
+  private def drain(): Unit = {
+    synchronized {
+      try {
+        source.filter(_ => !closed).foreach { case (_, entries) =>
+          while (!closed && responseObserver.isReady && entries.hasNext) {
+            val reply = ScanReply(success = true, None, nextChunk(entries))
+            sentBytes += reply.serializedSize
+            responseObserver.onNext(reply)
+          }
+          if (!closed && !entries.hasNext) {
+            close(success = true)
+            responseObserver.onCompleted()
+          }
+        }
+      } catch {
+        case e: Exception => fail(e)
+      }
+    }
+    finishDrain()
+  }
+
+  // A ready event during the drain found it still running, so it is checked again here
+  private def finishDrain(): Unit = {
+    draining.set(false)
+    if (responseObserver.isReady && synchronized(!closed && source.isDefined)) scheduleDrain()
+  }
+
+  private def fail(e: Throwable): Unit = synchronized {
+    logger.warn("Scan failed: " + e.toString)
+    if (!closed) {
+      e match {
+        // Rejections of the executor, the client is expected to back off and retry
+        case statusException: StatusRuntimeException =>
+          close(success = false)
+          responseObserver.onError(statusException)
+        case _ =>
+          val reply = ScanReply(success = false, Some(e.toString))
+          sentBytes += reply.serializedSize
+          close(success = false)
+          responseObserver.onNext(reply)
+          responseObserver.onCompleted()
+      }
+    }
+  }
+
+  private def nextChunk(entries: Iterator[VersionedKeyValuePair[Array[Byte]]]): Seq[VersionedKeyValuePairProto] = {
+    val chunk = mutable.ArrayBuffer[VersionedKeyValuePairProto]()
+    var chunkBytes = 0L
+    while (entries.hasNext && chunk.length < maxChunkEntries && chunkBytes < maxChunkBytes) {
+      val pair = entries.next()
+      chunk += VersionedKeyValuePairProto(pair.key, pair.version, ByteStringConversions.wrap(pair.value))
+      chunkBytes += pair.key.length + pair.value.length
+    }
+    chunk.toSeq
+  }
+
+  private def close(success: Boolean): Unit = synchronized {
+    if (!closed) {
+      closed = true
+      source.foreach(_._1.close())
+      onFinished(sentBytes, success)
+    }
+  }
+
+}
+
+object ScanStreamer {
+  val defaultMaxChunkEntries: Int = 1000
+  val defaultMaxChunkBytes: Long = 4L * 1024 * 1024 // 4MB
+}
@@ -0,0 +1,184 @@
+package com.scalableminds.fossildb.db
+
+import com.typesafe.scalalogging.LazyLogging
+import org.rocksdb.{BackupEngine, BackupEngineOptions, Env, RocksDB}
+
+import java.nio.file.{Files, Path}
+import java.time.{Instant, ZoneOffset}
+import java.util.concurrent.atomic.AtomicLong
+import java.util.concurrent.{Executors, TimeUnit}
+import scala.concurrent.duration.Duration
+import scala.concurrent.{Await, Promise}
+import scala.jdk.CollectionConverters.ListHasAsScala
+import scala.jdk.StreamConverters.StreamHasToScala
+import scala.util.{Failure, Success, Try}
+
+// Decides which backups to delete after a new one was created
+sealed trait BackupRetention {
+  def backupsToDelete(backups: Seq[BackupInfo]): Seq[BackupInfo]
+}
+
+case class KeepLastBackups(count: Int) extends BackupRetention {
+  override def backupsToDelete(backups: Seq[BackupInfo]): Seq[BackupInfo] = backups.sortBy(-_.id).drop(count)
+
+  override def toString: String = s"last:$count"
+}
+
+// Keeps the newest backup of each of the last days (in UTC) on which backups were made
+case class KeepDailyBackups(days: Int) extends BackupRetention {
+  override def backupsToDelete(backups: Seq[BackupInfo]): Seq[BackupInfo] = {
+    val newestPerDay = backups.groupBy(backup => Instant.ofEpochSecond(backup.timestamp).atZone(ZoneOffset.UTC).toLocalDate)
+      .toSeq.sortBy(_._1).reverse.take(days).map(_._2.maxBy(_.id))
+    backups.filterNot(newestPerDay.contains)
+  }
+
+  override def toString: String = s"daily:$days"
+}
+
+object BackupRetention {
+  val default: BackupRetention = KeepLastBackups(1)
+
+  // Parses last:<count> or daily:<days>
+  def parse(spec: String): BackupRetention = spec.split(":", -1) match {
+    case Array("last", count) if count.toIntOption.exists(_ > 0) => KeepLastBackups(count.toInt)
+    case Array("daily", days) if days.toIntOption.exists(_ > 0) => KeepDailyBackups(days.toInt)
+    case _ => throw new IllegalArgumentException(s"Invalid backup retention $spec, expected last:<count> or daily:<days>")
+  }
+}
+
+/*
+   While running, bytesCopied is the growth of the backup directory since the job started. Unchanged SST files
+   are shared with earlier backups and not copied again, so dbBytes is only an upper bound of what is copied.
+ */
+case class BackupJobStatus(jobId: Long, state: String, startTime: Long, endTime: Option[Long], bytesCopied: Long,
+                           dbBytes: Long, backupInfo: Option[BackupInfo], error: Option[String])
+
+object BackupJobStatus {
+  val running = "RUNNING"
+  val succeeded = "SUCCEEDED"
+  val failed = "FAILED"
+}
+
+private class BackupJob(val id: Long, val dbBytes: Long, val bytesAtStart: Long) {
+  val startTime: Long = System.currentTimeMillis
+  val result: Promise[BackupInfo] = Promise()
+  @volatile var endTime: Option[Long] = None
+  @volatile var bytesCopied: Long = 0
+}
+
+/*
+   Runs backups in the background, one at a time. The BackupEngine stays open for the lifetime of the
+   manager, so it does not need to re-read the metadata of the existing backups for every new one.
+ */
+class BackupManager(backupDir: Path, retention: BackupRetention = BackupRetention.default) extends LazyLogging {
+
+  private val jobExecutor = Executors.newSingleThreadExecutor((runnable: Runnable) => {
+    val thread = new Thread(runnable, "fossildb-backup")
+    thread.setDaemon(true)
+    thread
+  })
+  private val nextJobId = new AtomicLong(1)
+  private var jobs: Vector[BackupJob] = Vector.empty
+  // Guards the engine, which must not be used concurrently. Job statuses are guarded by the manager itself.
+  private val engineLock = new Object
+  @volatile private var backupEngineOpt: Option[BackupEngine] = None
+
+  private def withBackupEngine[T](block: BackupEngine => T): T = engineLock.synchronized {
+    val backupEngine = backupEngineOpt.getOrElse {
+      if (!Files.exists(backupDir) || !Files.isDirectory(backupDir))
+        Files.createDirectories(backupDir)
+      RocksDB.loadLibrary()
+      val engine = BackupEngine.open(Env.getDefault, new BackupEngineOptions(backupDir.toString))
+      backupEngineOpt = Some(engine)
+      engine
+    }
+    block(backupEngine)
+  }
+
+  def startJob(rocksDBManager: RocksDBManager)(onFinished: => Unit): BackupJobStatus = {
+    val job = new BackupJob(nextJobId.getAndIncrement(), rocksDBManager.liveSstFilesBytes, directorySize)
+    synchronized {
+      jobs = (jobs :+ job).takeRight(BackupManager.retainedJobs)
+    }
+    jobExecutor.execute { () =>
+      logger.info(s"Starting backup job ${job.id}")
+      val result = Try(withBackupEngine { backupEngine =>
+        val backupInfo = rocksDBManager.backup(backupEngine).getOrElse(throw new Exception("Backup did not return valid BackupInfo"))
+        job.bytesCopied = math.max(0, directorySize - job.bytesAtStart)
+        applyRetention(backupEngine)
+        backupInfo
+      })
+      job.endTime = Some(System.currentTimeMillis)
+      result match {
+        case Success(info) => logger.info(s"Backup job ${job.id} created backup ${info.id}, ${job.bytesCopied} bytes copied")
+        case Failure(e) => logger.warn(s"Backup job ${job.id} failed: $e")
+      }
+      onFinished
+      job.result.complete(result)
+    }
+    status(job)
+  }
+
+  // Blocks until the job is finished
+  def awaitJob(jobId: Long): BackupInfo = {
+    val job = findJob(Some(jobId))
+    Await.result(job.result.future, Duration.Inf)
+  }
+
+  // The status of the job with the id, or of the latest job
+  def jobStatus(jobIdOpt: Option[Long]): BackupJobStatus = status(findJob(jobIdOpt))
+
+  private def findJob(jobIdOpt: Option[Long]): BackupJob = synchronized {
+    jobIdOpt match {
+      case Some(jobId) => jobs.find(_.id == jobId).getOrElse(throw new NoSuchElementException(s"No backup job $jobId"))
+      case None => jobs.lastOption.getOrElse(throw new NoSuchElementException("No backup job was started yet"))
+    }
+  }
+
+  private def status(job: BackupJob): BackupJobStatus = job.result.future.value match {
+    case None => BackupJobStatus(job.id, BackupJobStatus.running, job.startTime, None,
+      math.max(0, directorySize - job.bytesAtStart), job.dbBytes, None, None)
+    case Some(Success(info)) => BackupJobStatus(job.id, BackupJobStatus.succeeded, job.startTime, job.endTime,
+      job.bytesCopied, job.dbBytes, Some(info), None)
+    case Some(Failure(e)) => BackupJobStatus(job.id, BackupJobStatus.failed, job.startTime, job.endTime,
+      job.bytesCopied, job.dbBytes, None, Some(e.toString))
+  }
+
+  private def applyRetention(backupEngine: BackupEngine): Unit = {
+    val backups = backupEngine.getBackupInfo.asScala.toSeq.map(info => BackupInfo(info.backupId, info.timestamp, info.size))
+    retention.backupsToDelete(backups).foreach { backup =>
+      logger.info(s"Deleting backup ${backup.id} according to retention $retention")
+      backupEngine.deleteBackup(backup.id)
+    }
+  }
+
+  def restore(rocksDBManager: RocksDBManager): Unit = withBackupEngine(rocksDBManager.restoreFromBackup)
+
+  // Files may be renamed or deleted by a running backup while walking the directory, those are skipped
+  private def directorySize: Long =
+    if (!Files.isDirectory(backupDir)) 0L
+    else Try {
+      val paths = Files.walk(backupDir)
+      try {
+        paths.toScala(List).map(path => Try(if (Files.isRegularFile(path)) Files.size(path) else 0L).getOrElse(0L)).sum
+      } finally {
+        paths.close()
+      }
+    }.getOrElse(0L)
+
+  // Aborts a running backup, it fails and its partial files are removed on the next backup
+  def close(): Unit = {
+    backupEngineOpt.foreach(_.stopBackup())
+    jobExecutor.shutdown()
+    jobExecutor.awaitTermination(1, TimeUnit.MINUTES)
+    engineLock.synchronized {
+      backupEngineOpt.foreach(_.close())
+      backupEngineOpt = None
+    }
+  }
+
+}
+
+object BackupManager {
+  val retainedJobs: Int = 20
+}
@@ -0,0 +1,67 @@
+package com.scalableminds.fossildb.db
+
+import org.rocksdb.{ColumnFamilyOptions, CompressionOptions, CompressionType}
+
+/*
+   Block compression of one column family. compression is used for all levels but the bottommost one, which holds
+   most of the data and is rewritten least often, so it can afford the slower but stronger bottommostCompression.
+   With zstdDictionaryBytes > 0, compaction into the bottommost level trains a ZSTD dictionary of that size on
+   samples of the data, which helps for many small, similar values.
+ */
+case class CompressionConfig(compression: CompressionType, bottommostCompression: CompressionType, zstdDictionaryBytes: Int = 0) {
+
+  def applyTo(options: ColumnFamilyOptions): ColumnFamilyOptions = {
+    options.setCompressionType(compression).setBottommostCompressionType(bottommostCompression)
+    if (zstdDictionaryBytes > 0) {
+      options.setBottommostCompressionOptions(new CompressionOptions()
+        .setEnabled(true)
+        .setMaxDictBytes(zstdDictionaryBytes)
+        .setZStdMaxTrainBytes(zstdDictionaryBytes * CompressionConfig.trainingBytesPerDictionaryByte))
+    }
+    options
+  }
+
+  override def toString: String = {
+    val dictionary = if (zstdDictionaryBytes > 0) s":$zstdDictionaryBytes" else ""
+    s"${CompressionConfig.nameOf(compression)}/${CompressionConfig.nameOf(bottommostCompression)}$dictionary"
+  }
+}
+
+object CompressionConfig {
+  // ZSTD recommends sample data of about 100 times the dictionary size
+  val trainingBytesPerDictionaryByte: Int = 100
+
+  private val codecsByName: Map[String, CompressionType] = Map(
+    "none" -> CompressionType.NO_COMPRESSION,
+    "snappy" -> CompressionType.SNAPPY_COMPRESSION,
+    "lz4" -> CompressionType.LZ4_COMPRESSION,
+    "zstd" -> CompressionType.ZSTD_COMPRESSION
+  )
+
+  val codecNames: Seq[String] = codecsByName.keys.toSeq.sorted
+
+  private def nameOf(codec: CompressionType): String = codecsByName.find(_._2 == codec).map(_._1).getOrElse(codec.getLibraryName)
+
+  private def codec(name: String): CompressionType =
+    codecsByName.getOrElse(name.toLowerCase, throw new IllegalArgumentException(s"Unknown compression $name, expected one of ${codecNames.mkString(", ")}"))
+
+  /*
+     Parses <codec>[/<bottommost codec>][:<zstd dictionary bytes>], e.g. "zstd", "lz4/zstd" or "lz4/zstd:16384".
+     Without a bottommost codec, all levels use the same one.
+   */
+  def parse(spec: String): CompressionConfig = {
+    val (codecs, dictionaryBytes) = spec.split(":", -1) match {
+      case Array(codecs) => (codecs, 0)
+      case Array(codecs, bytes) => (codecs, bytes.toIntOption.filter(_ > 0).getOrElse(throw new IllegalArgumentException(s"Invalid zstd dictionary size $bytes")))
+      case _ => throw new IllegalArgumentException(s"Invalid compression $spec")
+    }
+    val config = codecs.split("/", -1) match {
+      case Array(all) => CompressionConfig(codec(all), codec(all), dictionaryBytes)
+      case Array(hot, bottommost) => CompressionConfig(codec(hot), codec(bottommost), dictionaryBytes)
+      case _ => throw new IllegalArgumentException(s"Invalid compression $spec")
+    }
+    require(dictionaryBytes == 0 || config.bottommostCompression == CompressionType.ZSTD_COMPRESSION,
+      s"A dictionary can only be used with zstd as bottommost compression, got $spec")
+    config
+  }
+}
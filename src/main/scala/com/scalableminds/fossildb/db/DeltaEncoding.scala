@@ -0,0 +1,186 @@
+package com.scalableminds.fossildb.db
+
+import java.io.ByteArrayOutputStream
+import java.nio.ByteBuffer
+import java.util
+import scala.collection.mutable
+
+/*
+   A binary delta is a sequence of copy (offset and length in the base) and insert (literal bytes) operations.
+   Matches are found by looking up each 16 byte window of the target among the aligned 16 byte blocks of the
+   base and extending hits in both directions, which handles inserted, removed and changed ranges anywhere.
+ */
+object BinaryDelta {
+  private val blockSize = 16
+  private val copyOp: Byte = 0
+  private val insertOp: Byte = 1
+
+  def encode(base: Array[Byte], target: Array[Byte]): Array[Byte] = {
+    val out = new ByteArrayOutputStream(target.length / 4 + 16)
+    writeVarint(out, target.length)
+    val blocks = mutable.HashMap[Int, Int]()
+    (0 to base.length - blockSize by blockSize).foreach(offset => blocks.getOrElseUpdate(blockHash(base, offset), offset))
+    var insertStart = 0
+    var i = 0
+    while (i + blockSize <= target.length) {
+      blocks.get(blockHash(target, i)) match {
+        case Some(candidate) if util.Arrays.equals(base, candidate, candidate + blockSize, target, i, i + blockSize) =>
+          var start = i
+          var baseStart = candidate
+          while (start > insertStart && baseStart > 0 && target(start - 1) == base(baseStart - 1)) {
+            start -= 1
+            baseStart -= 1
+          }
+          var end = i + blockSize
+          var baseEnd = candidate + blockSize
+          while (end < target.length && baseEnd < base.length && target(end) == base(baseEnd)) {
+            end += 1
+            baseEnd += 1
+          }
+          writeInsert(out, target, insertStart, start)
+          out.write(copyOp)
+          writeVarint(out, baseStart)
+          writeVarint(out, end - start)
+          i = end
+          insertStart = end
+        case _ => i += 1
+      }
+    }
+    writeInsert(out, target, insertStart, target.length)
+    out.toByteArray
+  }
+
+  def apply(base: Array[Byte], delta: Array[Byte]): Array[Byte] = {
+    val in = ByteBuffer.wrap(delta)
+    val result = new Array[Byte](readVarint(in))
+    var position = 0
+    while (in.hasRemaining) {
+      in.get() match {
+        case `copyOp` =>
+          val offset = readVarint(in)
+          val length = readVarint(in)
+          System.arraycopy(base, offset, result, position, length)
+          position += length
+        case `insertOp` =>
+          val length = readVarint(in)
+          in.get(result, position, length)
+          position += length
+        case op => throw new IllegalArgumentException(s"Invalid delta operation $op")
+      }
+    }
+    if (position != result.length) throw new IllegalArgumentException("Delta does not match its base")
+    result
+  }
+
+  private def writeInsert(out: ByteArrayOutputStream, target: Array[Byte], from: Int, until: Int): Unit =
+    if (until > from) {
+      out.write(insertOp)
+      writeVarint(out, until - from)
+      out.write(target, from, until - from)
+    }
+
+  private def blockHash(bytes: Array[Byte], offset: Int): Int = {
+    var hash = 0
+    var k = offset
+    while (k < offset + blockSize) {
+      hash = 31 * hash + bytes(k)
+      k += 1
+    }
+    hash
+  }
+
+  private def writeVarint(out: ByteArrayOutputStream, value: Int): Unit = {
+    var remaining = value
+    while ((remaining & ~0x7F) != 0) {
+      out.write((remaining & 0x7F) | 0x80)
+      remaining >>>= 7
+    }
+    out.write(remaining)
+  }
+
+  private def readVarint(in: ByteBuffer): Int = {
+    var result = 0
+    var shift = 0
+    var byte = 0
+    do {
+      byte = in.get()
+      result |= (byte & 0x7F) << shift
+      shift += 7
+    } while ((byte & 0x80) != 0)
+    result
+  }
+}
+
+sealed trait StoredValue
+
+case class FullValue(value: Array[Byte]) extends StoredValue
+
+// chainLength is the number of deltas to apply, starting from the nearest full value, to get this version
+case class DeltaValue(baseVersion: Long, chainLength: Int, delta: Array[Byte]) extends StoredValue
+
+/*
+   In collections with delta encoding, a version is stored either as its plain value or as a delta against an older
+   version of the same key, marked by a header. Plain values that happen to start with the header marker are
+   stored with a header as well, in all collections (see DeltaEncoding.escape), so delta encoding can be enabled
+   for a collection with existing values. Only values written before FossilDB knew delta encoding that start with
+   the marker would be read as deltas. maxChainLength bounds the number of deltas applied for one read, 0 stops
+   writing deltas but still reads them and keeps them readable when their bases are removed. Collections without
+   delta encoding read existing deltas with DeltaEncoding.readOnly, but do not store the versions based on a removed
+   or overwritten one in full, so reads of those fail.
+ */
+class DeltaEncoding(val maxChainLength: Int) {
+  import DeltaEncoding._
+
+  def parse(stored: Array[Byte]): StoredValue =
+    if (stored.length <= marker.length || !RocksDBStore.startsWith(stored, marker)) FullValue(stored)
+    else stored(marker.length) match {
+      case `fullType` => FullValue(util.Arrays.copyOfRange(stored, marker.length + 1, stored.length))
+      case `deltaType` =>
+        val header = ByteBuffer.wrap(stored, marker.length + 1, deltaHeaderLength - marker.length - 1)
+        DeltaValue(header.getLong, header.getShort.toInt, util.Arrays.copyOfRange(stored, deltaHeaderLength, stored.length))
+      case valueType => throw new IllegalStateException(s"Invalid stored value type $valueType")
+    }
+
+  def storedFull(value: Array[Byte]): Array[Byte] = escape(value)
+
+  /*
+     A delta against base is only stored if the chain stays within maxChainLength and the delta is considerably
+     smaller than the value, otherwise the value is stored in full and starts a new chain.
+   */
+  def encode(value: Array[Byte], baseOpt: Option[(Long, Int, Array[Byte])]): (Array[Byte], Int) = baseOpt match {
+    case Some((baseVersion, baseChainLength, baseValue)) if baseChainLength < maxChainLength =>
+      val delta = BinaryDelta.encode(baseValue, value)
+      if (deltaHeaderLength + delta.length < value.length * maxDeltaRatio) {
+        val stored = ByteBuffer.allocate(deltaHeaderLength + delta.length)
+          .put(marker).put(deltaType).putLong(baseVersion).putShort((baseChainLength + 1).toShort).put(delta)
+        (stored.array, baseChainLength + 1)
+      } else (storedFull(value), 0)
+    case _ => (storedFull(value), 0)
+  }
+
+  def chainLength(stored: Array[Byte]): Int = parse(stored) match {
+    case DeltaValue(_, length, _) => length
+    case FullValue(_) => 0
+  }
+
+  override def toString: String = s"delta encoding with chains of up to $maxChainLength deltas"
+}
+
+object DeltaEncoding {
+  private val marker: Array[Byte] = Array(0xFD.toByte) ++ "FDELTA".getBytes
+  private val fullType: Byte = 0
+  private val deltaType: Byte = 1
+  // Marker, type, base version and chain length
+  private val deltaHeaderLength = marker.length + 1 + 8 + 2
+
+  val maxDeltaRatio: Double = 0.5
+  // The chain length is stored in two bytes
+  val maxChainLengthLimit: Int = Short.MaxValue
+
+  // For reads in collections without delta encoding
+  val readOnly: DeltaEncoding = new DeltaEncoding(0)
+
+  // Plain values as stored by all collections, parse reads them back
+  def escape(value: Array[Byte]): Array[Byte] =
+    if (RocksDBStore.startsWith(value, marker)) (marker :+ fullType) ++ value else value
+}
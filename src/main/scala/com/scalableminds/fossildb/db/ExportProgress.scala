@@ -0,0 +1,63 @@
+package com.scalableminds.fossildb.db
+
+import java.util.concurrent.atomic.LongAdder
+
+/*
+   method is checkpoint (hard links to the SST files of the db, nothing is written), sst (sorted SST files
+   built from the source iterators and ingested into the new db) or batch (write batches, for column families
+   whose keys are converted to another encoding and thus change their order). Entries and bytes are only
+   counted for the sst and batch methods.
+ */
+case class ExportStatus(newDataDir: String, state: String, method: String, startTime: Long, endTime: Option[Long],
+                        entriesWritten: Long, bytesWritten: Long, estimatedEntries: Long, columnFamily: Option[String],
+                        error: Option[String])
+
+object ExportStatus {
+  val running = "RUNNING"
+  val succeeded = "SUCCEEDED"
+  val failed = "FAILED"
+
+  val checkpointMethod = "checkpoint"
+  val sstMethod = "sst"
+  val batchMethod = "batch"
+}
+
+class ExportProgress(newDataDir: String) {
+
+  private val startTime = System.currentTimeMillis
+  private val entries = new LongAdder
+  private val bytes = new LongAdder
+  @volatile private var endTime: Option[Long] = None
+  @volatile private var result: Option[Either[String, Unit]] = None
+  @volatile private var currentMethod = ""
+  @volatile private var currentColumnFamily: Option[String] = None
+  @volatile var estimatedEntries: Long = 0
+
+  def startColumnFamily(columnFamily: String, method: String): Unit = {
+    currentColumnFamily = Some(columnFamily)
+    currentMethod = method
+  }
+
+  def startCheckpoint(): Unit = currentMethod = ExportStatus.checkpointMethod
+
+  def entryWritten(key: Array[Byte], value: Array[Byte]): Unit = {
+    entries.increment()
+    bytes.add(key.length + value.length)
+  }
+
+  def finish(error: Option[Throwable]): Unit = {
+    endTime = Some(System.currentTimeMillis)
+    currentColumnFamily = None
+    result = Some(error.map(_.toString).toLeft(()))
+  }
+
+  def status: ExportStatus = {
+    val (state, error) = result match {
+      case None => (ExportStatus.running, None)
+      case Some(Right(_)) => (ExportStatus.succeeded, None)
+      case Some(Left(errorMessage)) => (ExportStatus.failed, Some(errorMessage))
+    }
+    ExportStatus(newDataDir, state, currentMethod, startTime, endTime, entries.sum, bytes.sum, estimatedEntries, currentColumnFamily, error)
+  }
+
+}
@@ -0,0 +1,164 @@
+package com.scalableminds.fossildb.db
+
+import com.typesafe.scalalogging.LazyLogging
+import io.grpc.Status
+
+import java.util
+import java.util.concurrent.atomic.AtomicLongArray
+import java.util.concurrent.{LinkedBlockingQueue, TimeUnit}
+import scala.collection.mutable
+import scala.concurrent.{Future, Promise}
+import scala.jdk.CollectionConverters.ListHasAsScala
+import scala.util.{Failure, Success, Try}
+
+/*
+   windowMicros is how long the first put of a batch waits for more puts to arrive, it trades the latency of
+   single puts against the number of puts per write batch. Puts that queued up while the previous batch was
+   written are added without waiting, up to maxPuts per batch.
+ */
+case class GroupCommitConfig(windowMicros: Long, maxPuts: Int) {
+  override def toString: String = s"$windowMicros/$maxPuts"
+}
+
+object GroupCommitConfig {
+  val defaultMaxPuts: Int = 1000
+
+  // <windowMicros>[/<maxPuts>], e.g. 500/1000
+  def parse(spec: String): GroupCommitConfig = spec.split("/", -1) match {
+    case Array(window) if window.toLongOption.exists(_ >= 0) => GroupCommitConfig(window.toLong, defaultMaxPuts)
+    case Array(window, maxPuts) if window.toLongOption.exists(_ >= 0) && maxPuts.toIntOption.exists(_ > 0) =>
+      GroupCommitConfig(window.toLong, maxPuts.toInt)
+    case _ => throw new IllegalArgumentException(s"Invalid group commit config $spec, expected <windowMicros>[/<maxPuts>]")
+  }
+}
+
+/*
+   The newest version of recently written keys, so that versions for puts without one are assigned without a seek.
+   Writes that do not go through the group commit invalidate their keys. As in the ReadCache, this bumps the
+   generation of the key's stripe, and versions computed before are not recorded afterwards.
+ */
+class LatestVersionIndex(maxKeys: Int) {
+
+  private val generations = new AtomicLongArray(LatestVersionIndex.stripes)
+
+  // Guarded by this, in access order to drop the least recently written keys
+  private val versions = new util.LinkedHashMap[String, java.lang.Long](16, 0.75f, true) {
+    override def removeEldestEntry(eldest: util.Map.Entry[String, java.lang.Long]): Boolean = size > maxKeys
+  }
+
+  def generation(key: String): Long = generations.get(stripe(key))
+
+  def get(key: String): Option[Long] = synchronized(Option(versions.get(key)).map(_.longValue))
+
+  def update(key: String, version: Long, generation: Long): Unit = synchronized {
+    if (generations.get(stripe(key)) == generation) versions.put(key, version)
+  }
+
+  def invalidate(key: String): Unit = {
+    generations.incrementAndGet(stripe(key))
+    synchronized(versions.remove(key))
+  }
+
+  def invalidateAll(): Unit = {
+    (0 until LatestVersionIndex.stripes).foreach(generations.incrementAndGet)
+    synchronized(versions.clear())
+  }
+
+  private def stripe(key: String): Int = (key.hashCode & Int.MaxValue) % LatestVersionIndex.stripes
+
+}
+
+object LatestVersionIndex {
+  private val stripes = 1024
+  val defaultMaxKeys: Int = 100000
+}
+
+/*
+   Collects single puts of one column family and writes them with one write batch per group, on a dedicated thread.
+   Versions of puts without one are assigned in arrival order, from the LatestVersionIndex or, for keys not in it,
+   the newest stored version. The futures returned by put complete once the batch is written.
+ */
+class GroupCommitter(name: String, config: GroupCommitConfig, newestStoredVersion: String => Option[Long],
+                     write: Seq[(String, Long, Array[Byte])] => Unit) extends LazyLogging {
+
+  private case class PendingPut(key: String, version: Option[Long], value: Array[Byte], promise: Promise[Long])
+
+  private val queue = new LinkedBlockingQueue[PendingPut](config.maxPuts * GroupCommitter.queuedBatches)
+  val latestVersions = new LatestVersionIndex(LatestVersionIndex.defaultMaxKeys)
+  @volatile private var closed = false
+
+  private val thread = new Thread(() => run(), s"fossildb-group-commit-$name")
+  thread.setDaemon(true)
+  thread.start()
+
+  def put(key: String, version: Option[Long], value: Array[Byte]): Future[Long] = {
+    val promise = Promise[Long]()
+    // Synchronized with close, so that no put is queued after the thread finished
+    synchronized {
+      if (closed) promise.failure(new IllegalStateException("The store is closed"))
+      else if (!queue.offer(PendingPut(key, version, value, promise)))
+        promise.failure(Status.RESOURCE_EXHAUSTED.withDescription(s"Too many pending puts to $name, retry later").asRuntimeException())
+    }
+    promise.future
+  }
+
+  // Writes the pending puts before it returns
+  def close(): Unit = {
+    synchronized { closed = true }
+    thread.join()
+    val remaining = new util.ArrayList[PendingPut]()
+    queue.drainTo(remaining)
+    remaining.asScala.foreach(_.promise.failure(new IllegalStateException("The store is closed")))
+  }
+
+  private def run(): Unit = {
+    val batch = new util.ArrayList[PendingPut](config.maxPuts)
+    while (!closed || !queue.isEmpty) {
+      val first = queue.poll(GroupCommitter.idlePollMillis, TimeUnit.MILLISECONDS)
+      if (first != null) {
+        batch.add(first)
+        val deadline = System.nanoTime + config.windowMicros * 1000
+        var remaining = deadline - System.nanoTime
+        while (batch.size < config.maxPuts && remaining > 0) {
+          Option(queue.poll(remaining, TimeUnit.NANOSECONDS)).foreach(batch.add)
+          remaining = deadline - System.nanoTime
+        }
+        queue.drainTo(batch, config.maxPuts - batch.size)
+        commit(batch.asScala.toSeq)
+        batch.clear()
+      }
+    }
+  }
+
+  private def commit(puts: Seq[PendingPut]): Unit = {
+    val generations = mutable.HashMap[String, Long]()
+    val latest = mutable.HashMap[String, Option[Long]]()
+    def latestOf(key: String): Option[Long] = latest.getOrElseUpdate(key, {
+      generations(key) = latestVersions.generation(key)
+      latestVersions.get(key).orElse(newestStoredVersion(key))
+    })
+    Try {
+      val versions = puts.map { put =>
+        val previous = latestOf(put.key)
+        val version = put.version.getOrElse(previous.map(_ + 1).getOrElse(0L))
+        latest(put.key) = Some(math.max(version, previous.getOrElse(version)))
+        version
+      }
+      write(puts.zip(versions).map { case (put, version) => (put.key, version, put.value) })
+      versions
+    } match {
+      case Success(versions) =>
+        latest.foreach { case (key, version) => version.foreach(latestVersions.update(key, _, generations(key))) }
+        puts.zip(versions).foreach { case (put, version) => put.promise.success(version) }
+      case Failure(e) =>
+        logger.warn(s"Could not write a group of ${puts.length} puts to $name: $e")
+        puts.foreach(_.promise.failure(e))
+    }
+  }
+
+}
+
+object GroupCommitter {
+  private val queuedBatches = 16
+  private val idlePollMillis = 100L
+}
@@ -0,0 +1,134 @@
+package com.scalableminds.fossildb.db
+
+import java.util
+import java.util.concurrent.atomic.{AtomicLongArray, LongAdder}
+import java.util.concurrent.{CompletableFuture, CompletionException, ConcurrentHashMap}
+import scala.collection.mutable
+
+case class ReadCacheStats(hits: Long, misses: Long, coalesced: Long, entries: Long, bytes: Long)
+
+/*
+   Sits in front of the lookups of single keys (the newest version, or the newest one not newer than a version).
+   Concurrent identical lookups share one read, and if maxBytes is positive, results are kept in an LRU cache
+   bounded by the size of their keys and values. Writes call invalidate after they are applied: this bumps the
+   generation of the key's stripe, and the result of a read that started before is neither cached nor shared
+   with lookups that start after the write, so no lookup misses a completed write.
+ */
+class ReadCache(maxBytes: Long) {
+
+  private type Lookup = (String, Option[Long])
+  private type Result = Option[VersionedKeyValuePair[Array[Byte]]]
+
+  private class InFlight(val generation: Long) {
+    val result = new CompletableFuture[Result]
+  }
+
+  private val generations = new AtomicLongArray(ReadCache.stripes)
+  private val inFlight = new ConcurrentHashMap[Lookup, InFlight]()
+
+  // Guarded by this, in access order for LRU eviction
+  private val entries = new util.LinkedHashMap[Lookup, Result](16, 0.75f, true)
+  private val versionsByKey = mutable.HashMap[String, mutable.Set[Option[Long]]]()
+  private var bytes = 0L
+
+  private val hits = new LongAdder
+  private val misses = new LongAdder
+  private val coalesced = new LongAdder
+
+  def get(key: String, version: Option[Long])(read: => Result): Result = {
+    val lookup = (key, version)
+    cached(lookup) match {
+      case Some(result) =>
+        hits.increment()
+        result
+      case None =>
+        val generation = generations.get(stripe(key))
+        var leader = false
+        val flight = inFlight.compute(lookup, (_, existing) =>
+          if (existing != null && existing.generation == generation) existing
+          else {
+            leader = true
+            new InFlight(generation)
+          })
+        if (leader) {
+          misses.increment()
+          try {
+            val result = read
+            flight.result.complete(result)
+            store(lookup, generation, result)
+            result
+          } catch {
+            case e: Throwable =>
+              flight.result.completeExceptionally(e)
+              throw e
+          } finally {
+            inFlight.remove(lookup, flight)
+          }
+        } else {
+          coalesced.increment()
+          try flight.result.join() catch {
+            case e: CompletionException => throw e.getCause
+          }
+        }
+    }
+  }
+
+  def invalidate(key: String): Unit = {
+    generations.incrementAndGet(stripe(key))
+    synchronized {
+      versionsByKey.remove(key).foreach(_.foreach(version => removeEntry((key, version))))
+    }
+  }
+
+  def invalidateAll(): Unit = {
+    (0 until ReadCache.stripes).foreach(generations.incrementAndGet)
+    synchronized {
+      entries.clear()
+      versionsByKey.clear()
+      bytes = 0
+    }
+  }
+
+  def stats: ReadCacheStats = synchronized {
+    ReadCacheStats(hits.sum, misses.sum, coalesced.sum, entries.size, bytes)
+  }
+
+  private def stripe(key: String): Int = (key.hashCode & Int.MaxValue) % ReadCache.stripes
+
+  private def cached(lookup: Lookup): Option[Result] =
+    if (maxBytes <= 0) None
+    else synchronized(Option(entries.get(lookup)))
+
+  private def store(lookup: Lookup, generation: Long, result: Result): Unit =
+    if (maxBytes > 0 && entrySize(lookup, result) <= maxBytes) synchronized {
+      if (generations.get(stripe(lookup._1)) == generation && !entries.containsKey(lookup)) {
+        entries.put(lookup, result)
+        versionsByKey.getOrElseUpdate(lookup._1, mutable.Set()) += lookup._2
+        bytes += entrySize(lookup, result)
+        val eldest = entries.entrySet.iterator
+        while (bytes > maxBytes && eldest.hasNext) {
+          val evicted = eldest.next()
+          val (evictedKey, evictedVersion) = evicted.getKey
+          bytes -= entrySize(evicted.getKey, evicted.getValue)
+          eldest.remove()
+          versionsByKey.get(evictedKey).foreach { versions =>
+            versions -= evictedVersion
+            if (versions.isEmpty) versionsByKey.remove(evictedKey)
+          }
+        }
+      }
+    }
+
+  private def removeEntry(lookup: Lookup): Unit =
+    Option(entries.remove(lookup)).foreach(result => bytes -= entrySize(lookup, result))
+
+  private def entrySize(lookup: Lookup, result: Result): Long =
+    ReadCache.entryOverheadBytes + 2L * lookup._1.length + result.map(_.value.length.toLong).getOrElse(0L)
+
+}
+
+object ReadCache {
+  private val stripes = 1024
+  // Rough size of the map entry, lookup and result objects
+  private val entryOverheadBytes = 200L
+}
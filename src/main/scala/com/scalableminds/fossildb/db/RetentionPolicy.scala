@@ -0,0 +1,50 @@
+package com.scalableminds.fossildb.db
+
+// Decides for one version of a key whether to keep it. index is 0 for the newest version of the key, 1 for the one before, ...
+sealed trait RetentionRule {
+  def keeps(version: Long, index: Long, newestVersion: Long): Boolean
+}
+
+case class KeepNewestVersions(count: Long) extends RetentionRule {
+  override def keeps(version: Long, index: Long, newestVersion: Long): Boolean = index < count
+
+  override def toString: String = s"newest:$count"
+}
+
+// Keeps the versions less than distance below the newest version of the key
+case class KeepRecentVersions(distance: Long) extends RetentionRule {
+  override def keeps(version: Long, index: Long, newestVersion: Long): Boolean = newestVersion - version < distance
+
+  override def toString: String = s"recent:$distance"
+}
+
+case class KeepEveryNthVersion(n: Long) extends RetentionRule {
+  override def keeps(version: Long, index: Long, newestVersion: Long): Boolean = version % n == 0
+
+  override def toString: String = s"every:$n"
+}
+
+// A version is kept if any of the rules keeps it. The newest version of a key is always kept.
+case class RetentionPolicy(rules: Seq[RetentionRule]) {
+  def keeps(version: Long, index: Long, newestVersion: Long): Boolean =
+    index == 0 || rules.exists(_.keeps(version, index, newestVersion))
+
+  override def toString: String = rules.mkString("+")
+}
+
+object RetentionPolicy {
+  val ruleNames: Seq[String] = Seq("newest", "recent", "every")
+
+  // Parses rules joined by +, e.g. newest:10+every:100
+  def parse(spec: String): RetentionPolicy = RetentionPolicy(spec.split("\\+", -1).toSeq.map { rule =>
+    rule.split(":", -1) match {
+      case Array(name, value) if value.toLongOption.exists(_ > 0) => name match {
+        case "newest" => KeepNewestVersions(value.toLong)
+        case "recent" => KeepRecentVersions(value.toLong)
+        case "every" => KeepEveryNthVersion(value.toLong)
+        case _ => throw new IllegalArgumentException(s"Unknown retention rule $name, expected one of ${ruleNames.mkString(", ")}")
+      }
+      case _ => throw new IllegalArgumentException(s"Invalid retention rule $rule, expected <rule>:<positive number>")
+    }
+  })
+}
@@ -7,22 +7,49 @@ import java.nio.file.{Files, Path}
 import java.util
 import scala.collection.mutable
 import scala.concurrent.Future
-import scala.jdk.CollectionConverters.{BufferHasAsJava, ListHasAsScala, SeqHasAsJava}
+import scala.jdk.CollectionConverters.{BufferHasAsJava, ListHasAsScala, MapHasAsScala, SeqHasAsJava}
 import scala.language.postfixOps
 
 case class BackupInfo(id: Int, timestamp: Long, size: Long)
 
-case class KeyValuePair[T](key: String, value: T)
-
-class RocksDBManager(dataDir: Path, columnFamilies: List[String], optionsFilePathOpt: Option[String]) extends LazyLogging {
-
-  private val (db: RocksDB, columnFamilyHandles) = {
-    RocksDB.loadLibrary()
+// Summed up table properties of the SST files of one column family, data still in the memtables is not included
+case class CompressionStats(columnFamily: String, compressions: Seq[String], sstFiles: Int, entries: Long, rawBytes: Long, compressedBytes: Long)
+
+// Block cache usage and cumulative RocksDB statistics counters since the db was opened, by ticker name
+case class CacheStats(blockCacheCapacity: Long, blockCacheUsage: Long, tickers: Seq[(String, Long)], readCaches: Seq[(String, ReadCacheStats)] = Seq.empty)
+
+// A RocksDB property of the whole db, or of one column family
+case class PropertySample(property: String, columnFamily: Option[String], value: Long)
+
+case class KeyValuePair[T](key: Array[Byte], value: T)
+
+class RocksDBManager(dataDir: Path, columnFamilies: List[String], optionsFilePathOpt: Option[String],
+                     compression: Map[String, CompressionConfig] = Map.empty,
+                     blockCacheBytes: Long = RocksDBManager.defaultBlockCacheBytes,
+                     bloomPrefixLengths: Map[String, Int] = Map.empty) extends LazyLogging {
+
+  RocksDB.loadLibrary()
+  // Shared by all column families, so the memory limit holds no matter how many of them are in use
+  private val blockCache = new LRUCache(blockCacheBytes)
+  private val statistics = new Statistics()
+  private val options = new DBOptions()
+
+  private val (db: RocksDB, columnFamilyHandles, columnFamilyOptions) = {
+    /*
+       Index and filter blocks are kept in the block cache, so they count towards its limit. Whole key bloom
+       filters speed up the multiGet lookups of exact versions, prefix bloom filters (see bloomPrefixLengths)
+       the seeks for the newest version of a key. With an options file, its table options are used instead.
+     */
+    val tableConfig = new BlockBasedTableConfig()
+      .setBlockCache(blockCache)
+      .setFilterPolicy(new BloomFilter(RocksDBManager.bloomBitsPerKey))
+      .setCacheIndexAndFilterBlocks(true)
+      .setPinL0FilterAndIndexBlocksInCache(true)
     val columnOptions = new ColumnFamilyOptions()
       .setArenaBlockSize(4L * 1024 * 1024) // 4MB
       .setTargetFileSizeBase(1024L * 1024 * 1024) // 1GB
       .setMaxBytesForLevelBase(10L * 1024 * 1024 * 1024) // 10GB
-    val options = new DBOptions()
+      .setTableFormatConfig(tableConfig)
     val cfListRef: mutable.Buffer[ColumnFamilyDescriptor] = mutable.Buffer()
     optionsFilePathOpt.foreach { optionsFilePath =>
       try {
@@ -34,10 +61,28 @@ class RocksDBManager(dataDir: Path, columnFamilies: List[String], optionsFilePat
           throw new Exception("Failed to load rocksdb options from file " + optionsFilePath, e)
       }
     }
-    options.setCreateIfMissing(true).setCreateMissingColumnFamilies(true)
+    options.setCreateIfMissing(true).setCreateMissingColumnFamilies(true).setStatistics(statistics)
     val defaultColumnFamilyOptions: ColumnFamilyOptions = cfListRef.find(_.getName sameElements RocksDB.DEFAULT_COLUMN_FAMILY).map(_.getOptions).getOrElse(columnOptions)
     val newColumnFamilyDescriptors = (columnFamilies.map(_.getBytes) :+ RocksDB.DEFAULT_COLUMN_FAMILY).diff(cfListRef.toList.map(_.getName)).map(new ColumnFamilyDescriptor(_, defaultColumnFamilyOptions))
-    val columnFamilyDescriptors = cfListRef.toList ::: newColumnFamilyDescriptors
+    require(compression.keySet.subsetOf(columnFamilies.toSet), s"Compression configured for unknown column families ${(compression.keySet -- columnFamilies).mkString(", ")}")
+    require(bloomPrefixLengths.keySet.subsetOf(columnFamilies.toSet), s"Bloom prefix length configured for unknown column families ${(bloomPrefixLengths.keySet -- columnFamilies).mkString(", ")}")
+    // Settings from the command line take precedence over the options file
+    val columnFamilyDescriptors = (cfListRef.toList ::: newColumnFamilyDescriptors).map { descriptor =>
+      val name = new String(descriptor.getName)
+      if (!compression.contains(name) && !bloomPrefixLengths.contains(name)) descriptor
+      else {
+        val cfOptions = new ColumnFamilyOptions(descriptor.getOptions)
+        compression.get(name).foreach { config =>
+          logger.info(s"Column family $name uses $config compression")
+          config.applyTo(cfOptions)
+        }
+        bloomPrefixLengths.get(name).foreach { length =>
+          logger.info(s"Column family $name uses prefix bloom filters on the first $length key bytes")
+          cfOptions.useCappedPrefixExtractor(length).setMemtablePrefixBloomSizeRatio(RocksDBManager.memtablePrefixBloomSizeRatio)
+        }
+        new ColumnFamilyDescriptor(descriptor.getName, cfOptions)
+      }
+    }
     logger.info("Opening RocksDB at " + dataDir.toAbsolutePath)
     val columnFamilyHandles = new util.ArrayList[ColumnFamilyHandle]
     val db = RocksDB.open(
@@ -45,29 +90,67 @@ class RocksDBManager(dataDir: Path, columnFamilies: List[String], optionsFilePat
       dataDir.toAbsolutePath.toString,
       columnFamilyDescriptors.asJava,
       columnFamilyHandles)
-    (db, columnFamilies.zip(columnFamilyHandles.asScala).toMap)
+    // The handles are returned in descriptor order, which puts the column families from the options file first
+    val handlesByName = columnFamilyDescriptors.map(descriptor => new String(descriptor.getName)).zip(columnFamilyHandles.asScala).toMap
+    val optionsByName = columnFamilyDescriptors.map(descriptor => new String(descriptor.getName) -> descriptor.getOptions).toMap
+    (db, columnFamilies.map(cf => cf -> handlesByName(cf)).toMap, columnFamilies.map(cf => cf -> optionsByName(cf)).toMap)
+  }
+
+  // Shared by all column families, RocksDB snapshots cover the whole db
+  val snapshots = new SnapshotRegistry(db)
+
+  private val keyCodecs: Map[String, VersionedKeyCodec] = columnFamilyHandles.map { case (name, handle) =>
+    val readOptions = new ReadOptions().setTotalOrderSeek(true)
+    val rocksIt = db.newIterator(handle, readOptions)
+    try {
+      rocksIt.seekToFirst()
+      val codec = VersionedKeyCodec.detect(if (rocksIt.isValid) Some(rocksIt.key()) else None)
+      logger.info(s"Column family $name uses ${codec.name} key encoding")
+      name -> codec
+    } finally {
+      rocksIt.close()
+      readOptions.close()
+    }
   }
 
   def getStoreForColumnFamily(columnFamily: String): Option[RocksDBStore] = {
     columnFamilyHandles.get(columnFamily).map(new RocksDBStore(db, _))
   }
 
-  def backup(backupDir: Path): Option[BackupInfo] = {
-    if (!Files.exists(backupDir) || !Files.isDirectory(backupDir))
-      Files.createDirectories(backupDir)
+  def keyCodecForColumnFamily(columnFamily: String): Option[VersionedKeyCodec] = keyCodecs.get(columnFamily)
 
-    RocksDB.loadLibrary()
-    val backupEngine = BackupEngine.open(Env.getDefault, new BackupEngineOptions(backupDir.toString))
+  def compressionStats(columnFamily: String): CompressionStats = {
+    val tables = db.getPropertiesOfAllTables(columnFamilyHandles(columnFamily)).asScala.values.toSeq
+    CompressionStats(columnFamily,
+      tables.map(_.getCompressionName).distinct.sorted,
+      tables.length,
+      tables.map(_.getNumEntries).sum,
+      tables.map(table => table.getRawKeySize + table.getRawValueSize).sum,
+      tables.map(_.getDataSize).sum)
+  }
+
+  def propertySamples: Seq[PropertySample] =
+    RocksDBManager.sampledDbProperties.map(property => PropertySample(property, None, db.getLongProperty(property))) ++
+      columnFamilyHandles.toSeq.sortBy(_._1).flatMap { case (name, handle) =>
+        RocksDBManager.sampledColumnFamilyProperties.map(property => PropertySample(property, Some(name), db.getLongProperty(handle, property)))
+      }
+
+  def cacheStats: CacheStats =
+    CacheStats(blockCache.getCapacity, blockCache.getUsage, RocksDBManager.reportedTickers.map(ticker => ticker.name -> statistics.getTickerCount(ticker)))
+
+  // Size of the SST files of all column families that are part of the current version of the db
+  def liveSstFilesBytes: Long =
+    columnFamilyHandles.values.map(handle => db.getLongProperty(handle, "rocksdb.live-sst-files-size")).sum
+
+  // SST files that are already part of earlier backups in the engine are not copied again
+  def backup(backupEngine: BackupEngine): Option[BackupInfo] = {
     backupEngine.createNewBackup(db)
-    backupEngine.purgeOldBackups(1)
-    backupEngine.getBackupInfo.asScala.headOption.map(info => BackupInfo(info.backupId, info.timestamp, info.size))
+    backupEngine.getBackupInfo.asScala.maxByOption(_.backupId).map(info => BackupInfo(info.backupId, info.timestamp, info.size))
   }
 
-  def restoreFromBackup(backupDir: Path): Unit = {
+  def restoreFromBackup(backupEngine: BackupEngine): Unit = {
     logger.info("Restoring from backup. RocksDB temporarily unavailable")
     close()
-    RocksDB.loadLibrary()
-    val backupEngine = BackupEngine.open(Env.getDefault, new BackupEngineOptions(backupDir.toString))
     backupEngine.restoreDbFromLatestBackup(dataDir.toString, dataDir.toString, new RestoreOptions(true))
     logger.info("Restoring from backup complete. Reopening RocksDB")
   }
@@ -75,64 +158,279 @@ class RocksDBManager(dataDir: Path, columnFamilies: List[String], optionsFilePat
   def compactAllData(): Unit = {
     logger.info("Compacting all data")
     RocksDB.loadLibrary()
-    db.compactRange()
+    compactAllColumnFamilies()
     logger.info("All data has been compacted to last level containing data")
   }
 
-  def exportToNewDB(newDataDir: Path, newOptionsFilePathOpt: Option[String]): Unit = {
+  /*
+     Without a new options file and with all column families already in the key encoding a new db would get,
+     the export is a checkpoint: hard links to the SST files (copies if newDataDir is on another file system).
+     Otherwise every column family is written to a new db opened with the new options. Column families that keep
+     their key encoding are written as sorted SST files and ingested as a whole, which skips the memtable, the WAL
+     and compactions. Converted keys sort differently than the source keys, so those go through write batches.
+   */
+  def exportToNewDB(newDataDir: Path, newOptionsFilePathOpt: Option[String], progress: ExportProgress): Unit = {
     RocksDB.loadLibrary()
     logger.info(s"Exporting to new DB at ${newDataDir.toString} with options file $newOptionsFilePathOpt")
-    val newManager = new RocksDBManager(newDataDir, columnFamilies, newOptionsFilePathOpt)
-    newManager.columnFamilyHandles.foreach { case (name, handle) =>
-      val store = getStoreForColumnFamily(name).get
-      store.withRawRocksIterator { rocksIt =>
-        val dataIterator = RocksDBStore.scan(rocksIt, "", None)
-        dataIterator.foreach(el => newManager.db.put(handle, el.key.getBytes, el.value))
+    progress.estimatedEntries = columnFamilyHandles.values.map(handle => db.getLongProperty(handle, "rocksdb.estimate-num-keys")).sum
+    val newDataDirIsEmpty = !Files.exists(newDataDir) || (Files.isDirectory(newDataDir) && isEmptyDirectory(newDataDir))
+    if (newOptionsFilePathOpt.isEmpty && newDataDirIsEmpty && keyCodecs.values.forall(_ == VersionedKeyCodec.detect(None))) {
+      progress.startCheckpoint()
+      logger.info("Creating checkpoint")
+      Files.deleteIfExists(newDataDir)
+      val checkpoint = Checkpoint.create(db)
+      try {
+        checkpoint.createCheckpoint(newDataDir.toAbsolutePath.toString)
+      } finally {
+        checkpoint.close()
+      }
+      logger.info("Checkpoint created")
+    } else {
+      val newManager = new RocksDBManager(newDataDir, columnFamilies, newOptionsFilePathOpt, compression, blockCacheBytes, bloomPrefixLengths)
+      try {
+        newManager.columnFamilyHandles.foreach { case (name, handle) =>
+          val sourceCodec = keyCodecs(name)
+          val targetCodec = newManager.keyCodecs(name)
+          if (sourceCodec == targetCodec) {
+            progress.startColumnFamily(name, ExportStatus.sstMethod)
+            ingestSstFiles(name, newManager, handle, newDataDir.resolve(RocksDBManager.exportSstDirName), progress)
+          } else {
+            logger.info(s"Converting column family $name from ${sourceCodec.name} to ${targetCodec.name} key encoding")
+            progress.startColumnFamily(name, ExportStatus.batchMethod)
+            writeTranscoded(name, newManager, handle, sourceCodec, targetCodec, progress)
+          }
+        }
+      } finally {
+        newManager.close()
       }
     }
-    logger.info("Writing data completed. Start compaction")
-    newManager.db.compactRange()
-    logger.info("Compaction finished")
   }
 
+  private def isEmptyDirectory(path: Path): Boolean = {
+    val entries = Files.list(path)
+    try entries.findAny().isEmpty finally entries.close()
+  }
+
+  // Writes the column family to SST files in sstDir, built with the options of the new db, and moves them into it
+  private def ingestSstFiles(name: String, newManager: RocksDBManager, targetHandle: ColumnFamilyHandle, sstDir: Path,
+                             progress: ExportProgress): Unit = {
+    Files.createDirectories(sstDir)
+    val envOptions = new EnvOptions()
+    val sstOptions = new Options(newManager.options, newManager.columnFamilyOptions(name))
+    val files = mutable.Buffer[Path]()
+    var writerOpt: Option[SstFileWriter] = None
+    def finishFile(): Unit = writerOpt.foreach { writer =>
+      writer.finish()
+      writer.close()
+      writerOpt = None
+    }
+    try {
+      getStoreForColumnFamily(name).get.withRawRocksIterator { rocksIt =>
+        RocksDBStore.scan(rocksIt, Array.emptyByteArray, None).foreach { el =>
+          // SstFileWriter cannot finish files without entries, so they are only created for the next entry
+          val writer = writerOpt.getOrElse {
+            val file = sstDir.resolve(s"${files.length}.sst")
+            val newWriter = new SstFileWriter(envOptions, sstOptions)
+            writerOpt = Some(newWriter)
+            newWriter.open(file.toString)
+            files += file
+            newWriter
+          }
+          writer.put(el.key, el.value)
+          progress.entryWritten(el.key, el.value)
+          if (writer.fileSize >= RocksDBManager.exportSstFileBytes) finishFile()
+        }
+      }
+      finishFile()
+      logger.info(s"Wrote ${files.length} SST files for column family $name. Ingesting them")
+      if (files.nonEmpty) {
+        val ingestOptions = new IngestExternalFileOptions().setMoveFiles(true)
+        try newManager.db.ingestExternalFile(targetHandle, files.map(_.toString).asJava, ingestOptions) finally ingestOptions.close()
+      }
+    } finally {
+      writerOpt.foreach(_.close())
+      sstOptions.close()
+      envOptions.close()
+      // Ingested files were moved already, these are only left over after a failure
+      files.foreach(Files.deleteIfExists)
+      Files.deleteIfExists(sstDir)
+    }
+  }
+
+  private def writeTranscoded(name: String, newManager: RocksDBManager, handle: ColumnFamilyHandle, sourceCodec: VersionedKeyCodec,
+                              targetCodec: VersionedKeyCodec, progress: ExportProgress): Unit = {
+    val writeOptions = new WriteOptions().setDisableWAL(true)
+    val batch = new WriteBatch()
+    try {
+      getStoreForColumnFamily(name).get.withRawRocksIterator { rocksIt =>
+        RocksDBStore.scan(rocksIt, Array.emptyByteArray, None).foreach { el =>
+          transcode(el.key, sourceCodec, targetCodec) match {
+            case Some(newKey) =>
+              batch.put(handle, newKey, el.value)
+              progress.entryWritten(newKey, el.value)
+              if (batch.getDataSize >= RocksDBManager.exportBatchBytes) {
+                newManager.db.write(writeOptions, batch)
+                batch.clear()
+              }
+            case None => logger.warn(s"Skipping entry in column family $name that cannot be stored with ${targetCodec.name} key encoding: ${new String(el.key)}")
+          }
+        }
+      }
+      newManager.db.write(writeOptions, batch)
+    } finally {
+      batch.close()
+      writeOptions.close()
+    }
+    // Without the WAL, the data is only durable once it is flushed
+    val flushOptions = new FlushOptions().setWaitForFlush(true)
+    try newManager.db.flush(flushOptions, handle) finally flushOptions.close()
+    logger.info(s"Writing column family $name completed. Start compaction")
+    newManager.db.compactRange(handle)
+  }
+
+  // compactRange() without a handle only compacts the default column family
+  private def compactAllColumnFamilies(): Unit =
+    columnFamilyHandles.values.foreach(handle => db.compactRange(handle))
+
+  private def transcode(compositeKey: Array[Byte], sourceCodec: VersionedKeyCodec, targetCodec: VersionedKeyCodec): Option[Array[Byte]] =
+    if (sourceCodec == targetCodec) Some(compositeKey)
+    else {
+      val keyLength = sourceCodec.keyLength(compositeKey)
+      // Both invalid key chars are ASCII and thus encoded as a single byte
+      if (keyLength < 0 || compositeKey.take(keyLength).contains(targetCodec.invalidKeyChar.toByte)) None
+      else Some(targetCodec.encode(compositeKey.take(keyLength), sourceCodec.decodeVersion(compositeKey)))
+    }
+
   def close(): Future[Unit] = {
     logger.info("Closing RocksDB handle")
-    Future.successful(db.close())
+    snapshots.releaseAll()
+    db.close()
+    statistics.close()
+    Future.successful(blockCache.close())
   }
 }
 
-class RocksDBKeyIterator(it: RocksIterator, prefix: Option[String]) extends Iterator[String] with LazyLogging {
+object RocksDBManager {
+  val defaultBlockCacheBytes: Long = 256L * 1024 * 1024
+  val bloomBitsPerKey: Double = 10
+  val memtablePrefixBloomSizeRatio: Double = 0.02
+
+  // Limits for the SST files and write batches written by exportToNewDB
+  val exportSstFileBytes: Long = 256L * 1024 * 1024
+  val exportBatchBytes: Long = 64L * 1024 * 1024
+  val exportSstDirName: String = "export-sst"
+
+  val reportedTickers: Seq[TickerType] = Seq(
+    TickerType.BLOCK_CACHE_HIT, TickerType.BLOCK_CACHE_MISS,
+    TickerType.BLOCK_CACHE_DATA_HIT, TickerType.BLOCK_CACHE_DATA_MISS,
+    TickerType.BLOCK_CACHE_INDEX_HIT, TickerType.BLOCK_CACHE_INDEX_MISS,
+    TickerType.BLOCK_CACHE_FILTER_HIT, TickerType.BLOCK_CACHE_FILTER_MISS,
+    TickerType.BLOOM_FILTER_USEFUL, TickerType.BLOOM_FILTER_FULL_POSITIVE,
+    TickerType.BLOOM_FILTER_PREFIX_CHECKED, TickerType.BLOOM_FILTER_PREFIX_USEFUL,
+    TickerType.STALL_MICROS, TickerType.COMPACT_READ_BYTES, TickerType.COMPACT_WRITE_BYTES, TickerType.FLUSH_WRITE_BYTES
+  )
+
+  val sampledDbProperties: Seq[String] = Seq(
+    "rocksdb.num-running-compactions",
+    "rocksdb.num-running-flushes",
+    "rocksdb.actual-delayed-write-rate",
+    "rocksdb.is-write-stopped",
+    "rocksdb.num-snapshots"
+  )
+
+  val sampledColumnFamilyProperties: Seq[String] = Seq(
+    "rocksdb.estimate-pending-compaction-bytes",
+    "rocksdb.cur-size-all-mem-tables",
+    "rocksdb.size-all-mem-tables",
+    "rocksdb.num-immutable-mem-table",
+    "rocksdb.num-files-at-level0",
+    "rocksdb.estimate-num-keys",
+    "rocksdb.total-sst-files-size",
+    "rocksdb.live-sst-files-size"
+  )
+}
 
-  override def hasNext: Boolean = it.isValid && prefix.forall(it.key().startsWith(_))
+/*
+   Both iterators hand out the raw key bytes of the underlying iterator. The key of the current entry is read
+   (and copied out of RocksDB) once in hasNext and reused by next.
+ */
+class RocksDBKeyIterator(it: RocksIterator, prefix: Option[Array[Byte]]) extends Iterator[Array[Byte]] {
 
-  override def next(): String = {
-    val key = new String(it.key().map(_.toChar))
+  private var currentKey: Array[Byte] = _
+
+  override def hasNext: Boolean = {
+    if (currentKey == null && it.isValid) currentKey = it.key()
+    currentKey != null && prefix.forall(RocksDBStore.startsWith(currentKey, _))
+  }
+
+  override def next(): Array[Byte] = {
+    if (!hasNext) throw new NoSuchElementException
+    val key = currentKey
+    currentKey = null
     it.next()
     key
   }
 
-  def peek: String = {
-    new String(it.key().map(_.toChar))
+}
+
+class RocksDBIterator(it: RocksIterator, prefix: Option[Array[Byte]]) extends Iterator[KeyValuePair[Array[Byte]]] {
+
+  private val keyIterator = new RocksDBKeyIterator(it, prefix)
+
+  override def hasNext: Boolean = keyIterator.hasNext
+
+  override def next(): KeyValuePair[Array[Byte]] = {
+    if (!hasNext) throw new NoSuchElementException
+    val value = it.value()
+    KeyValuePair(keyIterator.next(), value)
   }
 
 }
 
-class RocksDBIterator(it: RocksIterator, prefix: Option[String]) extends Iterator[KeyValuePair[Array[Byte]]] {
+/*
+   An iterator with a snapshot of its own, for iterations that outlive the call that opened them. Point lookups
+   via readOptions see the same snapshot. close releases the iterator, its options and the snapshot.
+ */
+class SnapshotRocksIterator(db: RocksDB, handle: ColumnFamilyHandle) extends AutoCloseable {
 
-  override def hasNext: Boolean = it.isValid && prefix.forall(it.key().startsWith(_))
+  private val snapshot = db.getSnapshot
 
-  override def next(): KeyValuePair[Array[Byte]] = {
-    val value = KeyValuePair(new String(it.key().map(_.toChar)), it.value())
-    it.next()
-    value
+  val readOptions: ReadOptions = new ReadOptions().setSnapshot(snapshot).setTotalOrderSeek(true)
+
+  val rocksIt: RocksIterator = db.newIterator(handle, readOptions)
+
+  override def close(): Unit = {
+    rocksIt.close()
+    readOptions.close()
+    db.releaseSnapshot(snapshot)
   }
 
 }
 
+class RocksDBWriteBatch(batch: WriteBatch, handle: ColumnFamilyHandle) {
+
+  def put(key: Array[Byte], value: Array[Byte]): Unit = batch.put(handle, key, value)
+
+  def delete(key: Array[Byte]): Unit = batch.delete(handle, key)
+
+  // Deletes all keys in [begin, end) with a single range tombstone
+  def deleteRange(begin: Array[Byte], end: Array[Byte]): Unit = batch.deleteRange(handle, begin, end)
+
+}
+
 class RocksDBStore(db: RocksDB, handle: ColumnFamilyHandle) extends LazyLogging {
 
+  private val writeOptions = new WriteOptions()
+
+  /*
+     With a prefix extractor (--bloomPrefixLength), iterators default to prefix mode, in which seeks may skip
+     SST files and iteration may stop at the end of the prefix of the seek target. All iterators that are not
+     bounded to a single key use total order seeks instead. The iterator copies the options, so they are shared.
+   */
+  private val totalOrderReadOptions = new ReadOptions().setTotalOrderSeek(true)
+
   def withRawRocksIterator[T](block: RocksIterator => T): T = {
-    val rocksIt = db.newIterator(handle)
+    val rocksIt = newRawRocksIterator()
     try {
       block(rocksIt)
     } finally {
@@ -140,29 +438,138 @@ class RocksDBStore(db: RocksDB, handle: ColumnFamilyHandle) extends LazyLogging
     }
   }
 
-  def get(key: String): Array[Byte] = {
-    db.get(handle, key.getBytes())
+  // The caller is responsible for closing the iterator. It sees the state of the db at its creation.
+  def newRawRocksIterator(): RocksIterator = db.newIterator(handle, totalOrderReadOptions)
+
+  // Like newRawRocksIterator, with point lookups at the state of the db the iterator sees
+  def newSnapshotIterator(): SnapshotRocksIterator = new SnapshotRocksIterator(db, handle)
+
+  /*
+     An iterator that only sees keys before upperBound. If upperBound and the seek target share the same prefix,
+     RocksDB uses prefix bloom filters to skip SST files, the results are the same as without them.
+   */
+  def withBoundedRocksIterator[T](upperBound: Array[Byte])(block: RocksIterator => T): T = {
+    val bound = new Slice(upperBound)
+    val readOptions = new ReadOptions().setAutoPrefixMode(true).setIterateUpperBound(bound)
+    val rocksIt = db.newIterator(handle, readOptions)
+    try {
+      block(rocksIt)
+    } finally {
+      rocksIt.close()
+      readOptions.close()
+      bound.close()
+    }
   }
 
-  def put(key: String, value: Array[Byte]): Unit = {
-    db.put(handle, key.getBytes(), value)
+  // Like withBoundedRocksIterator, with point lookups via readOptions at the snapshot of the iterator
+  def withBoundedSnapshotIterator[T](upperBound: Array[Byte])(block: (ReadOptions, RocksIterator) => T): T = {
+    val snapshot = db.getSnapshot
+    val bound = new Slice(upperBound)
+    val readOptions = new ReadOptions().setAutoPrefixMode(true).setIterateUpperBound(bound).setSnapshot(snapshot)
+    val rocksIt = db.newIterator(handle, readOptions)
+    try {
+      block(readOptions, rocksIt)
+    } finally {
+      rocksIt.close()
+      readOptions.close()
+      bound.close()
+      db.releaseSnapshot(snapshot)
+    }
   }
 
-  def delete(key: String): Unit = {
-    db.delete(handle, key.getBytes())
+  // For full passes over the column family, the blocks it reads do not displace the cached hot blocks
+  def withUncachedRocksIterator[T](block: RocksIterator => T): T = {
+    val readOptions = new ReadOptions().setFillCache(false).setTotalOrderSeek(true)
+    val rocksIt = db.newIterator(handle, readOptions)
+    try {
+      block(rocksIt)
+    } finally {
+      rocksIt.close()
+      readOptions.close()
+    }
+  }
+
+  // Point lookups via readOptions and the iterator see the same snapshot of the db
+  def withSnapshotIterator[T](block: (ReadOptions, RocksIterator) => T): T = {
+    val snapshot = db.getSnapshot
+    try {
+      withIteratorAt(snapshot)(block)
+    } finally {
+      db.releaseSnapshot(snapshot)
+    }
+  }
+
+  // Like withSnapshotIterator, for a snapshot that the caller releases
+  def withIteratorAt[T](snapshot: Snapshot)(block: (ReadOptions, RocksIterator) => T): T = {
+    val readOptions = new ReadOptions().setSnapshot(snapshot).setTotalOrderSeek(true)
+    val rocksIt = db.newIterator(handle, readOptions)
+    try {
+      block(readOptions, rocksIt)
+    } finally {
+      rocksIt.close()
+      readOptions.close()
+    }
+  }
+
+  def multiGet(readOptions: ReadOptions, keys: Seq[Array[Byte]]): Seq[Option[Array[Byte]]] = {
+    val handles = List.fill(keys.length)(handle).asJava
+    db.multiGetAsList(readOptions, handles, keys.asJava).asScala.map(Option(_)).toSeq
+  }
+
+  def get(key: Array[Byte]): Array[Byte] = {
+    db.get(handle, key)
+  }
+
+  def get(readOptions: ReadOptions, key: Array[Byte]): Array[Byte] = {
+    db.get(handle, readOptions, key)
+  }
+
+  def put(key: Array[Byte], value: Array[Byte]): Unit = {
+    db.put(handle, key, value)
+  }
+
+  def delete(key: Array[Byte]): Unit = {
+    db.delete(handle, key)
+  }
+
+  // Estimated number of entries in this column family, taken from memtable and SST file statistics
+  def estimateNumEntries(): Long = db.getLongProperty(handle, "rocksdb.estimate-num-keys")
+
+  // All changes made in block are applied atomically, readers see either none or all of them
+  def write(block: RocksDBWriteBatch => Unit): Unit = {
+    val batch = new WriteBatch()
+    try {
+      block(new RocksDBWriteBatch(batch, handle))
+      db.write(writeOptions, batch)
+    } finally {
+      batch.close()
+    }
   }
 
 }
 
 object RocksDBStore {
 
-  def scan(rocksIt: RocksIterator, key: String, prefix: Option[String]): RocksDBIterator = {
-    rocksIt.seek(key.getBytes())
+  def startsWith(bytes: Array[Byte], prefix: Array[Byte]): Boolean =
+    bytes.length >= prefix.length && util.Arrays.equals(bytes, 0, prefix.length, prefix, 0, prefix.length)
+
+  // Unsigned lexicographic comparison, as used by the default RocksDB comparator
+  def compareBytes(a: Array[Byte], b: Array[Byte]): Int = util.Arrays.compareUnsigned(a, b)
+
+  // The smallest byte string sorting after all byte strings starting with prefix, if there is one
+  def prefixUpperBound(prefix: Array[Byte]): Option[Array[Byte]] = {
+    val lastIncrementable = prefix.lastIndexWhere(_ != 0xFF.toByte)
+    if (lastIncrementable < 0) None
+    else Some(prefix.take(lastIncrementable) :+ (prefix(lastIncrementable) + 1).toByte)
+  }
+
+  def scan(rocksIt: RocksIterator, key: Array[Byte], prefix: Option[Array[Byte]]): RocksDBIterator = {
+    rocksIt.seek(key)
     new RocksDBIterator(rocksIt, prefix)
   }
 
-  def scanKeysOnly(rocksIt: RocksIterator, key: String, prefix: Option[String]): RocksDBKeyIterator = {
-    rocksIt.seek(key.getBytes())
+  def scanKeysOnly(rocksIt: RocksIterator, key: Array[Byte], prefix: Option[Array[Byte]]): RocksDBKeyIterator = {
+    rocksIt.seek(key)
     new RocksDBKeyIterator(rocksIt, prefix)
   }
 
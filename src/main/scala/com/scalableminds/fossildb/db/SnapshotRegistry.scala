@@ -0,0 +1,105 @@
+package com.scalableminds.fossildb.db
+
+import com.typesafe.scalalogging.LazyLogging
+import org.rocksdb.{RocksDB, Snapshot}
+
+import java.util.concurrent.{Executors, ThreadLocalRandom, TimeUnit}
+import scala.collection.mutable
+import scala.util.Try
+
+case class SnapshotToken(id: Long, expiresAt: Long)
+
+/*
+   RocksDB snapshots handed out to clients by id, so that several requests read the same state of the db.
+   A snapshot keeps RocksDB from dropping the entries it sees, so it is released after its time to live, or
+   earlier when the client releases it. Expired snapshots are released on the next call to the registry, or by
+   the reaper every reapIntervalSeconds on an idle server. Snapshots still used by a request are only released
+   once that request is done.
+ */
+class SnapshotRegistry(db: RocksDB, reapIntervalSeconds: Long = SnapshotRegistry.defaultReapIntervalSeconds) extends LazyLogging {
+
+  private class Entry(val snapshot: Snapshot, val expiresAt: Long) {
+    var users = 0
+    var released = false
+  }
+
+  private val entries = mutable.HashMap[Long, Entry]()
+  // Ids do not start at 1, so that tokens from before a restart or restore are unlikely to be valid again
+  private var nextId = ThreadLocalRandom.current.nextLong(1L << 48)
+
+  def acquire(ttlSeconds: Long): SnapshotToken = synchronized {
+    require(ttlSeconds > 0 && ttlSeconds <= SnapshotRegistry.maxTtlSeconds, s"Snapshot ttl must be between 1 and ${SnapshotRegistry.maxTtlSeconds} seconds")
+    releaseExpired()
+    require(entries.size < SnapshotRegistry.maxSnapshots, s"There are already ${SnapshotRegistry.maxSnapshots} snapshots")
+    nextId += 1
+    val entry = new Entry(db.getSnapshot, System.currentTimeMillis + ttlSeconds * 1000)
+    entries(nextId) = entry
+    SnapshotToken(nextId, entry.expiresAt)
+  }
+
+  def release(id: Long): Unit = synchronized {
+    entries.remove(id).foreach(releaseEntry)
+  }
+
+  def withSnapshot[T](id: Long)(block: Snapshot => T): T = {
+    val entry = synchronized {
+      releaseExpired()
+      val entry = entries.getOrElse(id, throw new NoSuchElementException(s"Snapshot $id does not exist or has expired"))
+      entry.users += 1
+      entry
+    }
+    try {
+      block(entry.snapshot)
+    } finally {
+      synchronized {
+        entry.users -= 1
+        if (entry.released && entry.users == 0) db.releaseSnapshot(entry.snapshot)
+      }
+    }
+  }
+
+  def size: Int = synchronized(entries.size)
+
+  private val reaper = {
+    val reaper = Executors.newSingleThreadScheduledExecutor((runnable: Runnable) => {
+      val thread = new Thread(runnable, "fossildb-snapshot-reaper")
+      thread.setDaemon(true)
+      thread
+    })
+    // An exception would cancel all further runs of the scheduled task
+    reaper.scheduleWithFixedDelay(() => Try(synchronized(releaseExpired())).failed.foreach(e => logger.warn("Could not release expired snapshots: " + e)),
+      reapIntervalSeconds, reapIntervalSeconds, TimeUnit.SECONDS)
+    reaper
+  }
+
+  // Before the db is closed
+  def releaseAll(): Unit = {
+    reaper.shutdownNow()
+    reaper.awaitTermination(1, TimeUnit.MINUTES)
+    synchronized {
+      entries.values.foreach(releaseEntry)
+      entries.clear()
+    }
+  }
+
+  private def releaseExpired(): Unit = {
+    val now = System.currentTimeMillis
+    entries.filter(_._2.expiresAt <= now).foreach { case (id, entry) =>
+      entries.remove(id)
+      releaseEntry(entry)
+    }
+  }
+
+  private def releaseEntry(entry: Entry): Unit = {
+    entry.released = true
+    if (entry.users == 0) db.releaseSnapshot(entry.snapshot)
+  }
+
+}
+
+object SnapshotRegistry {
+  val defaultTtlSeconds: Long = 60
+  val maxTtlSeconds: Long = 3600
+  val maxSnapshots: Int = 1000
+  val defaultReapIntervalSeconds: Long = 10
+}
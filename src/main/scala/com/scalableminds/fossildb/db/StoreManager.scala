@@ -1,25 +1,54 @@
 package com.scalableminds.fossildb.db
 
+import com.typesafe.scalalogging.LazyLogging
+import org.rocksdb.Snapshot
+
 import java.nio.file.{Path, Paths}
 import java.util.concurrent.atomic.AtomicBoolean
+import java.util.concurrent.{Executors, TimeUnit}
 import scala.concurrent.Future
+import scala.util.Try
+
+class StoreManager(dataDir: Path, backupDir: Path, val columnFamilies: List[String], rocksdbOptionsFile: Option[String],
+                   compression: Map[String, CompressionConfig] = Map.empty,
+                   blockCacheBytes: Long = RocksDBManager.defaultBlockCacheBytes,
+                   bloomPrefixLengths: Map[String, Int] = Map.empty,
+                   backupRetention: BackupRetention = BackupRetention.default,
+                   retentionPolicies: Map[String, RetentionPolicy] = Map.empty,
+                   retentionSweepIntervalSeconds: Long = StoreManager.defaultRetentionSweepIntervalSeconds,
+                   deltaChainLengths: Map[String, Int] = Map.empty,
+                   readCacheBytes: Map[String, Long] = Map.empty,
+                   groupCommit: Map[String, GroupCommitConfig] = Map.empty) extends LazyLogging {
+
+  require(retentionPolicies.keySet.subsetOf(columnFamilies.toSet), s"Retention policies configured for unknown column families ${(retentionPolicies.keySet -- columnFamilies).mkString(", ")}")
 
-class StoreManager(dataDir: Path, backupDir: Path, columnFamilies: List[String], rocksdbOptionsFile: Option[String]) {
+  require(deltaChainLengths.keySet.subsetOf(columnFamilies.toSet), s"Delta encoding configured for unknown column families ${(deltaChainLengths.keySet -- columnFamilies).mkString(", ")}")
+
+  require(readCacheBytes.keySet.subsetOf(columnFamilies.toSet), s"Read caches configured for unknown column families ${(readCacheBytes.keySet -- columnFamilies).mkString(", ")}")
+
+  require(groupCommit.keySet.subsetOf(columnFamilies.toSet), s"Group commit configured for unknown column families ${(groupCommit.keySet -- columnFamilies).mkString(", ")}")
 
   private var rocksDBManager: Option[RocksDBManager] = None
   private var stores: Option[Map[String, VersionedKeyValueStore]] = None
+  // Outlives the RocksDBManager, which is replaced on restore
+  private val backupManager = new BackupManager(backupDir, backupRetention)
 
   reInitialize()
 
   private def reInitialize(): Unit = {
+    closeStores()
     rocksDBManager.map(_.close())
-    rocksDBManager = Some(new RocksDBManager(dataDir, columnFamilies, rocksdbOptionsFile))
+    rocksDBManager = Some(new RocksDBManager(dataDir, columnFamilies, rocksdbOptionsFile, compression, blockCacheBytes, bloomPrefixLengths))
     stores = Some(columnFamilies.map { cf =>
-      val store: VersionedKeyValueStore = new VersionedKeyValueStore(rocksDBManager.get.getStoreForColumnFamily(cf).get)
+      val store: VersionedKeyValueStore = new VersionedKeyValueStore(rocksDBManager.get.getStoreForColumnFamily(cf).get, rocksDBManager.get.keyCodecForColumnFamily(cf).get,
+        deltaChainLengths.get(cf).map(new DeltaEncoding(_)), readCacheBytes.getOrElse(cf, 0L), groupCommit.get(cf), cf)
       cf -> store
     }.toMap)
   }
 
+  // Writes the puts still pending in group commits
+  private def closeStores(): Unit = stores.foreach(_.values.foreach(_.close()))
+
   def getStore(columnFamily: String): VersionedKeyValueStore = {
     failDuringRestore()
     try {
@@ -33,29 +62,43 @@ class StoreManager(dataDir: Path, backupDir: Path, columnFamilies: List[String],
 
   private val backupInProgress = new AtomicBoolean(false)
   private val restoreInProgress = new AtomicBoolean(false)
+  private val retentionInProgress = new AtomicBoolean(false)
 
   private def failDuringRestore(): Unit = if (restoreInProgress.get) throw new Exception("Unavailable during restore-from-backup operation")
   private def failDuringBackup(): Unit = if (backupInProgress.get) throw new Exception("Unavailable during backup")
+  private def failDuringRetention(): Unit = if (retentionInProgress.get) throw new Exception("Unavailable while applying retention policies")
 
 
   def backup: Option[BackupInfo] = {
+    val job = startBackup()
+    Some(backupManager.awaitJob(job.jobId))
+  }
+
+  // Returns immediately, the backup runs in the background
+  def startBackup(): BackupJobStatus = {
     failDuringRestore()
     if (backupInProgress.compareAndSet(false, true)) {
       try {
-        rocksDBManager.get.backup(backupDir)
-      } finally {
-        backupInProgress.set(false)
+        backupManager.startJob(rocksDBManager.get)(backupInProgress.set(false))
+      } catch {
+        case e: Exception =>
+          backupInProgress.set(false)
+          throw e
       }
     } else {
       throw new Exception("Backup already in progress")
     }
   }
 
+  def backupStatus(jobIdOpt: Option[Long]): BackupJobStatus = backupManager.jobStatus(jobIdOpt)
+
   def restoreFromBackup(): Unit = {
     failDuringBackup()
+    failDuringRetention()
     if (restoreInProgress.compareAndSet(false, true)) {
       try {
-        rocksDBManager.get.restoreFromBackup(backupDir)
+        closeStores()
+        backupManager.restore(rocksDBManager.get)
       } finally {
         reInitialize()
         restoreInProgress.set(false)
@@ -71,12 +114,116 @@ class StoreManager(dataDir: Path, backupDir: Path, columnFamilies: List[String],
     rocksDBManager.get.compactAllData()
   }
 
+  @volatile private var lastExport: Option[ExportProgress] = None
+  private val exportInProgress = new AtomicBoolean(false)
+
   def exportDB(newDataDir: String, newOptionsFilePathOpt: Option[String]): Unit = {
     failDuringRestore()
-    rocksDBManager.get.exportToNewDB(Paths.get(newDataDir), newOptionsFilePathOpt)
+    if (exportInProgress.compareAndSet(false, true)) {
+      val progress = new ExportProgress(newDataDir)
+      lastExport = Some(progress)
+      try {
+        rocksDBManager.get.exportToNewDB(Paths.get(newDataDir), newOptionsFilePathOpt, progress)
+        progress.finish(None)
+      } catch {
+        case e: Exception =>
+          progress.finish(Some(e))
+          throw e
+      } finally {
+        exportInProgress.set(false)
+      }
+    } else {
+      throw new Exception("Export already in progress")
+    }
+  }
+
+  // The running or the last finished export
+  def exportStatus: ExportStatus = lastExport.map(_.status).getOrElse(throw new NoSuchElementException("No export was started yet"))
+
+  def compressionStats(columnFamilyOpt: Option[String]): Seq[CompressionStats] = {
+    failDuringRestore()
+    columnFamilyOpt.foreach(getStore)
+    columnFamilyOpt.map(List(_)).getOrElse(columnFamilies).map(rocksDBManager.get.compressionStats)
+  }
+
+  def propertySamples: Seq[PropertySample] = {
+    failDuringRestore()
+    rocksDBManager.get.propertySamples
+  }
+
+  def cacheStats: CacheStats = {
+    failDuringRestore()
+    rocksDBManager.get.cacheStats.copy(readCaches = stores.get.toSeq.sortBy(_._1).map { case (cf, store) => cf -> store.readCacheStats })
+  }
+
+  /*
+     Deletes the versions that the retention policy of the column family, or of all column families with a policy,
+     does not keep. Returns the number of deleted versions, their space is reclaimed by the next compactions.
+   */
+  def applyRetention(columnFamilyOpt: Option[String]): Long = {
+    failDuringRestore()
+    val policies = columnFamilyOpt match {
+      case Some(columnFamily) =>
+        getStore(columnFamily)
+        Map(columnFamily -> retentionPolicies.getOrElse(columnFamily, throw new NoSuchElementException("No retention policy for column family " + columnFamily)))
+      case None => retentionPolicies
+    }
+    if (retentionInProgress.compareAndSet(false, true)) {
+      try {
+        policies.toSeq.sortBy(_._1).map { case (columnFamily, policy) =>
+          val deletedVersions = getStore(columnFamily).applyRetention(policy)
+          logger.info(s"Retention policy $policy deleted $deletedVersions versions in column family $columnFamily")
+          deletedVersions
+        }.sum
+      } finally {
+        retentionInProgress.set(false)
+      }
+    } else {
+      throw new Exception("Retention policies are already being applied")
+    }
+  }
+
+  def acquireSnapshot(ttlSeconds: Option[Long]): SnapshotToken = {
+    failDuringRestore()
+    rocksDBManager.get.snapshots.acquire(ttlSeconds.getOrElse(SnapshotRegistry.defaultTtlSeconds))
+  }
+
+  def releaseSnapshot(id: Long): Unit = {
+    failDuringRestore()
+    rocksDBManager.get.snapshots.release(id)
+  }
+
+  // Runs block at the snapshot with the id, if one is given. Snapshots do not survive a restore.
+  def withSnapshot[T](id: Option[Long])(block: Option[Snapshot] => T): T = id match {
+    case Some(snapshotId) =>
+      failDuringRestore()
+      rocksDBManager.get.snapshots.withSnapshot(snapshotId)(snapshot => block(Some(snapshot)))
+    case None => block(None)
+  }
+
+  private val retentionSweeper = if (retentionPolicies.isEmpty) None else {
+    val sweeper = Executors.newSingleThreadScheduledExecutor((runnable: Runnable) => {
+      val thread = new Thread(runnable, "fossildb-retention")
+      thread.setDaemon(true)
+      thread
+    })
+    // An exception would cancel all further runs of the scheduled task
+    sweeper.scheduleWithFixedDelay(() => Try(applyRetention(None)).failed.foreach(e => logger.warn("Could not apply retention policies: " + e)),
+      retentionSweepIntervalSeconds, retentionSweepIntervalSeconds, TimeUnit.SECONDS)
+    Some(sweeper)
   }
 
   def close: Option[Future[Unit]] = {
+    retentionSweeper.foreach { sweeper =>
+      sweeper.shutdownNow()
+      sweeper.awaitTermination(1, TimeUnit.MINUTES)
+    }
+    backupManager.close()
+    closeStores()
     rocksDBManager.map(_.close())
   }
 }
+
+object StoreManager {
+  val defaultRetentionSweepIntervalSeconds: Long = 3600
+}
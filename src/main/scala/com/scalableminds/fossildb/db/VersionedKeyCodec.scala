@@ -0,0 +1,143 @@
+package com.scalableminds.fossildb.db
+
+import java.nio.ByteBuffer
+import java.nio.charset.StandardCharsets
+
+/*
+   Maps (key, version) pairs to the composite keys stored in RocksDB and back, working on the raw key bytes.
+   In every encoding, the composite keys of all versions of a key are contiguous and start with the newest version.
+ */
+sealed trait VersionedKeyCodec {
+
+  def name: String
+
+  // Keys containing this char cannot be encoded unambiguously
+  def invalidKeyChar: Char
+
+  def encode(key: Array[Byte], version: Long): Array[Byte]
+
+  // Length of the key part of compositeKey, or -1 if compositeKey is not a composite key of this encoding
+  def keyLength(compositeKey: Array[Byte]): Int
+
+  // Only defined if keyLength(compositeKey) is non-negative
+  def decodeVersion(compositeKey: Array[Byte]): Long
+
+  // All composite keys of key start with this
+  def versionPrefix(key: Array[Byte]): Array[Byte]
+
+  // Sorts after all composite keys of key, but before those of any other key that sort after them
+  def seekPastVersionsOf(key: Array[Byte]): Array[Byte]
+
+  // The composite keys of all versions of key between oldestVersion and newestVersion (inclusive) form the range [begin, end)
+  def versionRange(key: Array[Byte], oldestVersion: Option[Long], newestVersion: Option[Long]): (Array[Byte], Array[Byte])
+
+  def encodeKey(key: String): Array[Byte] = key.getBytes(StandardCharsets.UTF_8)
+
+  def decodeKey(compositeKey: Array[Byte], keyLength: Int): String = new String(compositeKey, 0, keyLength, StandardCharsets.UTF_8)
+
+  def decode(compositeKey: Array[Byte]): Option[VersionedKey] = {
+    val length = keyLength(compositeKey)
+    if (length < 0) None else Some(VersionedKey(decodeKey(compositeKey, length), decodeVersion(compositeKey)))
+  }
+
+}
+
+/*
+   key bytes, a zero byte and the bitwise inverted version as 8 byte big-endian long.
+ */
+object BinaryKeyCodec extends VersionedKeyCodec {
+
+  val name = "binary"
+
+  private val separator: Byte = 0
+  private val versionLength = 8
+
+  val invalidKeyChar: Char = '\u0000'
+
+  def encode(key: Array[Byte], version: Long): Array[Byte] =
+    ByteBuffer.allocate(key.length + 1 + versionLength).put(key).put(separator).putLong(~version).array()
+
+  def keyLength(compositeKey: Array[Byte]): Int = {
+    val length = compositeKey.length - versionLength - 1
+    if (length >= 0 && compositeKey(length) == separator) length else -1
+  }
+
+  def decodeVersion(compositeKey: Array[Byte]): Long =
+    ~ByteBuffer.wrap(compositeKey, compositeKey.length - versionLength, versionLength).getLong
+
+  def versionPrefix(key: Array[Byte]): Array[Byte] = key :+ separator
+
+  def seekPastVersionsOf(key: Array[Byte]): Array[Byte] = key :+ (separator + 1).toByte
+
+  def versionRange(key: Array[Byte], oldestVersion: Option[Long], newestVersion: Option[Long]): (Array[Byte], Array[Byte]) = {
+    val begin = newestVersion.map(encode(key, _)).getOrElse(versionPrefix(key))
+    val end = oldestVersion.filter(_ > 0).map(v => encode(key, v - 1)).getOrElse(seekPastVersionsOf(key))
+    (begin, end)
+  }
+
+}
+
+/*
+   The original string encoding key@<inverted version as 16 hex chars>@<version>.
+   Still used for column families that were created with it.
+ */
+object LegacyStringKeyCodec extends VersionedKeyCodec {
+
+  val name = "legacy"
+
+  private val separator: Byte = '@'.toByte
+
+  val invalidKeyChar: Char = '@'
+
+  // Fixed-width (16 chars for non-negative versions), so that newer versions sort first
+  private def invertedVersionBytes(version: Long): Array[Byte] = (~version).toHexString.toUpperCase.getBytes(StandardCharsets.US_ASCII)
+
+  def encode(key: Array[Byte], version: Long): Array[Byte] =
+    versionPrefix(key) ++ invertedVersionBytes(version) ++ (separator +: version.toString.getBytes(StandardCharsets.US_ASCII))
+
+  def keyLength(compositeKey: Array[Byte]): Int = {
+    val first = compositeKey.indexOf(separator)
+    val last = compositeKey.lastIndexOf(separator)
+    val hasVersionSuffix = first >= 0 && last > first && last < compositeKey.length - 1 &&
+      (last + 1 until compositeKey.length).forall(i => compositeKey(i) >= '0' && compositeKey(i) <= '9')
+    if (hasVersionSuffix) first else -1
+  }
+
+  def decodeVersion(compositeKey: Array[Byte]): Long = {
+    var version = 0L
+    var i = compositeKey.lastIndexOf(separator) + 1
+    while (i < compositeKey.length) {
+      version = version * 10 + (compositeKey(i) - '0')
+      i += 1
+    }
+    version
+  }
+
+  def versionPrefix(key: Array[Byte]): Array[Byte] = key :+ separator
+
+  // The char following the separator sorts after all composite keys key@... of the given key
+  def seekPastVersionsOf(key: Array[Byte]): Array[Byte] = key :+ (separator + 1).toByte
+
+  // Both the inverted version and the suffix following it sort before the char following the separator
+  def versionRange(key: Array[Byte], oldestVersion: Option[Long], newestVersion: Option[Long]): (Array[Byte], Array[Byte]) = {
+    val begin = newestVersion.map(v => versionPrefix(key) ++ invertedVersionBytes(v)).getOrElse(versionPrefix(key))
+    val end = oldestVersion.map(v => seekPastVersionsOf(versionPrefix(key) ++ invertedVersionBytes(v))).getOrElse(seekPastVersionsOf(key))
+    (begin, end)
+  }
+
+}
+
+object VersionedKeyCodec {
+
+  /*
+     Column families that already contain string-encoded keys keep using that encoding,
+     empty ones (including all newly created ones) use the binary encoding.
+     ExportDB migrates the data of a legacy column family to the binary encoding.
+   */
+  def detect(firstCompositeKey: Option[Array[Byte]]): VersionedKeyCodec = firstCompositeKey match {
+    case Some(compositeKey) if LegacyStringKeyCodec.keyLength(compositeKey) >= 0 && BinaryKeyCodec.keyLength(compositeKey) < 0 =>
+      LegacyStringKeyCodec
+    case _ => BinaryKeyCodec
+  }
+
+}
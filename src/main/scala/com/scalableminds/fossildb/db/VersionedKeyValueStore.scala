@@ -1,33 +1,15 @@
 package com.scalableminds.fossildb.db
 
-import org.rocksdb.RocksIterator
+import org.rocksdb.{ReadOptions, RocksIterator, Snapshot}
 
+import java.nio.ByteBuffer
+import java.util
 import scala.annotation.tailrec
-import scala.util.Try
+import scala.collection.mutable
+import scala.concurrent.Future
 
 
-case class VersionedKey(key: String, version: Long) {
-  override def toString: String = VersionedKey.asString(key, version)
-}
-
-object VersionedKey {
-
-  def asString(key: String, version: Long) = s"$key${VersionedKey.versionSeparator}${(~version).toHexString.toUpperCase}${VersionedKey.versionSeparator}$version"
-
-  val versionSeparator: Char = '@'
-
-  def apply(key: String): Option[VersionedKey] = {
-    val parts = key.split(versionSeparator)
-    for {
-      key <- parts.headOption
-      versionString <- parts.lastOption
-      version <- Try(versionString.toLong).toOption
-    } yield {
-      VersionedKey(key, version)
-    }
-  }
-
-}
+case class VersionedKey(key: String, version: Long)
 
 case class VersionedKeyValuePair[T](versionedKey: VersionedKey, value: T) {
 
@@ -37,71 +19,207 @@ case class VersionedKeyValuePair[T](versionedKey: VersionedKey, value: T) {
 
 }
 
+case class KeyCount(keys: Long, versions: Long, exact: Boolean)
 
-class VersionFilterIterator(it: RocksDBIterator, version: Option[Long]) extends Iterator[VersionedKeyValuePair[Array[Byte]]] {
 
-  private var currentKey: Option[String] = None
+/*
+   Yields the newest entry (not newer than version, if given) of each key, starting at the current position of rocksIt.
+   Instead of stepping over all other versions of a key, it seeks directly to the relevant version and, once that is
+   emitted, past all remaining versions of the key.
+ */
+class VersionFilterIterator(rocksIt: RocksIterator, codec: VersionedKeyCodec, prefix: Array[Byte], version: Option[Long]) extends Iterator[VersionedKeyValuePair[Array[Byte]]] {
 
-  private var versionedIterator = it.flatMap{ pair =>
-    VersionedKey(pair.key).map(VersionedKeyValuePair(_, pair.value))
-  }
+  private var nextPair: Option[VersionedKeyValuePair[Array[Byte]]] = None
 
   override def hasNext: Boolean = {
-    versionedIterator = versionedIterator.dropWhile { pair =>
-      currentKey.contains(pair.key) || version.exists(pair.version > _)
+    while (nextPair.isEmpty && rocksIt.isValid) {
+      val compositeKey = rocksIt.key()
+      if (!RocksDBStore.startsWith(compositeKey, prefix)) return false
+      val keyLength = codec.keyLength(compositeKey)
+      if (keyLength < 0) rocksIt.next()
+      else {
+        val keyBytes = util.Arrays.copyOf(compositeKey, keyLength)
+        val entryVersion = codec.decodeVersion(compositeKey)
+        version match {
+          case Some(v) if entryVersion > v =>
+            rocksIt.seek(codec.encode(keyBytes, v))
+          case _ =>
+            nextPair = Some(VersionedKeyValuePair(VersionedKey(codec.decodeKey(compositeKey, keyLength), entryVersion), rocksIt.value()))
+            rocksIt.seek(codec.seekPastVersionsOf(keyBytes))
+        }
+      }
     }
-    versionedIterator.hasNext
+    nextPair.isDefined
   }
 
   override def next(): VersionedKeyValuePair[Array[Byte]] = {
-    val value = versionedIterator.next()
-    currentKey = Some(value.key)
-    value
+    if (!hasNext) throw new NoSuchElementException
+    val pair = nextPair.get
+    nextPair = None
+    pair
   }
 
 }
 
-class KeyOnlyIterator[T](rocksIt: RocksIterator, startAfterKey: Option[String], prefix: Option[String]) extends Iterator[String] {
+/*
+   Yields the versions in the composite key range [begin, end), which must only contain versions of a single key,
+   together with the size of each value if requested. The sizes are read without copying the values out of RocksDB.
+ */
+class VersionIterator(rocksIt: RocksIterator, codec: VersionedKeyCodec, begin: Array[Byte], end: Array[Byte],
+                      oldestFirst: Boolean, withValueSizes: Boolean) extends Iterator[(Long, Option[Int])] {
+
+  private val noValue = ByteBuffer.allocateDirect(0)
+
+  if (oldestFirst) {
+    // seekForPrev goes to the last key not after end, which may be end itself
+    rocksIt.seekForPrev(end)
+    if (rocksIt.isValid && RocksDBStore.compareBytes(rocksIt.key(), end) >= 0) rocksIt.prev()
+  } else {
+    rocksIt.seek(begin)
+  }
 
-  /*
-     Note that seek in the underlying iterators either hits precisely or goes to the
-     lexicographically *next* key. To achieve correct behavior with startAfterKey,
-     we have to advance once in case of the exact hit.
-   */
+  private var compositeKey: Option[Array[Byte]] = nextVersionKey()
 
-  private var currentKey: Option[String] = startAfterKey
+  private def advance(): Unit = if (oldestFirst) rocksIt.prev() else rocksIt.next()
 
-  private def compositeKeyFor(keyOpt: Option[String]) = keyOpt match {
-    case Some(key) => VersionedKey(key, 0).toString
-    // If the currentKey is not yet set, seek to the very beginning, or, if set, to the prefix.
-    case None => prefix.getOrElse("")
+  private def nextVersionKey(): Option[Array[Byte]] = {
+    var result: Option[Array[Byte]] = None
+    var done = false
+    while (!done && rocksIt.isValid) {
+      val key = rocksIt.key()
+      if (RocksDBStore.compareBytes(key, begin) < 0 || RocksDBStore.compareBytes(key, end) >= 0) done = true
+      else if (codec.keyLength(key) >= 0) {
+        result = Some(key)
+        done = true
+      } else advance()
+    }
+    result
   }
 
-  override def hasNext: Boolean = {
-    val it = RocksDBStore.scanKeysOnly(rocksIt, compositeKeyFor(currentKey), prefix)
-    if (it.hasNext && currentKey.isDefined && currentKey.contains(VersionedKey(it.peek).get.key)) it.next()
-    it.hasNext
+  override def hasNext: Boolean = compositeKey.isDefined
+
+  override def next(): (Long, Option[Int]) = {
+    val key = compositeKey.getOrElse(throw new NoSuchElementException)
+    val valueSize = if (withValueSizes) Some(rocksIt.value(noValue)) else None
+    advance()
+    compositeKey = nextVersionKey()
+    (codec.decodeVersion(key), valueSize)
   }
 
+}
+
+class KeyOnlyIterator(rocksIt: RocksIterator, codec: VersionedKeyCodec, startPosition: Array[Byte], prefix: Array[Byte]) extends Iterator[String] {
+
+  /*
+     All versions of a key are stored contiguously, so after reading one of them we can jump to the next key
+     with a single seek to the first byte string sorting after them.
+     The skipped version keys are never read or decoded.
+     Note that seek in the underlying iterator either hits precisely or goes to the lexicographically *next* key.
+   */
+
+  rocksIt.seek(startPosition)
+
+  override def hasNext: Boolean = rocksIt.isValid && RocksDBStore.startsWith(rocksIt.key(), prefix)
+
   override def next(): String = {
-    val it = RocksDBStore.scanKeysOnly(rocksIt, compositeKeyFor(currentKey), prefix)
-    if (it.hasNext && currentKey.isDefined && currentKey.contains(VersionedKey(it.peek).get.key)) it.next()
-    val nextKey = VersionedKey(it.next()).get.key
-    currentKey = Some(nextKey)
-    nextKey
+    val compositeKey = rocksIt.key()
+    val keyLength = codec.keyLength(compositeKey)
+    val keyBytes = if (keyLength < 0) compositeKey else util.Arrays.copyOf(compositeKey, keyLength)
+    rocksIt.seek(codec.seekPastVersionsOf(keyBytes))
+    codec.decodeKey(keyBytes, keyBytes.length)
   }
 
 }
 
 
-class VersionedKeyValueStore(underlying: RocksDBStore) {
+class VersionedKeyValueStore(underlying: RocksDBStore, val keyCodec: VersionedKeyCodec, val deltaEncoding: Option[DeltaEncoding] = None,
+                             readCacheBytes: Long = 0, groupCommit: Option[GroupCommitConfig] = None, name: String = "") {
+
+  private val readCache = new ReadCache(readCacheBytes)
+
+  // Deltas written while the collection had delta encoding stay readable after it is removed
+  private val readEncoding = deltaEncoding.getOrElse(DeltaEncoding.readOnly)
+
+  private val groupCommitter = groupCommit.map { config =>
+    new GroupCommitter(name, config, newestVersion, { entries =>
+      putEntries(entries)
+      entries.map(_._1).distinct.foreach(readCache.invalidate)
+    })
+  }
 
   def withRawRocksIterator[T](block: RocksIterator => T): T = underlying.withRawRocksIterator(block)
 
-  def get(rocksIt: RocksIterator, key: String, version: Option[Long] = None): Option[VersionedKeyValuePair[Array[Byte]]] =
-    scanVersionValuePairs(rocksIt, key, version).nextOption()
+  // The caller is responsible for closing the iterator. Lookups of delta bases with its readOptions see its snapshot.
+  def newSnapshotIterator(): SnapshotRocksIterator = underlying.newSnapshotIterator()
+
+  /*
+     An iterator that only sees the versions of key. Lookups with it skip SST files that cannot contain key
+     if the column family has a prefix bloom filter that is not longer than the encoded key.
+   */
+  def withKeyIterator[T](key: String)(block: RocksIterator => T): T = {
+    requireValidKey(key)
+    RocksDBStore.prefixUpperBound(keyCodec.versionPrefix(keyCodec.encodeKey(key))) match {
+      case Some(end) => underlying.withBoundedRocksIterator(end)(block)
+      case None => underlying.withRawRocksIterator(block)
+    }
+  }
+
+  /*
+     Like withKeyIterator, for reads that resolve values: with delta encoding, the iterator has an explicit
+     snapshot, and the read options to look up delta bases at it are passed on to block. Otherwise block gets
+     None, bases of deltas left from earlier delta encoding are then looked up at the current state.
+   */
+  def withKeySnapshotIterator[T](key: String)(block: (Option[ReadOptions], RocksIterator) => T): T =
+    if (deltaEncoding.isEmpty) withKeyIterator(key)(block(None, _))
+    else {
+      requireValidKey(key)
+      RocksDBStore.prefixUpperBound(keyCodec.versionPrefix(keyCodec.encodeKey(key))) match {
+        case Some(end) => underlying.withBoundedSnapshotIterator(end)((readOptions, rocksIt) => block(Some(readOptions), rocksIt))
+        case None => underlying.withSnapshotIterator((readOptions, rocksIt) => block(Some(readOptions), rocksIt))
+      }
+    }
+
+  def get(rocksIt: RocksIterator, key: String, version: Option[Long] = None, readOptions: Option[ReadOptions] = None): Option[VersionedKeyValuePair[Array[Byte]]] =
+    resolvingValues(scanVersionValuePairs(rocksIt, key, version), readOptions).nextOption()
+
+  /*
+     A lookup of a single key as made by the Get RPC: concurrent identical lookups share one read, and with a
+     read cache, the result is reused until the key is written.
+   */
+  def getShared(key: String, version: Option[Long]): Option[VersionedKeyValuePair[Array[Byte]]] =
+    readCache.get(key, version)(withKeySnapshotIterator(key)((readOptions, rocksIt) => get(rocksIt, key, version, readOptions)))
+
+  def readCacheStats: ReadCacheStats = readCache.stats
+
+  def groupsCommits: Boolean = groupCommitter.isDefined
+
+  /*
+     A put as made by the Put RPC with group commit: it is written in one batch with the other puts that arrive
+     within the configured window. Without a version, the next one of the key is assigned. Completes with the
+     version once the batch is written.
+   */
+  def putGrouped(key: String, version: Option[Long], value: Array[Byte]): Future[Long] = {
+    requireValidKey(key)
+    groupCommitter.getOrElse(throw new IllegalStateException(s"Group commit is not enabled for $name")).put(key, version, value)
+  }
+
+  def newestVersion(key: String): Option[Long] =
+    withKeyIterator(key)(rocksIt => listVersions(rocksIt, key, Some(1), None).headOption)
+
+  // Writes the pending puts of the group commit
+  def close(): Unit = groupCommitter.foreach(_.close())
+
+  /*
+     An iterator over the entries at snapshot, or else at the time of the call, with the read options it was
+     created with. Passing them on to the lookups made with the iterator keeps delta bases at the same snapshot.
+   */
+  def withSnapshotIterator[T](snapshot: Option[Snapshot])(block: (ReadOptions, RocksIterator) => T): T = snapshot match {
+    case Some(s) => underlying.withIteratorAt(s)(block)
+    case None => underlying.withSnapshotIterator(block)
+  }
 
-  def getMultipleVersions(rocksIt: RocksIterator, key: String, oldestVersion: Option[Long] = None, newestVersion: Option[Long] = None): (List[Array[Byte]], List[Long]) = {
+  def getMultipleVersions(rocksIt: RocksIterator, key: String, oldestVersion: Option[Long] = None, newestVersion: Option[Long] = None,
+                          readOptions: Option[ReadOptions] = None): (List[Array[Byte]], List[Long]) = {
 
     @tailrec
     def toListIter(versionIterator: Iterator[VersionedKeyValuePair[Array[Byte]]],
@@ -114,102 +232,445 @@ class VersionedKeyValueStore(underlying: RocksDBStore) {
       }
     }
 
-    val iterator = scanVersionValuePairs(rocksIt, key, newestVersion)
+    val iterator = resolvingValues(scanVersionValuePairs(rocksIt, key, newestVersion), readOptions)
     val (versions, keys) = toListIter(iterator, List(), List())
     (versions.reverse, keys.reverse)
   }
 
-  private def scanVersionValuePairs(rocksIt: RocksIterator, key: String, version: Option[Long] = None): Iterator[VersionedKeyValuePair[Array[Byte]]] = {
-    requireValidKey(key)
-    val prefix = s"$key${VersionedKey.versionSeparator}"
-    RocksDBStore.scan(rocksIt, version.map(VersionedKey(key, _).toString).getOrElse(prefix), Some(prefix)).flatMap { pair =>
-      VersionedKey(pair.key).map(VersionedKeyValuePair(_, pair.value))
+  /*
+     Batched lookups for many keys: the keys are visited in storage order with one shared iterator, so consecutive
+     seeks stay local, and all of them see one consistent snapshot. Lookups of an exact version are first tried
+     with a single multiGet; only keys without an entry for precisely that version fall back to a seek.
+   */
+  def getMultipleKeysByList(keys: Seq[String], version: Option[Long], snapshot: Option[Snapshot] = None): Seq[Option[VersionedKeyValuePair[Array[Byte]]]] = {
+    keys.foreach(requireValidKey)
+    val sortedKeys = sortedDistinct(keys)
+    withSnapshotIterator(snapshot) { (readOptions, rocksIt) =>
+      val exactHits: Map[String, VersionedKeyValuePair[Array[Byte]]] = version match {
+        case Some(v) =>
+          val values = underlying.multiGet(readOptions, sortedKeys.map(key => compositeKey(key, v)))
+          sortedKeys.zip(values).collect { case (key, Some(value)) =>
+            key -> VersionedKeyValuePair(VersionedKey(key, v), resolve(keyCodec.encodeKey(key), value, Some(readOptions)))
+          }.toMap
+        case None => Map.empty
+      }
+      val results = sortedKeys.map(key => key -> exactHits.get(key).orElse(get(rocksIt, key, version, Some(readOptions)))).toMap
+      keys.map(results)
+    }
+  }
+
+  def getMultipleKeysByListWithMultipleVersions(keys: Seq[String], oldestVersion: Option[Long], newestVersion: Option[Long],
+                                                snapshot: Option[Snapshot] = None): Seq[(String, List[Array[Byte]], List[Long])] = {
+    keys.foreach(requireValidKey)
+    withSnapshotIterator(snapshot) { (readOptions, rocksIt) =>
+      val results = sortedDistinct(keys).map(key => key -> getMultipleVersions(rocksIt, key, oldestVersion, newestVersion, Some(readOptions))).toMap
+      keys.map { key =>
+        val (values, versions) = results(key)
+        (key, values, versions)
+      }
     }
   }
 
-  private def scanVersionsOnly(rocksIt: RocksIterator, key: String, version: Option[Long] = None): Iterator[VersionedKey] = {
+  private def sortedDistinct(keys: Seq[String]): Seq[String] =
+    keys.distinct.map(key => key -> keyCodec.versionPrefix(keyCodec.encodeKey(key)))
+      .sortWith((a, b) => RocksDBStore.compareBytes(a._2, b._2) < 0).map(_._1)
+
+  private def compositeKey(key: String, version: Long): Array[Byte] = keyCodec.encode(keyCodec.encodeKey(key), version)
+
+  // The entries of all versions of key (not newer than version, if given), starting with the newest
+  private def scanVersions(rocksIt: RocksIterator, key: String, version: Option[Long]): RocksDBIterator = {
     requireValidKey(key)
-    val prefix = s"$key${VersionedKey.versionSeparator}"
-    RocksDBStore.scanKeysOnly(rocksIt, version.map(VersionedKey(key, _).toString).getOrElse(prefix), Some(prefix)).flatMap { key =>
-      VersionedKey(key)
+    val keyBytes = keyCodec.encodeKey(key)
+    val (begin, _) = keyCodec.versionRange(keyBytes, None, version)
+    RocksDBStore.scan(rocksIt, begin, Some(keyCodec.versionPrefix(keyBytes)))
+  }
+
+  private def scanVersionValuePairs(rocksIt: RocksIterator, key: String, version: Option[Long] = None): Iterator[VersionedKeyValuePair[Array[Byte]]] =
+    scanVersions(rocksIt, key, version).collect { case pair if keyCodec.keyLength(pair.key) >= 0 =>
+      VersionedKeyValuePair(VersionedKey(key, keyCodec.decodeVersion(pair.key)), pair.value)
+    }
+
+  /*
+     The value of a version given its stored bytes. For a delta, the chain of base versions is followed to the
+     nearest full (or already resolved) value, then the collected deltas are applied to it, oldest first.
+     Bases are looked up directly, with readOptions if the value was read at a snapshot, and recorded in resolved,
+     which maps versions of the same key to their values, so that they are reused for the next older versions.
+   */
+  private def resolve(keyBytes: Array[Byte], stored: Array[Byte], readOptions: Option[ReadOptions],
+                      resolved: mutable.Map[Long, Array[Byte]] = mutable.Map.empty): Array[Byte] = {
+    // Base version and delta of the versions along the chain, newest first
+    val deltas = mutable.ArrayBuffer[(Long, Array[Byte])]()
+    var current = readEncoding.parse(stored)
+    var start: Option[Array[Byte]] = None
+    while (start.isEmpty) current match {
+      case FullValue(value) => start = Some(value)
+      case DeltaValue(baseVersion, _, delta) =>
+        if (deltas.length >= DeltaEncoding.maxChainLengthLimit) throw new IllegalStateException(s"Delta chain through base version $baseVersion is too long")
+        deltas += ((baseVersion, delta))
+        resolved.get(baseVersion) match {
+          case Some(value) => start = Some(value)
+          case None =>
+            val baseKey = keyCodec.encode(keyBytes, baseVersion)
+            val baseStored = readOptions.map(underlying.get(_, baseKey)).getOrElse(underlying.get(baseKey))
+            if (baseStored == null) throw new IllegalStateException(s"Base version $baseVersion of a delta encoded version is missing")
+            current = readEncoding.parse(baseStored)
+        }
+    }
+    deltas.reverseIterator.foldLeft(start.get) { case (base, (baseVersion, delta)) =>
+      resolved(baseVersion) = base
+      BinaryDelta.apply(base, delta)
     }
   }
 
-  def getMultipleKeys(rocksIt: RocksIterator, startAfterKey: Option[String], prefix: Option[String] = None, version: Option[Long] = None, limit: Option[Int]): (Seq[String], Seq[Array[Byte]], Seq[Long]) = {
-    startAfterKey.foreach(requireValidKey)
-    prefix.foreach{ p => requireValidKey(p)}
-    val iterator: VersionFilterIterator = scanKeys(rocksIt, startAfterKey, prefix, version)
-
-    /*
-       Note that seek in the underlying iterators either hits precisely or goes to the
-       lexicographically *next* key. To achieve correct behavior with startAfterKey,
-       we have to advance once in case of the exact hit.
-     */
-    val firstItemOpt: Option[VersionedKeyValuePair[Array[Byte]]] = if (iterator.hasNext) {
-      val firstItem = iterator.next()
-      if (startAfterKey.contains(firstItem.key)) {
-        None
-      } else {
-        Some(firstItem)
+  // Resolves the values of pairs ordered by key and then newest version first, as stored
+  private def resolvingValues(pairs: Iterator[VersionedKeyValuePair[Array[Byte]]], readOptions: Option[ReadOptions] = None): Iterator[VersionedKeyValuePair[Array[Byte]]] = {
+    var currentKey: Option[String] = None
+    val resolved = mutable.Map[Long, Array[Byte]]()
+    pairs.map { pair =>
+      if (!currentKey.contains(pair.key)) {
+        currentKey = Some(pair.key)
+        resolved.clear()
       }
-    } else None
+      // Bases are older than their deltas, so values of this and newer versions are not needed anymore
+      if (resolved.nonEmpty) resolved.filterInPlace((version, _) => version < pair.version)
+      pair.copy(value = resolve(keyCodec.encodeKey(pair.key), pair.value, readOptions, resolved))
+    }
+  }
+
+  // The first position at or after prefix that sorts after all versions of startAfterKey
+  private def startPosition(startAfterKey: Option[String], prefixBytes: Array[Byte]): Array[Byte] = startAfterKey match {
+    case Some(key) =>
+      val afterKey = keyCodec.seekPastVersionsOf(keyCodec.encodeKey(key))
+      if (RocksDBStore.compareBytes(afterKey, prefixBytes) > 0) afterKey else prefixBytes
+    case None => prefixBytes
+  }
 
-    val limitPadded = limit.map(_ + 1).getOrElse(Int.MaxValue)
-    val asVector = iterator.take(limitPadded).toVector
-    val asSequenceAdvancedIfNeeded = firstItemOpt.map(_ +: asVector).getOrElse(asVector).take(limit.getOrElse(Int.MaxValue))
-    val keys = asSequenceAdvancedIfNeeded.map(_.key)
-    val values = asSequenceAdvancedIfNeeded.map(_.value)
-    val versions = asSequenceAdvancedIfNeeded.map(_.version)
-    (keys, values, versions)
+  def getMultipleKeys(rocksIt: RocksIterator, startAfterKey: Option[String], prefix: Option[String] = None, version: Option[Long] = None, limit: Option[Int],
+                      readOptions: Option[ReadOptions] = None): (Seq[String], Seq[Array[Byte]], Seq[Long]) = {
+    startAfterKey.foreach(requireValidKey)
+    prefix.foreach(requireValidKey)
+    val pairs = resolvingValues(scanKeys(rocksIt, startAfterKey, prefix, version).take(limit.getOrElse(Int.MaxValue)), readOptions).toVector
+    (pairs.map(_.key), pairs.map(_.value), pairs.map(_.version))
   }
 
-  private def scanKeys(rocksIt: RocksIterator, startAfterKey: Option[String], prefix: Option[String] = None, version: Option[Long] = None): VersionFilterIterator = {
-    val fullKey = startAfterKey.map(key => s"$key${VersionedKey.versionSeparator}").orElse(prefix).getOrElse("")
-    new VersionFilterIterator(RocksDBStore.scan(rocksIt, fullKey, prefix), version)
+  def scan(rocksIt: RocksIterator, startAfterKey: Option[String], prefix: Option[String], version: Option[Long], allVersions: Boolean,
+           readOptions: Option[ReadOptions] = None): Iterator[VersionedKeyValuePair[Array[Byte]]] = {
+    startAfterKey.foreach(requireValidKey)
+    prefix.foreach(requireValidKey)
+    resolvingValues(if (allVersions) {
+      val prefixBytes = prefix.map(keyCodec.encodeKey).getOrElse(Array.emptyByteArray)
+      RocksDBStore.scan(rocksIt, startPosition(startAfterKey, prefixBytes), Some(prefixBytes)).flatMap { pair =>
+        keyCodec.decode(pair.key).map(VersionedKeyValuePair(_, pair.value))
+      }.filter(pair => version.forall(pair.version <= _))
+    } else scanKeys(rocksIt, startAfterKey, prefix, version), readOptions)
   }
 
-  def deleteMultipleVersions(rocksIt: RocksIterator, key: String, oldestVersion: Option[Long] = None, newestVersion: Option[Long] = None): Unit = {
-    @tailrec
-    def deleteIter(versionIterator: Iterator[VersionedKey]): Unit = {
-      if (versionIterator.hasNext) {
-        val item = versionIterator.next()
-        if (item.version >= oldestVersion.getOrElse(0L)) {
-          delete(item.key, item.version)
-          deleteIter(versionIterator)
+  private def scanKeys(rocksIt: RocksIterator, startAfterKey: Option[String], prefix: Option[String], version: Option[Long]): VersionFilterIterator = {
+    val prefixBytes = prefix.map(keyCodec.encodeKey).getOrElse(Array.emptyByteArray)
+    rocksIt.seek(startPosition(startAfterKey, prefixBytes))
+    new VersionFilterIterator(rocksIt, keyCodec, prefixBytes, version)
+  }
+
+  def deleteMultipleVersions(key: String, oldestVersion: Option[Long] = None, newestVersion: Option[Long] = None): Unit = {
+    requireValidKey(key)
+    val keyBytes = keyCodec.encodeKey(key)
+    val (begin, end) = keyCodec.versionRange(keyBytes, oldestVersion, newestVersion)
+    if (RocksDBStore.compareBytes(begin, end) < 0) {
+      val (oldest, newest) = (oldestVersion.getOrElse(0L), newestVersion.getOrElse(Long.MaxValue))
+      withDeltaWriteLock(underlying.write { batch =>
+        materializeDependents(batch, keyBytes, version => version >= oldest && version <= newest, oldest)
+        batch.deleteRange(begin, end)
+      })
+      written(key)
+    }
+  }
+
+  def deleteAllByPrefix(prefix: String): Unit = {
+    val prefixBytes = keyCodec.encodeKey(prefix)
+    // All versions of the matching keys are deleted, but a concurrent put must not encode a delta against one of them
+    withDeltaWriteLock(RocksDBStore.prefixUpperBound(prefixBytes) match {
+      case Some(end) => underlying.write(_.deleteRange(prefixBytes, end))
+      case None =>
+        // Only for the empty prefix (or one consisting of 0xFF bytes only) there is no upper bound
+        underlying.withRawRocksIterator { rocksIt =>
+          underlying.write(batch => RocksDBStore.scanKeysOnly(rocksIt, prefixBytes, Some(prefixBytes)).foreach(batch.delete))
+        }
+    })
+    writtenAll()
+  }
+
+  /*
+     Deletes the versions the policy does not keep, in one pass over the composite keys. Versions of a key are
+     stored contiguously, so each run of consecutive deleted versions becomes a single range tombstone (plus a
+     point tombstone for its last version, as the end of a range is exclusive). With delta encoding, kept versions
+     based on a deleted one are stored in full, so the deletions are only written once all versions of a key were
+     seen. Returns the number of deleted versions.
+   */
+  def applyRetention(policy: RetentionPolicy): Long = withDeltaWriteLock {
+    var deletedVersions = 0L
+    val runs = mutable.ArrayBuffer[(Array[Byte], Array[Byte])]()
+    val materialized = mutable.ArrayBuffer[(Array[Byte], Array[Byte])]()
+    def writeRuns(): Unit = {
+      underlying.write { batch =>
+        materialized.foreach { case (compositeKey, value) => batch.put(compositeKey, value) }
+        runs.foreach { case (first, last) =>
+          if (!util.Arrays.equals(first, last)) batch.deleteRange(first, last)
+          batch.delete(last)
         }
       }
+      runs.clear()
+      materialized.clear()
     }
-
-    val versionsIterator = scanVersionsOnly(rocksIt, key, newestVersion)
-    deleteIter(versionsIterator)
+    underlying.withUncachedRocksIterator { rocksIt =>
+      val compositeKeys = RocksDBStore.scanKeysOnly(rocksIt, Array.emptyByteArray, None)
+      var currentKey: Array[Byte] = null
+      var newestVersion = 0L
+      var index = 0L
+      var run: Option[(Array[Byte], Array[Byte])] = None
+      // Only collected with delta encoding
+      val deletedOfKey = mutable.Set[Long]()
+      def closeRun(): Unit = {
+        run.foreach(runs += _)
+        run = None
+      }
+      def finishKey(): Unit = {
+        closeRun()
+        deltaEncoding.filter(_ => deletedOfKey.nonEmpty).foreach { encoding =>
+          materialized ++= dependentsToMaterialize(encoding, currentKey, deletedOfKey.contains, deletedOfKey.min)
+          deletedOfKey.clear()
+        }
+        if (runs.length >= VersionedKeyValueStore.retentionBatchRuns) writeRuns()
+      }
+      compositeKeys.foreach { compositeKey =>
+        val keyLength = keyCodec.keyLength(compositeKey)
+        if (keyLength < 0) closeRun()
+        else {
+          val version = keyCodec.decodeVersion(compositeKey)
+          if (currentKey == null || !util.Arrays.equals(compositeKey, 0, keyLength, currentKey, 0, currentKey.length)) {
+            finishKey()
+            currentKey = util.Arrays.copyOf(compositeKey, keyLength)
+            newestVersion = version
+            index = 0
+          }
+          if (policy.keeps(version, index, newestVersion)) closeRun()
+          else {
+            run = Some((run.map(_._1).getOrElse(compositeKey), compositeKey))
+            deletedVersions += 1
+            if (deltaEncoding.isDefined) deletedOfKey += version
+          }
+          index += 1
+        }
+      }
+      finishKey()
+    }
+    if (runs.nonEmpty || materialized.nonEmpty) writeRuns()
+    if (deletedVersions > 0) writtenAll()
+    deletedVersions
   }
 
-  def deleteAllByPrefix(rocksIt: RocksIterator, prefix: String): Unit = {
-    RocksDBStore.scanKeysOnly(rocksIt, prefix, Some(prefix)).foreach(underlying.delete)
+  // Writes all entries in one atomic batch
+  def putMultiple(entries: Seq[(String, Long, Array[Byte])]): Unit = {
+    entries.foreach { case (key, _, _) => requireValidKey(key) }
+    putEntries(entries)
+    entries.map(_._1).distinct.foreach(written)
   }
 
+  private def putEntries(entries: Seq[(String, Long, Array[Byte])]): Unit =
+    deltaEncoding match {
+      case None =>
+        underlying.write { batch =>
+          entries.foreach { case (key, version, value) => batch.put(compositeKey(key, version), DeltaEncoding.escape(value)) }
+        }
+      case Some(encoding) =>
+        withDeltaWriteLock(underlying.write { batch =>
+          entries.groupBy(_._1).foreach { case (key, keyEntries) =>
+            // As in a plain write batch, the last entry for a version wins
+            val versions = keyEntries.map { case (_, version, value) => version -> value }.toMap.toSeq.sortBy(_._1)
+            putDeltaEncoded(batch, encoding, keyCodec.encodeKey(key), versions)
+          }
+        })
+    }
+
   def put(key: String, version: Long, value: Array[Byte]): Unit = {
     requireValidKey(key)
-    underlying.put(VersionedKey.asString(key, version), value)
+    deltaEncoding match {
+      case None => underlying.put(compositeKey(key, version), DeltaEncoding.escape(value))
+      case Some(encoding) => withDeltaWriteLock(underlying.write(batch => putDeltaEncoded(batch, encoding, keyCodec.encodeKey(key), Seq(version -> value))))
+    }
+    written(key)
   }
 
   def delete(key: String, version: Long): Unit = {
     requireValidKey(key)
-    underlying.delete(VersionedKey.asString(key, version))
+    deltaEncoding match {
+      case None => underlying.delete(compositeKey(key, version))
+      case Some(_) =>
+        val keyBytes = keyCodec.encodeKey(key)
+        withDeltaWriteLock(underlying.write { batch =>
+          materializeDependents(batch, keyBytes, _ == version, version)
+          batch.delete(keyCodec.encode(keyBytes, version))
+        })
+    }
+    written(key)
   }
 
+  // After writes that do not go through the group commit, which keeps its own versions up to date
+  private def written(key: String): Unit = {
+    readCache.invalidate(key)
+    groupCommitter.foreach(_.latestVersions.invalidate(key))
+  }
+
+  private def writtenAll(): Unit = {
+    readCache.invalidateAll()
+    groupCommitter.foreach(_.latestVersions.invalidateAll())
+  }
+
+  private val deltaWriteLock = new Object
+
+  /*
+     With delta encoding, a write depends on the stored versions it is encoded against or makes independent of
+     removed ones, so writes to the store are serialized. Without delta encoding, block runs unsynchronized.
+   */
+  private def withDeltaWriteLock[T](block: => T): T =
+    if (deltaEncoding.isEmpty) block else deltaWriteLock.synchronized(block)
+
+  /*
+     Stores versions of one key, given oldest first, as deltas against the next older version where that pays off.
+     Newer versions that are based on an overwritten version are stored in full first.
+   */
+  private def putDeltaEncoded(batch: RocksDBWriteBatch, encoding: DeltaEncoding, keyBytes: Array[Byte], versions: Seq[(Long, Array[Byte])]): Unit = {
+    val overwritten = versions.map(_._1).toSet
+    materializeDependents(batch, keyBytes, overwritten.contains, versions.head._1)
+    // Chain length and value of the versions written so far
+    val written = mutable.TreeMap[Long, (Int, Array[Byte])]()
+    underlying.withRawRocksIterator { rocksIt =>
+      versions.foreach { case (version, value) =>
+        val base = if (encoding.maxChainLength == 0 || version <= 0) None else {
+          val writtenBase = written.maxBefore(version)
+          val (begin, _) = keyCodec.versionRange(keyBytes, None, Some(version - 1))
+          val storedBase = RocksDBStore.scan(rocksIt, begin, Some(keyCodec.versionPrefix(keyBytes)))
+            .find(pair => keyCodec.keyLength(pair.key) >= 0)
+            .map(pair => (keyCodec.decodeVersion(pair.key), pair.value))
+            .filter { case (storedVersion, _) => !overwritten.contains(storedVersion) && writtenBase.forall(_._1 < storedVersion) }
+          storedBase match {
+            case Some((storedVersion, stored)) => Some((storedVersion, encoding.chainLength(stored), resolve(keyBytes, stored, None)))
+            case None => writtenBase.map { case (writtenVersion, (chainLength, writtenValue)) => (writtenVersion, chainLength, writtenValue) }
+          }
+        }
+        val (stored, chainLength) = encoding.encode(value, base)
+        batch.put(keyCodec.encode(keyBytes, version), stored)
+        written(version) = (chainLength, value)
+      }
+    }
+  }
+
+  // Before versions of a key are deleted or overwritten, stores the remaining versions based on one of them in full
+  private def materializeDependents(batch: RocksDBWriteBatch, keyBytes: Array[Byte], isRemoved: Long => Boolean, oldestRemoved: Long): Unit =
+    deltaEncoding.foreach { encoding =>
+      dependentsToMaterialize(encoding, keyBytes, isRemoved, oldestRemoved).foreach { case (compositeKey, value) => batch.put(compositeKey, value) }
+    }
+
+  /*
+     Bases are older than their deltas, so only versions newer than oldestRemoved can depend on removed ones.
+     A version based on a remaining version that in turn is based on a removed one keeps its delta,
+     as its base is stored in full as well.
+   */
+  private def dependentsToMaterialize(encoding: DeltaEncoding, keyBytes: Array[Byte], isRemoved: Long => Boolean,
+                                      oldestRemoved: Long): Seq[(Array[Byte], Array[Byte])] =
+    if (oldestRemoved == Long.MaxValue) Seq.empty
+    else underlying.withRawRocksIterator { rocksIt =>
+      val (begin, end) = keyCodec.versionRange(keyBytes, Some(oldestRemoved + 1), None)
+      RocksDBStore.scan(rocksIt, begin, Some(keyCodec.versionPrefix(keyBytes)))
+        .takeWhile(pair => RocksDBStore.compareBytes(pair.key, end) < 0)
+        .filter(pair => keyCodec.keyLength(pair.key) >= 0)
+        .flatMap { pair =>
+          encoding.parse(pair.value) match {
+            case DeltaValue(baseVersion, _, _) if isRemoved(baseVersion) && !isRemoved(keyCodec.decodeVersion(pair.key)) =>
+              Some(pair.key -> encoding.storedFull(resolve(keyBytes, pair.value, None)))
+            case _ => None
+          }
+        }.toVector
+    }
+
   def listKeys(rocksIt: RocksIterator, limit: Option[Int], startAfterKey: Option[String], prefix: Option[String]): Seq[String] = {
-    val iterator = new KeyOnlyIterator(rocksIt, startAfterKey, prefix)
+    val prefixBytes = prefix.map(keyCodec.encodeKey).getOrElse(Array.emptyByteArray)
+    val iterator = new KeyOnlyIterator(rocksIt, keyCodec, startPosition(startAfterKey, prefixBytes), prefixBytes)
     iterator.take(limit.getOrElse(Int.MaxValue)).toSeq
   }
 
-  def listVersions(rocksIt: RocksIterator, key: String, limit: Option[Int], offset: Option[Int]): Seq[Long] = {
-    val iterator = scanVersionsOnly(rocksIt, key)
-    iterator.map(_.version).drop(offset.getOrElse(0)).take(limit.getOrElse(Int.MaxValue)).toSeq
+  def listVersions(rocksIt: RocksIterator, key: String, limit: Option[Int], offset: Option[Int],
+                   oldestVersion: Option[Long] = None, newestVersion: Option[Long] = None, oldestFirst: Boolean = false): Seq[Long] =
+    versionIterator(rocksIt, key, limit, offset, oldestVersion, newestVersion, oldestFirst, withValueSizes = false).map(_._1).toSeq
+
+  def listVersionsWithValueSizes(rocksIt: RocksIterator, key: String, limit: Option[Int], offset: Option[Int],
+                                 oldestVersion: Option[Long], newestVersion: Option[Long], oldestFirst: Boolean): Seq[(Long, Int)] =
+    versionIterator(rocksIt, key, limit, offset, oldestVersion, newestVersion, oldestFirst, withValueSizes = true).collect {
+      case (version, Some(valueSize)) => (version, valueSize)
+    }.toSeq
+
+  private def versionIterator(rocksIt: RocksIterator, key: String, limit: Option[Int], offset: Option[Int], oldestVersion: Option[Long],
+                              newestVersion: Option[Long], oldestFirst: Boolean, withValueSizes: Boolean): Iterator[(Long, Option[Int])] = {
+    requireValidKey(key)
+    val (begin, end) = keyCodec.versionRange(keyCodec.encodeKey(key), oldestVersion, newestVersion)
+    new VersionIterator(rocksIt, keyCodec, begin, end, oldestFirst, withValueSizes)
+      .drop(offset.getOrElse(0)).take(limit.getOrElse(Int.MaxValue))
+  }
+
+  // Counts keys and versions in a single pass over the composite keys, no values are read
+  def count(rocksIt: RocksIterator, prefix: Option[String]): KeyCount = {
+    prefix.foreach(requireValidKey)
+    val prefixBytes = prefix.map(keyCodec.encodeKey).getOrElse(Array.emptyByteArray)
+    countEntries(rocksIt, prefixBytes, Long.MaxValue)
+  }
+
+  def countVersions(rocksIt: RocksIterator, key: String): KeyCount = {
+    requireValidKey(key)
+    countEntries(rocksIt, keyCodec.versionPrefix(keyCodec.encodeKey(key)), Long.MaxValue)
+  }
+
+  /*
+     RocksDB only estimates the number of entries, i.e. of versions. The number of keys is extrapolated
+     from the versions per key among the first entries. If those are all entries, the count is exact.
+   */
+  def estimateCount(rocksIt: RocksIterator): KeyCount = {
+    val sample = countEntries(rocksIt, Array.emptyByteArray, VersionedKeyValueStore.estimateSampleEntries)
+    if (sample.exact) sample
+    else {
+      val versions = math.max(underlying.estimateNumEntries(), sample.versions)
+      val keys = math.max(sample.keys, math.round(versions.toDouble * sample.keys / sample.versions))
+      KeyCount(keys, versions, exact = false)
+    }
+  }
+
+  // Stops after maxEntries versions, the result is exact only if all entries with the prefix were counted
+  private def countEntries(rocksIt: RocksIterator, prefix: Array[Byte], maxEntries: Long): KeyCount = {
+    val compositeKeys = RocksDBStore.scanKeysOnly(rocksIt, prefix, Some(prefix))
+    var previousKey: Array[Byte] = Array.emptyByteArray
+    var keys = 0L
+    var versions = 0L
+    while (versions < maxEntries && compositeKeys.hasNext) {
+      val compositeKey = compositeKeys.next()
+      val keyLength = keyCodec.keyLength(compositeKey)
+      if (keyLength >= 0) {
+        versions += 1
+        if (keys == 0 || !util.Arrays.equals(compositeKey, 0, keyLength, previousKey, 0, previousKey.length)) {
+          keys += 1
+          previousKey = util.Arrays.copyOf(compositeKey, keyLength)
+        }
+      }
+    }
+    KeyCount(keys, versions, exact = !compositeKeys.hasNext)
   }
 
   private def requireValidKey(key: String): Unit = {
-    require(!key.contains(VersionedKey.versionSeparator), s"keys cannot contain the char ${VersionedKey.versionSeparator}")
+    require(!key.contains(keyCodec.invalidKeyChar), f"keys cannot contain the char U+${keyCodec.invalidKeyChar.toInt}%04X")
   }
 
 }
+
+object VersionedKeyValueStore {
+  val estimateSampleEntries: Long = 100000
+
+  // Runs of deleted versions per write batch when applying a retention policy
+  val retentionBatchRuns: Int = 10000
+}
@@ -0,0 +1,178 @@
+package com.scalableminds.fossildb
+
+import java.io.File
+import java.nio.file.Paths
+import com.scalableminds.fossildb.db.{BinaryDelta, DeltaEncoding, RetentionPolicy, StoreManager, VersionedKeyValueStore}
+import org.scalatest.BeforeAndAfterEach
+import org.scalatest.flatspec.AnyFlatSpec
+
+import scala.util.Random
+
+class DeltaEncodingSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHelpers {
+
+  private val testTempDir = "testData6"
+  private val dataDir = Paths.get(testTempDir, "data")
+  private val backupDir = Paths.get(testTempDir, "backup")
+
+  private val collectionA = "collectionA"
+  private val collectionB = "collectionB"
+
+  private val columnFamilies = List(collectionA, collectionB)
+
+  private val maxChainLength = 4
+
+  // A random value of 4kB per version, each version changes a few bytes of the previous one
+  private val values: Seq[Array[Byte]] = {
+    val random = new Random(42)
+    Iterator.iterate(random.nextBytes(4096)) { previous =>
+      val next = previous.clone()
+      (0 until 3).foreach(_ => next(random.nextInt(next.length)) = random.nextInt.toByte)
+      next
+    }.take(20).toSeq
+  }
+
+  override def beforeEach(): Unit = {
+    deleteRecursively(new File(testTempDir))
+    new File(testTempDir).mkdir()
+  }
+
+  override def afterEach(): Unit = {
+    deleteRecursively(new File(testTempDir))
+  }
+
+  private def withStoreManager(block: StoreManager => Unit): Unit = {
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None,
+      retentionPolicies = Map(collectionA -> RetentionPolicy.parse("newest:2+every:5")), deltaChainLengths = Map(collectionA -> maxChainLength))
+    try block(storeManager) finally storeManager.close
+  }
+
+  private def storedSize(store: VersionedKeyValueStore, key: String): Long =
+    store.withRawRocksIterator(rocksIt => store.listVersionsWithValueSizes(rocksIt, key, None, None, None, None, oldestFirst = false).map(_._2.toLong).sum)
+
+  private def assertAllVersions(store: VersionedKeyValueStore, key: String, expected: Seq[(Long, Array[Byte])]): Unit = {
+    store.withRawRocksIterator { rocksIt =>
+      expected.foreach { case (version, value) => assert(store.get(rocksIt, key, Some(version)).get.value sameElements value) }
+      val (storedValues, versions) = store.getMultipleVersions(rocksIt, key)
+      assert(versions == expected.map(_._1).reverse)
+      assert(storedValues.zip(expected.map(_._2).reverse).forall { case (a, b) => a sameElements b })
+    }
+  }
+
+  "BinaryDelta" should "reconstruct the target from the base" in {
+    val base = values.head
+    val target = values.last.take(1000) ++ "inserted".getBytes ++ values.last.drop(1500)
+    val delta = BinaryDelta.encode(base, target)
+    assert(delta.length < 700)
+    assert(BinaryDelta.apply(base, delta) sameElements target)
+    assert(BinaryDelta.apply(base, BinaryDelta.encode(base, Array.emptyByteArray)).isEmpty)
+  }
+
+  "Delta encoding" should "store consecutive versions as deltas and read them transparently" in {
+    withStoreManager { storeManager =>
+      val store = storeManager.getStore(collectionA)
+      values.zipWithIndex.foreach { case (value, version) => store.put("aKey", version, value) }
+      storeManager.getStore(collectionB).putMultiple(values.zipWithIndex.map { case (value, version) => ("aKey", version.toLong, value) })
+      assertAllVersions(store, "aKey", values.indices.map(_.toLong).zip(values))
+      // Every (maxChainLength + 1)-th version is stored in full
+      assert(storedSize(store, "aKey") < storedSize(storeManager.getStore(collectionB), "aKey") / 3)
+      val (keys, keyValues, _) = store.withRawRocksIterator(rocksIt => store.getMultipleKeys(rocksIt, None, None, Some(7), None))
+      assert(keys == Seq("aKey") && (keyValues.head sameElements values(7)))
+    }
+  }
+
+  it should "keep versions readable when their base is deleted or overwritten" in {
+    withStoreManager { storeManager =>
+      val store = storeManager.getStore(collectionA)
+      store.putMultiple(values.zipWithIndex.map { case (value, version) => ("aKey", version.toLong, value) })
+      store.delete("aKey", 3)
+      store.deleteMultipleVersions("aKey", Some(8), Some(11))
+      store.put("aKey", 14, values.head)
+      val expected = values.indices.map(_.toLong).zip(values).filterNot { case (version, _) => version == 3 || (version >= 8 && version <= 11) }
+        .map { case (version, value) => if (version == 14) (version, values.head) else (version, value) }
+      assertAllVersions(store, "aKey", expected)
+    }
+  }
+
+  it should "resolve deltas at the snapshot of an open iterator when their base is overwritten or deleted" in {
+    withStoreManager { storeManager =>
+      val store = storeManager.getStore(collectionA)
+      store.putMultiple(values.take(3).zipWithIndex.map { case (value, version) => ("aKey", version.toLong, value) })
+      val snapshotIt = store.newSnapshotIterator()
+      try {
+        val entries = store.scan(snapshotIt.rocksIt, None, None, None, allVersions = true, Some(snapshotIt.readOptions))
+        store.withKeySnapshotIterator("aKey") { (readOptions, rocksIt) =>
+          // Version 1 is based on version 0, version 2 on version 1
+          store.put("aKey", 0, values.last)
+          store.delete("aKey", 1)
+          assert(store.get(rocksIt, "aKey", Some(2), readOptions).get.value sameElements values(2))
+        }
+        val scanned = entries.toVector
+        assert(scanned.map(_.version) == Seq(2L, 1L, 0L))
+        assert(scanned.map(_.value).zip(values.take(3).reverse).forall { case (a, b) => a sameElements b })
+      } finally snapshotIt.close()
+      assertAllVersions(store, "aKey", Seq(0L -> values.last, 2L -> values(2)))
+    }
+  }
+
+  it should "read versions at the end of very long delta chains" in {
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None, deltaChainLengths = Map(collectionA -> DeltaEncoding.maxChainLengthLimit))
+    try {
+      val store = storeManager.getStore(collectionA)
+      val random = new Random(42)
+      val chain = Iterator.iterate(random.nextBytes(512)) { previous =>
+        val next = previous.clone()
+        next(random.nextInt(next.length)) = random.nextInt.toByte
+        next
+      }.take(20000).toVector
+      store.putMultiple(chain.zipWithIndex.map { case (value, version) => ("aKey", version.toLong, value) })
+      assert(storedSize(store, "aKey") < chain.length * 100L)
+      assert(store.getShared("aKey", None).get.value sameElements chain.last)
+      assert(store.getShared("aKey", Some(10000)).get.value sameElements chain(10000))
+    } finally storeManager.close
+  }
+
+  it should "read values that start with the marker unchanged after it is enabled" in {
+    val markerValue = Array(0xFD.toByte) ++ "FDELTA".getBytes ++ Array[Byte](1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1)
+    val before = new StoreManager(dataDir, backupDir, columnFamilies, None)
+    try {
+      before.getStore(collectionB).put("aKey", 0, markerValue)
+      assert(before.getStore(collectionB).getShared("aKey", None).get.value sameElements markerValue)
+    } finally before.close
+    val after = new StoreManager(dataDir, backupDir, columnFamilies, None, deltaChainLengths = Map(collectionB -> maxChainLength))
+    try {
+      val store = after.getStore(collectionB)
+      assert(store.getShared("aKey", None).get.value sameElements markerValue)
+      store.put("aKey", 1, markerValue ++ values.head)
+      assertAllVersions(store, "aKey", Seq(0L -> markerValue, 1L -> (markerValue ++ values.head)))
+    } finally after.close
+  }
+
+  it should "read stored deltas after it is disabled" in {
+    val before = new StoreManager(dataDir, backupDir, columnFamilies, None, deltaChainLengths = Map(collectionB -> maxChainLength))
+    try before.getStore(collectionB).putMultiple(values.zipWithIndex.map { case (value, version) => ("aKey", version.toLong, value) })
+    finally before.close
+    val after = new StoreManager(dataDir, backupDir, columnFamilies, None)
+    try {
+      val store = after.getStore(collectionB)
+      assert(store.deltaEncoding.isEmpty)
+      assertAllVersions(store, "aKey", values.indices.map(_.toLong).zip(values))
+      store.withRawRocksIterator { rocksIt =>
+        val (keys, keyValues, _) = store.getMultipleKeys(rocksIt, None, None, Some(7), None)
+        assert(keys == Seq("aKey") && (keyValues.head sameElements values(7)))
+      }
+      // Without delta encoding, the versions based on a deleted one are not stored in full
+      store.delete("aKey", 3)
+      assertThrows[IllegalStateException](store.getShared("aKey", Some(4)))
+    } finally after.close
+  }
+
+  it should "keep versions readable when retention deletes their base" in {
+    withStoreManager { storeManager =>
+      val store = storeManager.getStore(collectionA)
+      store.putMultiple(values.zipWithIndex.map { case (value, version) => ("aKey", version.toLong, value) })
+      assert(storeManager.applyRetention(Some(collectionA)) == 14)
+      assertAllVersions(store, "aKey", Seq(0L, 5L, 10L, 15L, 18L, 19L).map(version => (version, values(version.toInt))))
+    }
+  }
+
+}
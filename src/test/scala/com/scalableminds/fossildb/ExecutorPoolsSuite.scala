@@ -0,0 +1,60 @@
+package com.scalableminds.fossildb
+
+import io.grpc.{Status, StatusRuntimeException}
+import org.scalatest.flatspec.AnyFlatSpec
+
+import java.util.concurrent.CountDownLatch
+import scala.concurrent.Await
+import scala.concurrent.duration.DurationInt
+
+class ExecutorPoolsSuite extends AnyFlatSpec {
+
+  "BoundedExecutor" should "run submitted requests" in {
+    val executor = new BoundedExecutor("test", PoolConfig(2, 10))
+    try {
+      assert(Await.result(executor.submit(21 * 2), 10.seconds) == 42)
+    } finally executor.shutdown()
+  }
+
+  it should "reject requests with RESOURCE_EXHAUSTED while its queue is full" in {
+    val executor = new BoundedExecutor("test", PoolConfig(1, 1))
+    val release = new CountDownLatch(1)
+    try {
+      val running = executor.submit(release.await())
+      val queued = executor.submit(release.await())
+      val rejected = executor.submit(0)
+      val error = intercept[StatusRuntimeException](Await.result(rejected, 10.seconds))
+      assert(error.getStatus.getCode == Status.Code.RESOURCE_EXHAUSTED)
+      assert(executor.rejectedCount == 1)
+      assert(executor.queueSize <= 1)
+      release.countDown()
+      Await.result(running, 10.seconds)
+      Await.result(queued, 10.seconds)
+      assert(Await.result(executor.submit(1), 10.seconds) == 1)
+    } finally {
+      release.countDown()
+      executor.shutdown()
+    }
+  }
+
+  it should "pass on exceptions of the request" in {
+    val executor = new BoundedExecutor("test", PoolConfig(1, 1))
+    try {
+      intercept[IllegalStateException](Await.result(executor.submit(throw new IllegalStateException), 10.seconds))
+    } finally executor.shutdown()
+  }
+
+  "ExecutorPools" should "parse pool configs" in {
+    assert(ExecutorPools.parseConfig("16/1000") == PoolConfig(16, 1000))
+    intercept[IllegalArgumentException](ExecutorPools.parseConfig("16"))
+    intercept[IllegalArgumentException](ExecutorPools.parseConfig("0/10"))
+  }
+
+  it should "fall back to the defaults for pools that are not configured" in {
+    val pools = new ExecutorPools(Map("write" -> PoolConfig(1, 5)))
+    try {
+      assert(pools.all.map(_.name) == Seq("read", "scan", "write", "admin"))
+    } finally pools.shutdown()
+  }
+
+}
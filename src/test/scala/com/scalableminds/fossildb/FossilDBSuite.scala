@@ -3,11 +3,12 @@ package com.scalableminds.fossildb
 import java.io.File
 import java.nio.file.Paths
 import com.google.protobuf.ByteString
-import com.scalableminds.fossildb.db.StoreManager
+import com.scalableminds.fossildb.db.{BackupInfo, BackupRetention, KeepDailyBackups, KeepLastBackups, SnapshotRegistry, StoreManager}
 import com.scalableminds.fossildb.proto.fossildbapi._
 import com.typesafe.scalalogging.LazyLogging
 import io.grpc.health.v1._
 import io.grpc.netty.NettyChannelBuilder
+import org.rocksdb.RocksDB
 import org.scalatest.BeforeAndAfterEach
 import org.scalatest.flatspec.AnyFlatSpec
 
@@ -155,6 +156,30 @@ class FossilDBSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHelpers
     assert(testData1 == reply.value)
   }
 
+  "DeleteMultipleVersions" should "delete all versions within the bounds (inclusive)" in {
+    (0 to 5).foreach(version => client.put(PutRequest(collectionA, aKey, Some(version), testData1)))
+    client.put(PutRequest(collectionA, aNotherKey, Some(3), testData2))
+    client.deleteMultipleVersions(DeleteMultipleVersionsRequest(collectionA, aKey, newestVersion = Some(4), oldestVersion = Some(2)))
+    val reply = client.listVersions(ListVersionsRequest(collectionA, aKey))
+    assert(reply.versions == Seq(5, 1, 0))
+    assert(client.get(GetRequest(collectionA, aNotherKey)).actualVersion == 3)
+  }
+
+  it should "delete all versions of a key if called without bounds" in {
+    (0 to 3).foreach(version => client.put(PutRequest(collectionA, aKey, Some(version), testData1)))
+    client.put(PutRequest(collectionA, "aKeyWithSuffix", Some(0), testData2))
+    client.deleteMultipleVersions(DeleteMultipleVersionsRequest(collectionA, aKey))
+    assert(client.listVersions(ListVersionsRequest(collectionA, aKey)).versions.isEmpty)
+    assert(client.listKeys(ListKeysRequest(collectionA)).keys == Seq("aKeyWithSuffix"))
+  }
+
+  it should "do nothing if the bounds are inverted" in {
+    (0 to 3).foreach(version => client.put(PutRequest(collectionA, aKey, Some(version), testData1)))
+    val reply = client.deleteMultipleVersions(DeleteMultipleVersionsRequest(collectionA, aKey, newestVersion = Some(1), oldestVersion = Some(2)))
+    assert(reply.success)
+    assert(client.listVersions(ListVersionsRequest(collectionA, aKey)).versions.length == 4)
+  }
+
   "DeleteAllByPrefix" should "delete all versions of all values matching this prefix" in {
     client.put(PutRequest(collectionA, "prefixedA", Some(0), testData1))
     client.put(PutRequest(collectionA, "prefixedA", Some(1), testData1))
@@ -237,6 +262,16 @@ class FossilDBSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHelpers
     assert(reply.keys(2) == "123458")
   }
 
+  it should "start at the prefix if startAfterKey sorts before it" in {
+    client.put(PutRequest(collectionA, "123456", Some(1), testData1))
+    client.put(PutRequest(collectionA, "123458", Some(1), testData2))
+    client.put(PutRequest(collectionA, "123458", Some(2), testData2))
+    client.put(PutRequest(collectionA, "123459", Some(123), testData3))
+
+    val reply = client.listKeys(ListKeysRequest(collectionA, None, startAfterKey = Some("123456"), prefix = Some("123459")))
+    assert(reply.keys == Seq("123459"))
+  }
+
   "GetMultipleVersions" should "return all versions in descending order if called without limits" in {
     client.put(PutRequest(collectionA, aKey, Some(0), testData1))
     client.put(PutRequest(collectionA, aKey, Some(1), testData2))
@@ -476,6 +511,96 @@ class FossilDBSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHelpers
     assert(reply.versionValueBoxes.forall(_.versionValuePair.isEmpty))
   }
 
+  it should "answer in request order, also for duplicate keys and exactly matching versions" in {
+    client.put(PutRequest(collectionA, aKey, Some(1), testData1))
+    client.put(PutRequest(collectionA, aNotherKey, Some(0), testData1))
+    client.put(PutRequest(collectionA, aNotherKey, Some(2), testData2))
+    client.put(PutRequest(collectionA, aThirdKey, Some(3), testData3))
+    val reply = client.getMultipleKeysByList(GetMultipleKeysByListRequest(collectionA, keys = Seq(aThirdKey, aNotherKey, aKey, aNotherKey), version = Some(2)))
+    assert(reply.versionValueBoxes.length == 4)
+    assert(reply.versionValueBoxes(0).versionValuePair.isEmpty)
+    assert(reply.versionValueBoxes(1).versionValuePair.contains(VersionValuePairProto(2L, testData2)))
+    assert(reply.versionValueBoxes(2).versionValuePair.contains(VersionValuePairProto(1L, testData1)))
+    assert(reply.versionValueBoxes(3).versionValuePair.contains(VersionValuePairProto(2L, testData2)))
+  }
+
+  "AcquireSnapshot" should "let later reads ignore writes made after it" in {
+    client.put(PutRequest(collectionA, aKey, Some(0), testData1))
+    client.put(PutRequest(collectionA, aNotherKey, Some(0), testData1))
+    val snapshot = client.acquireSnapshot(AcquireSnapshotRequest(ttlSeconds = Some(10)))
+    assert(snapshot.success)
+    client.put(PutRequest(collectionA, aKey, Some(1), testData2))
+    client.put(PutRequest(collectionA, aThirdKey, Some(0), testData3))
+    client.delete(DeleteRequest(collectionA, aNotherKey, 0))
+    val keys = client.listKeys(ListKeysRequest(collectionA, snapshot = Some(snapshot.snapshot)))
+    assert(keys.keys == Seq(aKey, aNotherKey))
+    val page = client.getMultipleKeys(GetMultipleKeysRequest(collectionA, startAfterKey = Some(aKey), snapshot = Some(snapshot.snapshot)))
+    assert(page.keys == Seq(aNotherKey))
+    val boxes = client.getMultipleKeysByList(GetMultipleKeysByListRequest(collectionA, Seq(aKey, aThirdKey), snapshot = Some(snapshot.snapshot)))
+    assert(boxes.versionValueBoxes.map(_.versionValuePair.map(_.value)) == Seq(Some(testData1), None))
+    assert(client.listKeys(ListKeysRequest(collectionA)).keys == Seq(aKey, aThirdKey))
+  }
+
+  "ReleaseSnapshot" should "make the snapshot unavailable" in {
+    val snapshot = client.acquireSnapshot(AcquireSnapshotRequest())
+    assert(client.releaseSnapshot(ReleaseSnapshotRequest(snapshot.snapshot)).success)
+    val reply = client.listKeys(ListKeysRequest(collectionA, snapshot = Some(snapshot.snapshot)))
+    assert(!reply.success)
+    assert(!client.acquireSnapshot(AcquireSnapshotRequest(ttlSeconds = Some(24 * 3600))).success)
+  }
+
+  "SnapshotRegistry" should "release expired snapshots without further calls" in {
+    val db = RocksDB.open(Paths.get(testTempDir, "snapshots").toAbsolutePath.toString)
+    val registry = new SnapshotRegistry(db, reapIntervalSeconds = 1)
+    try {
+      registry.acquire(1)
+      assert(db.getLongProperty("rocksdb.num-snapshots") == 1)
+      Thread.sleep(3000)
+      assert(db.getLongProperty("rocksdb.num-snapshots") == 0)
+    } finally {
+      registry.releaseAll()
+      db.close()
+    }
+  }
+
+  "Scan" should "stream all versions of all keys in chunks" in {
+    client.put(PutRequest(collectionA, aKey, Some(0), testData1))
+    client.put(PutRequest(collectionA, aKey, Some(1), testData2))
+    client.put(PutRequest(collectionA, aNotherKey, Some(0), testData3))
+    client.put(PutRequest(collectionA, aThirdKey, Some(2), testData1))
+    client.put(PutRequest(collectionB, aKey, Some(0), testData1))
+    val replies = client.scan(ScanRequest(collectionA, allVersions = Some(true), maxChunkEntries = Some(2))).toSeq
+    assert(replies.forall(_.success))
+    assert(replies.length == 2)
+    val pairs = replies.flatMap(_.versionedKeyValuePairs)
+    assert(pairs == Seq(VersionedKeyValuePairProto(aKey, 1, testData2), VersionedKeyValuePairProto(aKey, 0, testData1),
+      VersionedKeyValuePairProto(aNotherKey, 0, testData3), VersionedKeyValuePairProto(aThirdKey, 2, testData1)))
+  }
+
+  it should "return only the newest matching version of each key by default" in {
+    client.put(PutRequest(collectionA, aKey, Some(0), testData1))
+    client.put(PutRequest(collectionA, aKey, Some(1), testData2))
+    client.put(PutRequest(collectionA, aNotherKey, Some(0), testData3))
+    client.put(PutRequest(collectionA, aThirdKey, Some(2), testData1))
+    val pairs = client.scan(ScanRequest(collectionA, version = Some(1))).toSeq.flatMap(_.versionedKeyValuePairs)
+    assert(pairs == Seq(VersionedKeyValuePairProto(aKey, 1, testData2), VersionedKeyValuePairProto(aNotherKey, 0, testData3)))
+  }
+
+  it should "respect prefix and startAfterKey" in {
+    client.put(PutRequest(collectionA, aKey, Some(0), testData1))
+    client.put(PutRequest(collectionA, aNotherKey, Some(0), testData2))
+    client.put(PutRequest(collectionA, aNotherKey, Some(1), testData2))
+    client.put(PutRequest(collectionA, aThirdKey, Some(0), testData3))
+    val pairs = client.scan(ScanRequest(collectionA, prefix = Some("a"), startAfterKey = Some(aKey), allVersions = Some(true))).toSeq.flatMap(_.versionedKeyValuePairs)
+    assert(pairs.map(_.key) == Seq(aNotherKey, aNotherKey, aThirdKey))
+  }
+
+  it should "fail on non-existent collection" in {
+    val replies = client.scan(ScanRequest("nonExistentCollection")).toSeq
+    assert(replies.length == 1)
+    assert(!replies.head.success)
+  }
+
   "Backup" should "create non-empty backup directory" in {
     client.put(PutRequest(collectionA, aKey, Some(0), testData1))
     client.backup(BackupRequest())
@@ -485,6 +610,41 @@ class FossilDBSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHelpers
     assert(dir.listFiles.length > 0)
   }
 
+  it should "keep only the last backup by default" in {
+    client.put(PutRequest(collectionA, aKey, Some(0), testData1))
+    val firstBackup = client.backup(BackupRequest())
+    client.put(PutRequest(collectionA, aKey, Some(1), testData2))
+    val secondBackup = client.backup(BackupRequest())
+    assert(secondBackup.id > firstBackup.id)
+    assert(new File(backupDir.toString, "meta").listFiles.map(_.getName).toSeq == Seq(secondBackup.id.toString))
+  }
+
+  "StartBackup" should "create a backup in the background" in {
+    client.put(PutRequest(collectionA, aKey, Some(0), testData1))
+    val jobId = client.startBackup(StartBackupRequest()).jobId
+    val status = Iterator.continually { Thread.sleep(50); client.getBackupStatus(GetBackupStatusRequest(Some(jobId))) }
+      .take(200).find(_.state != "RUNNING").get
+    assert(status.success)
+    assert(status.state == "SUCCEEDED")
+    assert(status.backup.exists(_.size > 0))
+    assert(status.bytesCopied > 0)
+    assert(client.getBackupStatus(GetBackupStatusRequest()).jobId == jobId)
+  }
+
+  "GetBackupStatus" should "fail if no backup was started" in {
+    val reply = client.getBackupStatus(GetBackupStatusRequest())
+    assert(!reply.success)
+  }
+
+  "BackupRetention" should "keep the newest backup of each of the last days" in {
+    val day = 24 * 60 * 60L
+    val backups = Seq(BackupInfo(1, 10, 0), BackupInfo(2, day + 10, 0), BackupInfo(3, day + 20, 0), BackupInfo(4, 2 * day + 10, 0))
+    assert(KeepDailyBackups(2).backupsToDelete(backups).map(_.id).sorted == Seq(1, 2))
+    assert(KeepLastBackups(3).backupsToDelete(backups).map(_.id) == Seq(1))
+    assert(BackupRetention.parse("daily:7") == KeepDailyBackups(7))
+    intercept[IllegalArgumentException](BackupRetention.parse("weekly:2"))
+  }
+
   "Restore" should "fail if there are no backups" in {
     val reply = client.restoreFromBackup(RestoreFromBackupRequest())
     assert(!reply.success)
@@ -534,4 +694,78 @@ class FossilDBSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHelpers
     assert(reply.versions.contains(2))
   }
 
+  it should "list versions newest first within the given bounds" in {
+    (0 to 5).foreach(version => client.put(PutRequest(collectionA, aKey, Some(version), testData1)))
+    client.put(PutRequest(collectionA, aNotherKey, Some(3), testData1))
+    val reply = client.listVersions(ListVersionsRequest(collectionA, aKey, oldestVersion = Some(1), newestVersion = Some(4)))
+    assert(reply.versions == Seq(4, 3, 2, 1))
+    val pagedReply = client.listVersions(ListVersionsRequest(collectionA, aKey, limit = Some(2), newestVersion = Some(4)))
+    assert(pagedReply.versions == Seq(4, 3))
+  }
+
+  it should "list versions oldest first if requested" in {
+    (0 to 5).foreach(version => client.put(PutRequest(collectionA, aKey, Some(version), testData1)))
+    client.put(PutRequest(collectionA, aNotherKey, Some(3), testData1))
+    client.put(PutRequest(collectionA, "aKez", Some(0), testData1))
+    val reply = client.listVersions(ListVersionsRequest(collectionA, aKey, oldestFirst = Some(true)))
+    assert(reply.versions == Seq(0, 1, 2, 3, 4, 5))
+    val pagedReply = client.listVersions(ListVersionsRequest(collectionA, aKey, limit = Some(2), oldestVersion = Some(2), oldestFirst = Some(true)))
+    assert(pagedReply.versions == Seq(2, 3))
+  }
+
+  it should "return the value sizes if requested" in {
+    client.put(PutRequest(collectionA, aKey, Some(0), ByteString.copyFromUtf8("a")))
+    client.put(PutRequest(collectionA, aKey, Some(1), ByteString.EMPTY))
+    client.put(PutRequest(collectionA, aKey, Some(2), testData1))
+    val reply = client.listVersions(ListVersionsRequest(collectionA, aKey, includeValueSizes = Some(true)))
+    assert(reply.versions == Seq(2, 1, 0))
+    assert(reply.valueSizes == Seq(testData1.size, 0, 1))
+    assert(client.listVersions(ListVersionsRequest(collectionA, aKey)).valueSizes.isEmpty)
+  }
+
+  "Count" should "count keys and versions of a collection" in {
+    client.put(PutRequest(collectionA, aKey, Some(0), testData1))
+    client.put(PutRequest(collectionA, aKey, Some(1), testData1))
+    client.put(PutRequest(collectionA, aNotherKey, Some(0), testData1))
+    client.put(PutRequest(collectionA, aThirdKey, Some(3), testData1))
+    client.put(PutRequest(collectionB, aKey, Some(0), testData1))
+    val reply = client.count(CountRequest(collectionA))
+    assert(reply.success)
+    assert(reply.keyCount == 3)
+    assert(reply.versionCount == 4)
+    assert(!reply.estimated)
+  }
+
+  it should "count only keys with the prefix" in {
+    client.put(PutRequest(collectionA, aKey, Some(0), testData1))
+    client.put(PutRequest(collectionA, aKey, Some(1), testData1))
+    client.put(PutRequest(collectionA, aNotherKey, Some(0), testData1))
+    client.put(PutRequest(collectionA, aThirdKey, Some(3), testData1))
+    val reply = client.count(CountRequest(collectionA, prefix = Some("aK")))
+    assert(reply.keyCount == 1)
+    assert(reply.versionCount == 2)
+  }
+
+  it should "count the versions of a single key" in {
+    client.put(PutRequest(collectionA, aKey, Some(0), testData1))
+    client.put(PutRequest(collectionA, aKey, Some(2), testData1))
+    client.put(PutRequest(collectionA, aNotherKey, Some(0), testData1))
+    val reply = client.count(CountRequest(collectionA, key = Some(aKey)))
+    assert(reply.keyCount == 1)
+    assert(reply.versionCount == 2)
+    val missingReply = client.count(CountRequest(collectionA, key = Some("missingKey")))
+    assert(missingReply.keyCount == 0)
+    assert(missingReply.versionCount == 0)
+  }
+
+  it should "count exactly if an estimate is requested for a small collection" in {
+    client.put(PutRequest(collectionA, aKey, Some(0), testData1))
+    client.put(PutRequest(collectionA, aKey, Some(1), testData1))
+    client.put(PutRequest(collectionA, aNotherKey, Some(0), testData1))
+    val reply = client.count(CountRequest(collectionA, estimate = Some(true)))
+    assert(reply.keyCount == 2)
+    assert(reply.versionCount == 3)
+    assert(!reply.estimated)
+  }
+
 }
@@ -0,0 +1,111 @@
+package com.scalableminds.fossildb
+
+import java.io.File
+import java.nio.file.Paths
+import com.google.protobuf.ByteString
+import com.scalableminds.fossildb.db.{GroupCommitConfig, StoreManager}
+import com.scalableminds.fossildb.proto.fossildbapi._
+import org.scalatest.BeforeAndAfterEach
+import org.scalatest.flatspec.AnyFlatSpec
+
+import scala.concurrent.duration.Duration
+import scala.concurrent.{Await, ExecutionContext, Future}
+
+class GroupCommitSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHelpers {
+
+  private val testTempDir = "testData8"
+  private val dataDir = Paths.get(testTempDir, "data")
+  private val backupDir = Paths.get(testTempDir, "backup")
+
+  private val collectionA = "collectionA"
+  private val collectionB = "collectionB"
+
+  private val testData1 = "testData1".getBytes
+  private val testData2 = "testData2".getBytes
+
+  private val timeout = Duration(10, "seconds")
+
+  override def beforeEach(): Unit = {
+    deleteRecursively(new File(testTempDir))
+    new File(testTempDir).mkdir()
+  }
+
+  override def afterEach(): Unit = {
+    deleteRecursively(new File(testTempDir))
+  }
+
+  private def withStoreManager[T](block: StoreManager => T): T = {
+    val storeManager = new StoreManager(dataDir, backupDir, List(collectionA, collectionB), None, groupCommit = Map(collectionA -> GroupCommitConfig(1000, 100)))
+    try block(storeManager) finally storeManager.close
+  }
+
+  "GroupCommitConfig" should "parse a window with an optional maximum number of puts" in {
+    assert(GroupCommitConfig.parse("500") == GroupCommitConfig(500, GroupCommitConfig.defaultMaxPuts))
+    assert(GroupCommitConfig.parse("0/10") == GroupCommitConfig(0, 10))
+    assertThrows[IllegalArgumentException](GroupCommitConfig.parse("500/0"))
+    assertThrows[IllegalArgumentException](GroupCommitConfig.parse("-1"))
+  }
+
+  "A store with group commit" should "assign consecutive versions to concurrent puts without a version" in {
+    withStoreManager { storeManager =>
+      val store = storeManager.getStore(collectionA)
+      store.put("aKey", 5, testData1)
+      implicit val ec: ExecutionContext = ExecutionContext.global
+      val versions = Await.result(Future.sequence((0 until 500).map(_ => store.putGrouped("aKey", None, testData2))), timeout)
+      assert(versions.sorted == (6L until 506L))
+      assert(store.newestVersion("aKey").contains(505L))
+      assert(store.withRawRocksIterator(store.getMultipleVersions(_, "aKey"))._2.length == 501)
+    }
+  }
+
+  it should "continue after the versions of puts with a version" in {
+    withStoreManager { storeManager =>
+      val store = storeManager.getStore(collectionA)
+      assert(Await.result(store.putGrouped("aKey", None, testData1), timeout) == 0)
+      assert(Await.result(store.putGrouped("aKey", Some(10), testData1), timeout) == 10)
+      assert(Await.result(store.putGrouped("aKey", Some(3), testData1), timeout) == 3)
+      assert(Await.result(store.putGrouped("aKey", None, testData2), timeout) == 11)
+    }
+  }
+
+  it should "see versions written or deleted without the group commit" in {
+    withStoreManager { storeManager =>
+      val store = storeManager.getStore(collectionA)
+      assert(Await.result(store.putGrouped("aKey", None, testData1), timeout) == 0)
+      store.putMultiple(Seq(("aKey", 7, testData1)))
+      assert(Await.result(store.putGrouped("aKey", None, testData1), timeout) == 8)
+      store.deleteMultipleVersions("aKey", Some(1))
+      assert(Await.result(store.putGrouped("aKey", None, testData2), timeout) == 1)
+      store.deleteAllByPrefix("a")
+      assert(Await.result(store.putGrouped("aKey", None, testData2), timeout) == 0)
+    }
+  }
+
+  it should "write pending puts when closed" in {
+    val storeManager = new StoreManager(dataDir, backupDir, List(collectionA, collectionB), None, groupCommit = Map(collectionA -> GroupCommitConfig(1000000, 100)))
+    val pending = storeManager.getStore(collectionA).putGrouped("aKey", None, testData1)
+    storeManager.close
+    assert(Await.result(pending, timeout) == 0)
+    withStoreManager { reopened =>
+      assert(reopened.getStore(collectionA).getShared("aKey", None).get.value sameElements testData1)
+    }
+  }
+
+  "Put" should "use the group commit of the collection" in {
+    withStoreManager { storeManager =>
+      val pools = new ExecutorPools()
+      val grpcImpl = new FossilDBGrpcImpl(storeManager, pools = pools)
+      val value = ByteString.copyFrom(testData1)
+      assert(Await.result(grpcImpl.put(PutRequest(collectionA, "aKey", None, value)), timeout).success)
+      assert(Await.result(grpcImpl.put(PutRequest(collectionA, "aKey", None, value)), timeout).success)
+      assert(Await.result(grpcImpl.put(PutRequest(collectionB, "aKey", None, value)), timeout).success)
+      assert(storeManager.getStore(collectionA).newestVersion("aKey").contains(1L))
+      assert(storeManager.getStore(collectionB).newestVersion("aKey").contains(0L))
+      val invalidPut = Await.result(grpcImpl.put(PutRequest(collectionA, "aKey", Some(-1), value)), timeout)
+      assert(!invalidPut.success && invalidPut.errorMessage.exists(_.contains("non-negative")))
+      assert(!Await.result(grpcImpl.put(PutRequest("noCollection", "aKey", None, value)), timeout).success)
+      pools.shutdown()
+    }
+  }
+
+}
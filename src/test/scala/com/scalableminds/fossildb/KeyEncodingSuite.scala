@@ -0,0 +1,143 @@
+package com.scalableminds.fossildb
+
+import java.io.File
+import java.nio.file.Paths
+import com.scalableminds.fossildb.db.{BinaryKeyCodec, ExportStatus, LegacyStringKeyCodec, RocksDBManager, RocksDBStore, StoreManager, VersionedKey}
+import org.scalatest.BeforeAndAfterEach
+import org.scalatest.flatspec.AnyFlatSpec
+
+
+class KeyEncodingSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHelpers {
+
+  private val testTempDir = "testData3"
+  private val dataDir = Paths.get(testTempDir, "data")
+  private val exportDir = Paths.get(testTempDir, "export")
+  private val backupDir = Paths.get(testTempDir, "backup")
+
+  private val collectionA = "collectionA"
+  private val collectionB = "collectionB"
+
+  private val columnFamilies = List(collectionA, collectionB)
+
+  private val testData1 = "testData1".getBytes
+  private val testData2 = "testData2".getBytes
+
+  override def beforeEach(): Unit = {
+    deleteRecursively(new File(testTempDir))
+    new File(testTempDir).mkdir()
+  }
+
+  override def afterEach(): Unit = {
+    deleteRecursively(new File(testTempDir))
+  }
+
+  private def writeLegacyEntries(entries: Seq[(String, Long, Array[Byte])]): Unit = {
+    val manager = new RocksDBManager(dataDir, columnFamilies, None)
+    val store = manager.getStoreForColumnFamily(collectionA).get
+    entries.foreach { case (key, version, value) => store.put(LegacyStringKeyCodec.encode(key.getBytes, version), value) }
+    manager.close()
+  }
+
+
+  "The key codecs" should "decode what they encode, newest versions first" in {
+    Seq(BinaryKeyCodec, LegacyStringKeyCodec).foreach { codec =>
+      val key = "a/key"
+      val encoded = Seq(0L, 1L, 255L, 256L, Long.MaxValue).map(codec.encode(key.getBytes, _))
+      assert(encoded.map(codec.decode) == Seq(0L, 1L, 255L, 256L, Long.MaxValue).map(v => Some(VersionedKey(key, v))))
+      assert(encoded.reverse.sliding(2).forall { case Seq(a, b) => RocksDBStore.compareBytes(a, b) < 0 })
+    }
+  }
+
+  it should "keep all versions of a key between the version prefix and the seek position past it" in {
+    Seq(BinaryKeyCodec, LegacyStringKeyCodec).foreach { codec =>
+      val encoded = codec.encode("key".getBytes, 5)
+      assert(RocksDBStore.startsWith(encoded, codec.versionPrefix("key".getBytes)))
+      assert(RocksDBStore.compareBytes(encoded, codec.seekPastVersionsOf("key".getBytes)) < 0)
+      assert(RocksDBStore.compareBytes(codec.seekPastVersionsOf("key".getBytes), codec.encode("keyz".getBytes, 5)) < 0)
+    }
+  }
+
+  "Opening a store" should "use the binary key encoding for new column families" in {
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None)
+    assert(storeManager.getStore(collectionA).keyCodec == BinaryKeyCodec)
+    storeManager.close
+  }
+
+  it should "detect and read string-encoded column families" in {
+    writeLegacyEntries(Seq(("aKey", 0, testData1), ("aKey", 1, testData2), ("bKey", 3, testData1)))
+
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None)
+    val store = storeManager.getStore(collectionA)
+    assert(store.keyCodec == LegacyStringKeyCodec)
+    assert(storeManager.getStore(collectionB).keyCodec == BinaryKeyCodec)
+    store.put("cKey", 2, testData2)
+    store.withRawRocksIterator { rocksIt =>
+      assert(store.get(rocksIt, "aKey", None).map(_.version).contains(1L))
+      assert(store.get(rocksIt, "aKey", Some(0)).map(_.value.toSeq).contains(testData1.toSeq))
+      assert(store.listKeys(rocksIt, None, None, None) == Seq("aKey", "bKey", "cKey"))
+      assert(store.listVersions(rocksIt, "aKey", None, None) == Seq(1L, 0L))
+    }
+    storeManager.close
+  }
+
+  "ExportDB" should "convert string-encoded column families to the binary key encoding" in {
+    writeLegacyEntries(Seq(("aKey", 0, testData1), ("aKey", 1, testData2), ("bKey", 3, testData1)))
+
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None)
+    storeManager.exportDB(exportDir.toString, None)
+    assert(storeManager.exportStatus.state == ExportStatus.succeeded)
+    storeManager.close
+
+    val exportedManager = new StoreManager(exportDir, backupDir, columnFamilies, None)
+    val store = exportedManager.getStore(collectionA)
+    assert(store.keyCodec == BinaryKeyCodec)
+    store.withRawRocksIterator { rocksIt =>
+      val (keys, values, versions) = store.getMultipleKeys(rocksIt, None, None, None, None)
+      assert(keys == Seq("aKey", "bKey"))
+      assert(values.map(_.toSeq) == Seq(testData2.toSeq, testData1.toSeq))
+      assert(versions == Seq(1L, 3L))
+      assert(store.listVersions(rocksIt, "aKey", None, None) == Seq(1L, 0L))
+    }
+    exportedManager.close
+  }
+
+  it should "take a checkpoint if the column families keep their key encoding and options" in {
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None)
+    storeManager.getStore(collectionA).put("aKey", 0, testData1)
+    storeManager.exportDB(exportDir.toString, None)
+    assert(storeManager.exportStatus.method == ExportStatus.checkpointMethod)
+    assert(storeManager.exportStatus.state == ExportStatus.succeeded)
+    storeManager.close
+
+    val exportedManager = new StoreManager(exportDir, backupDir, columnFamilies, None)
+    val store = exportedManager.getStore(collectionA)
+    store.withRawRocksIterator { rocksIt =>
+      assert(store.get(rocksIt, "aKey", Some(0)).map(_.value.toSeq).contains(testData1.toSeq))
+    }
+    exportedManager.close
+  }
+
+  it should "ingest sorted SST files if the new db gets another options file" in {
+    val optionsFile = new File(testTempDir, "exportOptions.ini")
+    writeToFile(optionsFile, "[Version]\n  rocksdb_version=5.11.3\n  options_file_version=1.1\n\n[DBOptions]\n\n[CFOptions \"default\"]\n  compression=kNoCompression\n\n")
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None)
+    storeManager.getStore(collectionA).putMultiple(Seq(("aKey", 0, testData1), ("aKey", 1, testData2), ("bKey", 3, testData1)))
+    storeManager.exportDB(exportDir.toString, Some(optionsFile.getPath))
+    val status = storeManager.exportStatus
+    assert(status.method == ExportStatus.sstMethod)
+    assert(status.entriesWritten == 3)
+    storeManager.close
+    assert(!new File(exportDir.toFile, RocksDBManager.exportSstDirName).exists)
+
+    val exportedManager = new StoreManager(exportDir, backupDir, columnFamilies, None)
+    val store = exportedManager.getStore(collectionA)
+    store.withRawRocksIterator { rocksIt =>
+      assert(store.listKeys(rocksIt, None, None, None) == Seq("aKey", "bKey"))
+      assert(store.listVersions(rocksIt, "aKey", None, None) == Seq(1L, 0L))
+      assert(store.get(rocksIt, "bKey", None).map(_.value.toSeq).contains(testData1.toSeq))
+    }
+    assert(exportedManager.compressionStats(Some(collectionA)).head.entries == 3)
+    exportedManager.close
+  }
+
+}
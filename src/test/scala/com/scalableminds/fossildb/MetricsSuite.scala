@@ -0,0 +1,86 @@
+package com.scalableminds.fossildb
+
+import java.io.File
+import java.net.URI
+import java.nio.file.Paths
+import com.google.protobuf.ByteString
+import com.scalableminds.fossildb.db.StoreManager
+import com.scalableminds.fossildb.proto.fossildbapi._
+import io.grpc.netty.NettyChannelBuilder
+import org.scalatest.BeforeAndAfterEach
+import org.scalatest.flatspec.AnyFlatSpec
+
+import scala.concurrent.ExecutionContext
+import scala.io.Source
+
+class MetricsSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHelpers {
+  private val testTempDir = "testData4"
+  private val dataDir = Paths.get(testTempDir, "data")
+  private val backupDir = Paths.get(testTempDir, "backup")
+
+  private val port = 21506
+  private val metricsPort = 21507
+  private var serverOpt: Option[FossilDBServer] = None
+  private val channel = NettyChannelBuilder.forAddress("127.0.0.1", port).usePlaintext().build
+  private val client = FossilDBGrpc.blockingStub(channel)
+  private val collectionA = "collectionA"
+
+  override def beforeEach(): Unit = {
+    deleteRecursively(new File(testTempDir))
+    new File(testTempDir).mkdir()
+    val storeManager = new StoreManager(dataDir, backupDir, List(collectionA), None)
+    serverOpt = Some(new FossilDBServer(storeManager, port, ExecutionContext.global, Some(metricsPort)))
+    serverOpt.foreach(_.start())
+  }
+
+  override def afterEach(): Unit = {
+    serverOpt.foreach(_.stop())
+    deleteRecursively(new File(testTempDir))
+  }
+
+  private def scrape(): String = {
+    val source = Source.fromURL(URI.create(s"http://127.0.0.1:$metricsPort/metrics").toURL)
+    try source.mkString finally source.close()
+  }
+
+  "Histogram" should "report cumulative bucket counts" in {
+    val histogram = new Histogram(Seq(1, 10))
+    Seq(0.5, 2.0, 5.0, 20.0).foreach(histogram.observe)
+    val (buckets, sum, count) = histogram.snapshot
+    assert(buckets == Seq((1.0, 1L), (10.0, 3L)))
+    assert(sum == 27.5)
+    assert(count == 4)
+  }
+
+  "Metrics" should "count calls, bytes and errors per rpc and collection" in {
+    client.put(PutRequest(collectionA, "aKey", Some(0), ByteString.copyFromUtf8("testData1")))
+    client.get(GetRequest(collectionA, "aKey", Some(0)))
+    client.get(GetRequest(collectionA, "missingKey", Some(0)))
+    client.get(GetRequest("notACollection", "aKey", Some(0)))
+    val metrics = scrape()
+    assert(metrics.contains("""fossildb_rpc_duration_seconds_count{rpc="Get",collection="collectionA"} 2"""))
+    assert(metrics.contains("""fossildb_rpc_duration_seconds_count{rpc="Put",collection="collectionA"} 1"""))
+    assert(metrics.contains("""fossildb_rpc_errors_total{rpc="Get",collection="collectionA"} 1"""))
+    assert(metrics.contains("""fossildb_rpc_errors_total{rpc="Get",collection="unknown"} 1"""))
+    assert(!metrics.contains("notACollection"))
+    assert(metrics.contains("""fossildb_rpc_duration_seconds_bucket{rpc="Put",collection="collectionA",le="+Inf"} 1"""))
+  }
+
+  it should "include sampled RocksDB properties" in {
+    // The first sample is taken in the background right after the start
+    val metrics = Iterator.continually { Thread.sleep(50); scrape() }.take(100).find(_.contains("fossildb_rocksdb_")).getOrElse("")
+    assert(metrics.contains("""fossildb_rocksdb_estimate_pending_compaction_bytes{collection="collectionA"}"""))
+    assert(metrics.contains("fossildb_rocksdb_num_running_compactions "))
+    assert(metrics.contains("fossildb_block_cache_capacity_bytes "))
+    assert(metrics.contains("fossildb_rocksdb_stall_micros_total "))
+  }
+
+  it should "include the state of the request executors" in {
+    client.get(GetRequest(collectionA, "missingKey", Some(0), mayBeEmpty = Some(true)))
+    val metrics = scrape()
+    assert(metrics.contains("""fossildb_executor_queue_size{pool="read"} 0"""))
+    assert(metrics.contains("""fossildb_executor_rejected_total{pool="write"} 0"""))
+    assert(metrics.contains("""fossildb_executor_completed_total{pool="read"}"""))
+  }
+
+}
@@ -0,0 +1,96 @@
+package com.scalableminds.fossildb
+
+import java.io.File
+import java.nio.file.Paths
+import java.util.concurrent.{CountDownLatch, Executors, TimeUnit}
+import com.scalableminds.fossildb.db.{ReadCache, StoreManager, VersionedKey, VersionedKeyValuePair}
+import org.scalatest.BeforeAndAfterEach
+import org.scalatest.flatspec.AnyFlatSpec
+
+import scala.concurrent.duration.Duration
+import scala.concurrent.{Await, ExecutionContext, Future}
+
+class ReadCacheSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHelpers {
+
+  private val testTempDir = "testData7"
+  private val dataDir = Paths.get(testTempDir, "data")
+  private val backupDir = Paths.get(testTempDir, "backup")
+
+  private val collectionA = "collectionA"
+  private val collectionB = "collectionB"
+
+  private val testData1 = "testData1".getBytes
+  private val testData2 = "testData2".getBytes
+
+  override def beforeEach(): Unit = {
+    deleteRecursively(new File(testTempDir))
+    new File(testTempDir).mkdir()
+  }
+
+  override def afterEach(): Unit = {
+    deleteRecursively(new File(testTempDir))
+  }
+
+  private def pair(version: Long, value: Array[Byte]) = Some(VersionedKeyValuePair(VersionedKey("aKey", version), value))
+
+  "ReadCache" should "share one read between concurrent identical lookups" in {
+    val cache = new ReadCache(0)
+    val readStarted = new CountDownLatch(1)
+    val finishRead = new CountDownLatch(1)
+    val executor = Executors.newFixedThreadPool(2)
+    implicit val ec: ExecutionContext = ExecutionContext.fromExecutor(executor)
+    try {
+      val leader = Future(cache.get("aKey", None) {
+        readStarted.countDown()
+        finishRead.await(10, TimeUnit.SECONDS)
+        pair(0, testData1)
+      })
+      readStarted.await(10, TimeUnit.SECONDS)
+      val follower = Future(cache.get("aKey", None)(throw new IllegalStateException("not coalesced")))
+      while (cache.stats.coalesced == 0) Thread.sleep(1)
+      finishRead.countDown()
+      assert(Await.result(leader, Duration(10, TimeUnit.SECONDS)).get.value sameElements testData1)
+      assert(Await.result(follower, Duration(10, TimeUnit.SECONDS)).get.value sameElements testData1)
+      assert(cache.stats.misses == 1 && cache.stats.coalesced == 1 && cache.stats.entries == 0)
+    } finally executor.shutdown()
+  }
+
+  it should "not cache the result of a read that overlapped a write" in {
+    val cache = new ReadCache(1024 * 1024)
+    cache.get("aKey", None) {
+      cache.invalidate("aKey")
+      pair(0, testData1)
+    }
+    assert(cache.get("aKey", None)(pair(1, testData2)).get.version == 1)
+    assert(cache.get("aKey", None)(throw new IllegalStateException("not cached")).get.version == 1)
+    assert(cache.stats.hits == 1 && cache.stats.misses == 2)
+  }
+
+  it should "evict the least recently used entries" in {
+    val cache = new ReadCache(1000)
+    (0 until 10).foreach(i => cache.get(s"key$i", None)(pair(i, new Array[Byte](100))))
+    assert(cache.stats.entries < 10 && cache.stats.bytes <= 1000)
+    assert(cache.get("key9", None)(throw new IllegalStateException("not cached")).get.version == 9)
+  }
+
+  "A store with a read cache" should "return written values after puts and deletes" in {
+    val storeManager = new StoreManager(dataDir, backupDir, List(collectionA, collectionB), None, readCacheBytes = Map(collectionA -> 1024L * 1024))
+    try {
+      val store = storeManager.getStore(collectionA)
+      store.put("aKey", 0, testData1)
+      assert(store.getShared("aKey", None).get.value sameElements testData1)
+      store.put("aKey", 1, testData2)
+      assert(store.getShared("aKey", None).get.value sameElements testData2)
+      assert(store.getShared("aKey", Some(0)).get.value sameElements testData1)
+      store.delete("aKey", 1)
+      assert(store.getShared("aKey", None).get.version == 0)
+      store.deleteAllByPrefix("a")
+      assert(store.getShared("aKey", None).isEmpty)
+      assert(store.getShared("aKey", None).isEmpty)
+      val stats = storeManager.cacheStats.readCaches.toMap
+      assert(stats(collectionA).hits == 1)
+      assert(stats(collectionB).misses == 0)
+    } finally storeManager.close
+  }
+
+}
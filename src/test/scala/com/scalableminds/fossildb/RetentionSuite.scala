@@ -0,0 +1,101 @@
+package com.scalableminds.fossildb
+
+import java.io.File
+import java.nio.file.Paths
+import com.scalableminds.fossildb.db.{KeepEveryNthVersion, KeepNewestVersions, KeepRecentVersions, RetentionPolicy, StoreManager}
+import org.scalatest.BeforeAndAfterEach
+import org.scalatest.flatspec.AnyFlatSpec
+
+class RetentionSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHelpers {
+
+  private val testTempDir = "testData5"
+  private val dataDir = Paths.get(testTempDir, "data")
+  private val backupDir = Paths.get(testTempDir, "backup")
+
+  private val collectionA = "collectionA"
+  private val collectionB = "collectionB"
+
+  private val columnFamilies = List(collectionA, collectionB)
+
+  private val testData = "testData".getBytes
+
+  override def beforeEach(): Unit = {
+    deleteRecursively(new File(testTempDir))
+    new File(testTempDir).mkdir()
+  }
+
+  override def afterEach(): Unit = {
+    deleteRecursively(new File(testTempDir))
+  }
+
+  private def withStoreManager(policies: Map[String, String])(block: StoreManager => Unit): Unit = {
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None, retentionPolicies = policies.map { case (cf, spec) => cf -> RetentionPolicy.parse(spec) })
+    try block(storeManager) finally storeManager.close
+  }
+
+  private def versionsOf(storeManager: StoreManager, collection: String, key: String): Seq[Long] = {
+    val store = storeManager.getStore(collection)
+    store.withRawRocksIterator(rocksIt => store.listVersions(rocksIt, key, None, None))
+  }
+
+  "RetentionPolicy" should "parse rules joined by +" in {
+    assert(RetentionPolicy.parse("newest:10+every:100") == RetentionPolicy(Seq(KeepNewestVersions(10), KeepEveryNthVersion(100))))
+    assert(RetentionPolicy.parse("newest:10+every:100").toString == "newest:10+every:100")
+    assert(RetentionPolicy.parse("recent:50") == RetentionPolicy(Seq(KeepRecentVersions(50))))
+    intercept[IllegalArgumentException](RetentionPolicy.parse("oldest:10"))
+    intercept[IllegalArgumentException](RetentionPolicy.parse("newest:0"))
+  }
+
+  "Applying retention" should "keep only the newest versions of each key" in {
+    withStoreManager(Map(collectionA -> "newest:3")) { storeManager =>
+      val store = storeManager.getStore(collectionA)
+      store.putMultiple((0L to 9L).map(("aKey", _, testData)) ++ (0L to 1L).map(("bKey", _, testData)) ++ (0L to 5L).map(("cKey", _, testData)))
+      assert(storeManager.applyRetention(None) == 7 + 3)
+      assert(versionsOf(storeManager, collectionA, "aKey") == Seq(9L, 8L, 7L))
+      assert(versionsOf(storeManager, collectionA, "bKey") == Seq(1L, 0L))
+      assert(versionsOf(storeManager, collectionA, "cKey") == Seq(5L, 4L, 3L))
+      assert(storeManager.applyRetention(Some(collectionA)) == 0)
+    }
+  }
+
+  it should "keep every k-th version in addition to the other rules" in {
+    withStoreManager(Map(collectionA -> "newest:1+every:4", collectionB -> "recent:2")) { storeManager =>
+      storeManager.getStore(collectionA).putMultiple((0L to 9L).map(("aKey", _, testData)))
+      storeManager.getStore(collectionB).putMultiple((0L to 9L).map(("aKey", _, testData)))
+      storeManager.applyRetention(None)
+      assert(versionsOf(storeManager, collectionA, "aKey") == Seq(9L, 8L, 4L, 0L))
+      assert(versionsOf(storeManager, collectionB, "aKey") == Seq(9L, 8L))
+    }
+  }
+
+  it should "keep the versions less than d below the newest version of each key" in {
+    withStoreManager(Map(collectionA -> "recent:3")) { storeManager =>
+      val store = storeManager.getStore(collectionA)
+      store.putMultiple((0L to 9L).map(("aKey", _, testData)) ++ (100L to 105L).map(("bKey", _, testData)) ++
+        (0L to 1L).map(("cKey", _, testData)) ++ Seq(0L, 5L, 6L, 20L).map(("dKey", _, testData)))
+      assert(storeManager.applyRetention(Some(collectionA)) == 7 + 3 + 3)
+      assert(versionsOf(storeManager, collectionA, "aKey") == Seq(9L, 8L, 7L))
+      assert(versionsOf(storeManager, collectionA, "bKey") == Seq(105L, 104L, 103L))
+      // The newest version is below d, the rule is relative to it
+      assert(versionsOf(storeManager, collectionA, "cKey") == Seq(1L, 0L))
+      assert(versionsOf(storeManager, collectionA, "dKey") == Seq(20L))
+    }
+  }
+
+  it should "run periodically" in {
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None,
+      retentionPolicies = Map(collectionA -> RetentionPolicy.parse("newest:1")), retentionSweepIntervalSeconds = 1)
+    try {
+      storeManager.getStore(collectionA).putMultiple((0L to 4L).map(("aKey", _, testData)))
+      Thread.sleep(3000)
+      assert(versionsOf(storeManager, collectionA, "aKey") == Seq(4L))
+    } finally storeManager.close
+  }
+
+  it should "fail for collections without a retention policy" in {
+    withStoreManager(Map(collectionA -> "newest:3")) { storeManager =>
+      intercept[NoSuchElementException](storeManager.applyRetention(Some(collectionB)))
+    }
+  }
+
+}
@@ -2,8 +2,8 @@ package com.scalableminds.fossildb
 
 import java.io.File
 import java.nio.file.Paths
-import com.scalableminds.fossildb.db.StoreManager
-import org.rocksdb.{ColumnFamilyDescriptor, ConfigOptions, DBOptions, Env}
+import com.scalableminds.fossildb.db.{CompressionConfig, StoreManager}
+import org.rocksdb.{ColumnFamilyDescriptor, CompressionType, ConfigOptions, DBOptions, Env}
 import org.scalatest.BeforeAndAfterEach
 import org.scalatest.flatspec.AnyFlatSpec
 
@@ -65,5 +65,97 @@ class RocksOptionsSuite extends AnyFlatSpec with BeforeAndAfterEach with TestHel
     }
   }
 
+  "CompressionConfig" should "parse codecs, bottommost codecs and dictionary sizes" in {
+    assert(CompressionConfig.parse("zstd") == CompressionConfig(CompressionType.ZSTD_COMPRESSION, CompressionType.ZSTD_COMPRESSION))
+    assert(CompressionConfig.parse("lz4/zstd:16384") == CompressionConfig(CompressionType.LZ4_COMPRESSION, CompressionType.ZSTD_COMPRESSION, 16384))
+    assert(CompressionConfig.parse("LZ4/none") == CompressionConfig(CompressionType.LZ4_COMPRESSION, CompressionType.NO_COMPRESSION))
+  }
+
+  it should "reject unknown codecs and dictionaries without zstd" in {
+    assertThrows[IllegalArgumentException](CompressionConfig.parse("gzip"))
+    assertThrows[IllegalArgumentException](CompressionConfig.parse("lz4/zstd/zstd"))
+    assertThrows[IllegalArgumentException](CompressionConfig.parse("lz4:16384"))
+    assertThrows[IllegalArgumentException](CompressionConfig.parse("zstd:0"))
+  }
+
+  "Initializing the StoreManager with compression" should "compress the bottommost level of the configured column family" in {
+    val compression = Map(collectionA -> CompressionConfig.parse("lz4/zstd:4096"), collectionB -> CompressionConfig.parse("none"))
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None, compression)
+    val value = ("compressible " * 100).getBytes
+    columnFamilies.foreach { cf =>
+      storeManager.getStore(cf).putMultiple((0 until 1000).map(i => (s"key$i", 0L, value)))
+    }
+    storeManager.compactAllData()
+
+    val Seq(statsA, statsB) = storeManager.compressionStats(None)
+    assert(statsA.columnFamily == collectionA)
+    assert(statsA.entries == 1000)
+    assert(statsA.compressions == Seq("ZSTD"))
+    assert(statsA.compressedBytes * 10 < statsA.rawBytes)
+    assert(statsB.compressions == Seq("NoCompression"))
+    assert(statsB.compressedBytes * 2 > statsB.rawBytes)
+    assert(storeManager.compressionStats(Some(collectionB)) == Seq(statsB))
+    storeManager.close
+  }
+
+  it should "fail for unknown column families" in {
+    assertThrows[Exception] {
+      new StoreManager(dataDir, backupDir, columnFamilies, None, Map("collectionC" -> CompressionConfig.parse("zstd")))
+    }
+  }
+
+  "Initializing the StoreManager with bloom prefix lengths" should "find all versions of keys longer and shorter than the prefix" in {
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None, blockCacheBytes = 8L * 1024 * 1024,
+      bloomPrefixLengths = Map(collectionA -> 4))
+    val store = storeManager.getStore(collectionA)
+    val keys = Seq("a", "abc", "abcd", "abcde", "abcdef", "bcdefg")
+    keys.foreach(key => store.putMultiple(Seq((key, 0L, key.getBytes), (key, 1L, key.getBytes))))
+    // Move the entries into an SST file, which has the bloom filter
+    storeManager.compactAllData()
+    keys.foreach { key =>
+      assert(store.withKeyIterator(key)(store.get(_, key)).map(_.version).contains(1L))
+      assert(store.withKeyIterator(key)(store.get(_, key, Some(0L))).map(_.version).contains(0L))
+      assert(store.withKeyIterator(key)(store.getMultipleVersions(_, key))._2 == List(1L, 0L))
+    }
+    Seq("ab", "abcdx", "abcdefg", "xyz").foreach { key =>
+      assert(store.withKeyIterator(key)(store.get(_, key)).isEmpty)
+    }
+
+    val stats = storeManager.cacheStats
+    assert(stats.blockCacheCapacity == 8L * 1024 * 1024)
+    assert(stats.blockCacheUsage > 0)
+    val tickers = stats.tickers.toMap
+    assert(tickers("BLOCK_CACHE_HIT") + tickers("BLOCK_CACHE_MISS") > 0)
+    storeManager.close
+  }
+
+  it should "list, count and scan all keys across prefixes after compaction" in {
+    val storeManager = new StoreManager(dataDir, backupDir, columnFamilies, None, bloomPrefixLengths = Map(collectionA -> 4))
+    val store = storeManager.getStore(collectionA)
+    val keys = Seq("a", "ab") ++ (0 until 200).map(i => f"$i%03d-aKey")
+    keys.grouped(50).foreach { group =>
+      store.putMultiple(group.flatMap(key => Seq((key, 0L, key.getBytes), (key, 1L, key.getBytes))))
+      storeManager.compactAllData()
+    }
+    store.withRawRocksIterator { rocksIt =>
+      val listed = store.listKeys(rocksIt, None, None, None)
+      assert(listed.length == keys.length && listed.toSet == keys.toSet)
+    }
+    store.withRawRocksIterator(rocksIt => assert(store.listKeys(rocksIt, None, Some("049-aKey"), None).length == 152))
+    store.withRawRocksIterator(rocksIt => assert(store.listKeys(rocksIt, None, None, Some("01")).length == 10))
+    store.withRawRocksIterator { rocksIt =>
+      val count = store.count(rocksIt, None)
+      assert(count.keys == keys.length && count.versions == 2 * keys.length)
+    }
+    store.withRawRocksIterator(rocksIt => assert(store.scan(rocksIt, None, None, None, allVersions = true).length == 2 * keys.length))
+    store.withRawRocksIterator(rocksIt => assert(store.getMultipleKeys(rocksIt, None, limit = None)._1.length == keys.length))
+    storeManager.close
+  }
+
+  it should "fail for unknown column families" in {
+    assertThrows[Exception] {
+      new StoreManager(dataDir, backupDir, columnFamilies, None, bloomPrefixLengths = Map("collectionC" -> 4))
+    }
+  }
 
 }
@@ -0,0 +1,63 @@
+package com.scalableminds.fossildb.benchmark
+
+import com.scalableminds.fossildb.TestHelpers
+
+import java.io.File
+import java.lang.management.ManagementFactory
+
+/*
+   A minimal JMH-style harness: every benchmark body runs for a number of warmup iterations that are discarded,
+   then for a number of measured iterations. Reported are the mean throughput and its spread.
+   Benchmarks are plain main objects, run them with e.g.
+     sbt "Test/runMain com.scalableminds.fossildb.benchmark.ListKeysBenchmark"
+ */
+trait BenchmarkHelpers extends TestHelpers {
+
+  protected val warmupIterations: Int = 3
+  protected val measurementIterations: Int = 5
+
+  protected def withTempDir[T](name: String)(block: File => T): T = {
+    val dir = new File(name)
+    deleteRecursively(dir)
+    dir.mkdirs()
+    try {
+      block(dir)
+    } finally {
+      deleteRecursively(dir)
+    }
+  }
+
+  // The block returns the number of operations it performed
+  protected def measure(label: String, unit: String)(block: => Long): Double = {
+    (1 to warmupIterations).foreach(_ => block)
+    val throughputs = (1 to measurementIterations).map { _ =>
+      val before = System.nanoTime()
+      val ops = block
+      ops / ((System.nanoTime() - before) / 1e9)
+    }
+    val mean = throughputs.sum / throughputs.length
+    val error = math.sqrt(throughputs.map(t => (t - mean) * (t - mean)).sum / throughputs.length)
+    println(f"$label%-50s $mean%14.1f ± $error%12.1f $unit/s")
+    mean
+  }
+
+  private lazy val threadMXBean = ManagementFactory.getThreadMXBean.asInstanceOf[com.sun.management.ThreadMXBean]
+
+  private def allocatedBytes: Long = threadMXBean.getThreadAllocatedBytes(Thread.currentThread().getId)
+
+  // The block returns the number of payload bytes it served. Reported are the heap bytes allocated per GB of payload
+  protected def measureAllocations(label: String)(block: => Long): Double = {
+    val gigabyte = 1024.0 * 1024 * 1024
+    (1 to warmupIterations).foreach(_ => block)
+    val ratios = (1 to measurementIterations).map { _ =>
+      val before = allocatedBytes
+      val served = block
+      (allocatedBytes - before) / (served / gigabyte)
+    }
+    val mean = ratios.sum / ratios.length
+    val error = math.sqrt(ratios.map(r => (r - mean) * (r - mean)).sum / ratios.length)
+    println(f"$label%-50s ${mean / gigabyte}%14.3f ± ${error / gigabyte}%12.3f GB allocated/GB served")
+    mean
+  }
+
+}
@@ -0,0 +1,64 @@
+package com.scalableminds.fossildb.benchmark
+
+import com.scalableminds.fossildb.db.{StoreManager, VersionedKeyCodec, VersionedKeyValueStore}
+import org.rocksdb.RocksIterator
+
+import java.nio.file.Paths
+
+/*
+   Measures ListKeys throughput (keys listed per second) depending on the number of versions stored per key,
+   comparing the single-seek KeyOnlyIterator with the previous approach of two seeks per listed key.
+ */
+object ListKeysBenchmark extends BenchmarkHelpers {
+
+  private val collection = "benchmark"
+  private val keyCount = 2000
+  private val versionsPerKey = Seq(1, 10, 100, 1000)
+  private val value = new Array[Byte](16)
+
+  def main(args: Array[String]): Unit = {
+    versionsPerKey.foreach { versions =>
+      withTempDir("benchmarkData") { dir =>
+        val storeManager = new StoreManager(Paths.get(dir.getPath, "data"), Paths.get(dir.getPath, "backup"), List(collection), None)
+        val store = storeManager.getStore(collection)
+        fill(store, versions)
+        measure(s"listKeys, $versions versions per key", "keys") {
+          store.withRawRocksIterator(rocksIt => store.listKeys(rocksIt, None, None, None)).length.toLong
+        }
+        measure(s"listKeys (two seeks per key), $versions versions per key", "keys") {
+          store.withRawRocksIterator(rocksIt => listKeysWithTwoSeeksPerKey(rocksIt, store.keyCodec)).toLong
+        }
+        storeManager.close
+      }
+    }
+  }
+
+  private def fill(store: VersionedKeyValueStore, versions: Int): Unit =
+    for {
+      keyIndex <- 0 until keyCount
+      version <- 0 until versions
+    } store.put(f"key$keyIndex%08d", version, value)
+
+  // The previous KeyOnlyIterator: seek to the oldest version of the current key in both hasNext and next
+  private def listKeysWithTwoSeeksPerKey(rocksIt: RocksIterator, codec: VersionedKeyCodec): Int = {
+    var currentKey: Option[Array[Byte]] = None
+    var count = 0
+
+    def keyOf(compositeKey: Array[Byte]): Array[Byte] = compositeKey.take(codec.keyLength(compositeKey))
+
+    def seekToNext(): Unit = {
+      rocksIt.seek(currentKey.map(codec.encode(_, 0)).getOrElse(Array.emptyByteArray))
+      if (rocksIt.isValid && currentKey.exists(_ sameElements keyOf(rocksIt.key()))) rocksIt.next()
+    }
+
+    while ({ seekToNext(); rocksIt.isValid }) {
+      seekToNext()
+      val key = keyOf(rocksIt.key())
+      codec.decodeKey(key, key.length)
+      currentKey = Some(key)
+      count += 1
+    }
+    count
+  }
+
+}
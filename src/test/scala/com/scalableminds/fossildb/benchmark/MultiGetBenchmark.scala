@@ -0,0 +1,49 @@
+package com.scalableminds.fossildb.benchmark
+
+import com.scalableminds.fossildb.db.{StoreManager, VersionedKeyValueStore}
+
+import java.nio.file.Paths
+import scala.util.Random
+
+/*
+   Measures GetMultipleKeysByList lookups (keys per second) for requests of a few hundred random keys,
+   comparing the batched path with the previous loop that opens one iterator per requested key.
+ */
+object MultiGetBenchmark extends BenchmarkHelpers {
+
+  private val collection = "benchmark"
+  private val keyCount = 100000
+  private val versionsPerKey = 10
+  private val keysPerRequest = 300
+  private val requestsPerIteration = 100
+  private val value = new Array[Byte](1024)
+
+  def main(args: Array[String]): Unit = {
+    withTempDir("benchmarkData") { dir =>
+      val storeManager = new StoreManager(Paths.get(dir.getPath, "data"), Paths.get(dir.getPath, "backup"), List(collection), None)
+      val store = storeManager.getStore(collection)
+      fill(store)
+      val random = new Random(0)
+      val requests = Seq.fill(requestsPerIteration)(Seq.fill(keysPerRequest)(keyName(random.nextInt(keyCount))))
+
+      Seq(None, Some(versionsPerKey - 1L), Some(versionsPerKey + 5L)).foreach { version =>
+        measure(s"batched lookup, version $version", "keys") {
+          requests.map(keys => store.getMultipleKeysByList(keys, version).count(_.isDefined).toLong).sum
+        }
+        measure(s"one iterator per key, version $version", "keys") {
+          requests.map(keys => keys.map(key => store.withRawRocksIterator(rocksIt => store.get(rocksIt, key, version))).count(_.isDefined).toLong).sum
+        }
+      }
+      storeManager.close
+    }
+  }
+
+  private def keyName(index: Int): String = f"key$index%08d"
+
+  private def fill(store: VersionedKeyValueStore): Unit =
+    for {
+      keyIndex <- 0 until keyCount
+      version <- 0 until versionsPerKey
+    } store.put(keyName(keyIndex), version, value)
+
+}
@@ -0,0 +1,65 @@
+package com.scalableminds.fossildb.benchmark
+
+import com.google.protobuf.ByteString
+import com.scalableminds.fossildb.ByteStringConversions
+import com.scalableminds.fossildb.db.StoreManager
+import com.scalableminds.fossildb.proto.fossildbapi.{GetReply, PutRequest}
+
+import java.io.OutputStream
+import java.nio.file.Paths
+import scala.util.Random
+
+/*
+   Measures the heap allocations per GB of values served by Get and written by Put, for values of a few MB,
+   comparing the zero-copy conversions with the previous ByteString.copyFrom / toByteArray copies.
+   Get replies are serialized to a discarding stream, as gRPC would serialize them to the network.
+   Put requests are parsed from their wire format once up front, as gRPC does before calling the service.
+ */
+object ValueTransferBenchmark extends BenchmarkHelpers {
+
+  private val collection = "benchmark"
+  private val valueCount = 64
+  private val valueSize = 4 * 1024 * 1024 // 4MB
+
+  def main(args: Array[String]): Unit = {
+    withTempDir("benchmarkData") { dir =>
+      val storeManager = new StoreManager(Paths.get(dir.getPath, "data"), Paths.get(dir.getPath, "backup"), List(collection), None)
+      val store = storeManager.getStore(collection)
+      val random = new Random(0)
+      val requests = (0 until valueCount).map { i =>
+        val value = new Array[Byte](valueSize)
+        random.nextBytes(value)
+        PutRequest.parseFrom(PutRequest(collection, keyName(i), Some(0L), ByteString.copyFrom(value)).toByteArray)
+      }
+
+      Seq[(String, ByteString => Array[Byte])](
+        ("put, zero-copy", ByteStringConversions.toByteArray),
+        ("put, toByteArray", _.toByteArray)
+      ).foreach { case (label, toByteArray) =>
+        measureAllocations(label) {
+          requests.map { req =>
+            store.put(req.key, req.getVersion, toByteArray(req.value))
+            req.value.size.toLong
+          }.sum
+        }
+      }
+
+      Seq[(String, Array[Byte] => ByteString)](
+        ("get, zero-copy", ByteStringConversions.wrap),
+        ("get, copyFrom", ByteString.copyFrom(_: Array[Byte]))
+      ).foreach { case (label, toByteString) =>
+        measureAllocations(label) {
+          (0 until valueCount).map { i =>
+            val pair = store.withRawRocksIterator(rocksIt => store.get(rocksIt, keyName(i), None)).get
+            GetReply(success = true, None, toByteString(pair.value), pair.version).writeTo(OutputStream.nullOutputStream())
+            pair.value.length.toLong
+          }.sum
+        }
+      }
+      storeManager.close
+    }
+  }
+
+  private def keyName(index: Int): String = f"key$index%08d"
+
+}